@@ -1,11 +1,22 @@
+import collections
 import datetime
 import threading
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.base import JobLookupError
 import traceback, os
+import hashlib
+import json
+import time
 import pytz
 from tzlocal import get_localzone
+from status_stream import status
+import continuous_capture
+from broadcast_store import BroadcastStore
+import state_store
+import streams
+from postprocess import postprocessor
+from metrics import Family, Histogram, BUCKETS
 
 scheduler = BackgroundScheduler(daemon=True)
 scheduler.start()
@@ -14,14 +25,29 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 SECONDS_WITHIN_START_IMMEDIATELY = 3
-SECONDS_RELOAD = 5
+SECONDS_RELOAD = 5 # shortest interval between schedule polls
+SECONDS_RELOAD_MAX = 60 # the interval doubles up to this while the schedule does not change
+SECONDS_BEFORE_BOUNDARY = 1 # poll this long before a known show start / end
+HORIZON_DAYS = 2
+HORIZON_MAX_SHOWS = 500
 SECONDS_MIN_DURATION = 10
 SECONDS_PADDING = 0
-# SECONDS_PADDING = 5
-# Padding would only work if we can have multiple recorder instances.
+SECONDS_EXPORT_DELAY = continuous_capture.SECONDS_EXPORT_DELAY
+SECONDS_WARM_STANDBY = 0 # connect this long before the start of a show, 0 to start at the show start
+SECONDS_LATENESS_TARGET = 0.1 # starts later than this are logged
+MAX_LATENESS_RECORDS = 100
+# Every broadcast has its own recorder, so with padding the next show starts recording before the current one stops.
+# How many recorders may run at once is limited by recorder_pool.
 
 assert SECONDS_WITHIN_START_IMMEDIATELY < SECONDS_RELOAD
 # otherwise you will miss some beginnings
+assert SECONDS_BEFORE_BOUNDARY < SECONDS_WITHIN_START_IMMEDIATELY
+# the poll right before a boundary has to fall into the start-immediately window
+
+SCHEDULE_UPDATE = Family('airtime_schedule_update_seconds', "Duration of schedule updates from Airtime.", ['outcome'])
+START_LATENESS = Family('recording_start_lateness_seconds', "Time from the scheduled start of a show to the start of its recorder.",
+                        ['trigger'], factory=lambda: Histogram((0.001, 0.0025) + BUCKETS))
+LATENESS = collections.deque(maxlen=MAX_LATENESS_RECORDS) # of the last scheduled starts
 
 
 def now():
@@ -41,6 +67,8 @@ class GenericBroadcast(object):
 
 
 class AirtimeBroadcast(GenericBroadcast):
+
+    padding = SECONDS_PADDING
     # modeled and named after Airtime API:
 
     # end_timestamp: "2020-07-21 21:00:00"
@@ -67,9 +95,9 @@ class AirtimeBroadcast(GenericBroadcast):
         # this is also used to update the dict later on
         self._dict = r
 
-        self.start = datetime.datetime.strptime(r['starts'], '%Y-%m-%d %H:%M:%S') - datetime.timedelta(seconds=SECONDS_PADDING)
+        self.start = datetime.datetime.strptime(r['starts'], '%Y-%m-%d %H:%M:%S') - datetime.timedelta(seconds=self.padding)
         self.start = self.timezone.localize(self.start)
-        self.end = datetime.datetime.strptime(r['ends'], '%Y-%m-%d %H:%M:%S') + datetime.timedelta(seconds=SECONDS_PADDING)
+        self.end = datetime.datetime.strptime(r['ends'], '%Y-%m-%d %H:%M:%S') + datetime.timedelta(seconds=self.padding)
         self.end = self.timezone.localize(self.end)
         self.name = r['name']
         self.description = r['description']
@@ -87,11 +115,26 @@ class AirtimeBroadcast(GenericBroadcast):
     def get_unique_id(self):
         return self.instance_id
 
+    def metadata(self):
+        # for the tags of the recording
+        return {'name': self.name, 'description': self.description, 'image_path': self.image_path,
+                'instance_id': self.instance_id}
+
     @classmethod
     def get_unique_id_from_dict(cls, r):
         return int(r['instance_id'])
 
 
+def make_recorder(url, filename):
+    # the urls were checked when the service started
+    from recorder import StreamRecorderWithAirtime
+    if streams.scheduled():
+        return streams.RecorderGroup((stream.id, StreamRecorderWithAirtime(stream.url, stream.filename, check_url=False,
+                                                                           secondary_url=stream.secondary))
+                                     for stream in streams.scheduled())
+    return StreamRecorderWithAirtime(url, filename, check_url=False)
+
+
 def try_to_remove_job(job):
     try:
         job.remove()
@@ -101,18 +144,22 @@ def try_to_remove_job(job):
 
 class AirtimeBroadcastRecording(AirtimeBroadcast):
 
+    warm_standby = SECONDS_WARM_STANDBY
+
     def __init__(self, r, url, filename, now=False, auto_schedule_recording=True, timezone=pytz.UTC):
 
+        self.warm_job = None
+        self.standby_start = None # start of the show the recorder was prepared for
+        self.lateness = None
         self.start_job = None
         self.start_job_date = None
         self.end_job = None
         self.end_job_date = None
         self.url = url
         self.filename = filename
+        self.continuation = False # the recording was interrupted by a restart and continues in a new file
 
-        from recorder import StreamRecorderWithAirtime
-
-        self.recorder = StreamRecorderWithAirtime(url, filename)
+        self.recorder = make_recorder(url, filename)
 
         # load dict to broadcast
         super(AirtimeBroadcastRecording, self).__init__(r, timezone)
@@ -121,23 +168,87 @@ class AirtimeBroadcastRecording(AirtimeBroadcast):
         if auto_schedule_recording:
             self.schedule_recording()
 
-    def trigger_start(self, id, name):
+    def recording_name(self):
+        return self.name + " cont" if self.continuation else self.name
+
+    def local_start(self):
+        # naive local time, like the recorder uses for filenames
+        return self.start.astimezone(now().tzinfo).replace(tzinfo=None)
+
+    def trigger_warm_up(self, id, name):
+        logger.debug("Warm standby of recording was triggered.")
+        self.warm_job = None
+        if continuous_capture.capture or self.recorder.running():
+            return
+        self.recorder.prepare(self.local_start(), name=self.recording_name(), metadata=self.metadata(),
+                              duration=(self.end - self.start).total_seconds())
+        if self.recorder.standby():
+            self.standby_start = self.start
+
+    def trigger_start(self, id, name, scheduled=False):
         logger.debug("Start of recording was triggered.")
         try_to_remove_job(self.start_job)
-        if self.recorder.running():
+        if continuous_capture.capture:
+            # nothing to start, the show is cut out of the capture when it ended
+            return
+        if self.recorder.standby():
+            # the recorder is connected already and starts its file at the show start on its own
+            self.record_lateness('standby', self.recorder.commit())
+        elif self.recorder.running():
             logging.warning("Can not start scheduled rec. Recorder already running.")
             return
-        self.recorder.start(name=self.name)
+        # without warm standby or when the prepared connection failed
+        cold = [recorder for stream, recorder in self.recorder.members() if not recorder.running()]
+        for recorder in cold:
+            recorder.start(name=self.recording_name(), metadata=self.metadata(),
+                           duration=(self.end - now()).total_seconds())
+        if cold and scheduled:
+            # started by its job, otherwise the start had passed already when the show was scheduled
+            self.record_lateness('job', (now() - self.start).total_seconds())
+        self.standby_start = None
         try_to_remove_job(self.start_job)
+        if state_store.store:
+            for stream, recorder in self.recorder.members():
+                if recorder.running():
+                    state_store.store.recording_started(self.instance_id, recorder._filename, recorder.name,
+                                                        continuous_capture.timestamp(recorder.start_time), stream)
+
+    def record_lateness(self, trigger, lateness):
+        if lateness is None:
+            return
+        self.lateness = lateness
+        START_LATENESS.labels(trigger).observe(lateness)
+        LATENESS.append({'instance_id': self.instance_id, 'name': self.name, 'start': self.start.isoformat(),
+                         'trigger': trigger, 'lateness': lateness})
+        if lateness > SECONDS_LATENESS_TARGET:
+            logger.warning("Recording of %s started %.3f seconds late." % (self.name, lateness))
 
     def trigger_end(self, id, name):
         logger.debug("End of recording was triggered.")
+        if continuous_capture.capture:
+            try_to_remove_job(self.end_job)
+            scheduler.add_job(self.export_from_capture, 'date',
+                              run_date=now() + datetime.timedelta(seconds=SECONDS_EXPORT_DELAY),
+                              name="rec-export-airtime-%i" % self.instance_id)
+            return
+        if state_store.store:
+            state_store.store.recording_stopped(self.instance_id)
+            state_store.store.remove_broadcast(self.instance_id)
         if self.recorder.running():
             self.recorder.stop()
             try_to_remove_job(self.end_job)
         else:
             raise RuntimeError("Can not stop scheduled rec. Recorder not running.")
 
+    def export_from_capture(self):
+        from recorder import slugify
+        start_time = self.start.astimezone(now().tzinfo).replace(tzinfo=None)
+        filename = self.recorder.format_filename(label=slugify(self.name), start_time=start_time)
+        continuous_capture.capture.export(continuous_capture.timestamp(self.start),
+                                          continuous_capture.timestamp(self.end), filename)
+        status.publish('recorder', {'action': 'export', 'filename': filename})
+        postprocessor.submit(filename, filename, dict(self.metadata(), station=self.recorder.station_name))
+
     def schedule_recording(self, start=True, end=True):
         if not self.record:
             logger.warning("This broadcasts has no recording enabled. Skipping.")
@@ -148,7 +259,11 @@ class AirtimeBroadcastRecording(AirtimeBroadcast):
             return
 
         if start:
-            if self.start < now() + datetime.timedelta(seconds=SECONDS_WITHIN_START_IMMEDIATELY):
+            # with warm standby the start is left to the job, so the recorder is not started before the show
+            window = 0 if self.warm_standby else SECONDS_WITHIN_START_IMMEDIATELY
+            if self.warm_standby:
+                self.schedule_warm_up()
+            if self.start < now() + datetime.timedelta(seconds=window):
                 # start immediately if start has passed or within 3 sec from now
                 self.trigger_start(id=self.id, name=self.name)
 
@@ -157,7 +272,7 @@ class AirtimeBroadcastRecording(AirtimeBroadcast):
                     self.start_job.reschedule('date', run_date=self.start)
                     logger.info("Start was re-scheduled at %s with job %s" % (str(self.start), str(self.start_job.name)))
                 else:
-                    self.start_job = scheduler.add_job(self.trigger_start, 'date', run_date=self.start, name="rec-start-airtime-%i" % self.instance_id, kwargs={'id': self.instance_id, 'name': self.name})
+                    self.start_job = scheduler.add_job(self.trigger_start, 'date', run_date=self.start, name="rec-start-airtime-%i" % self.instance_id, kwargs={'id': self.instance_id, 'name': self.name, 'scheduled': True})
                     logger.info("Start was scheduled at %s with job %s" % (str(self.start), str(self.start_job.name)))
 
         if end:
@@ -173,12 +288,46 @@ class AirtimeBroadcastRecording(AirtimeBroadcast):
         if self.record and self.end < now():
             logger.info("Broadcast is stale. Un-Scheduling...")
             self.unschedule_and_stop_recording()
+        elif state_store.store:
+            state_store.store.save_broadcast(self.instance_id, self._dict, self.timezone.zone,
+                                             continuous_capture.timestamp(self.end))
+
+    def schedule_warm_up(self):
+        if self.standby_start is not None and self.standby_start != self.start:
+            # prepared for the old start of a show that was moved
+            self.recorder.cancel()
+            self.standby_start = None
+        warm_up = self.start - datetime.timedelta(seconds=self.warm_standby)
+        if self.start <= now() or self.recorder.running():
+            try_to_remove_job(self.warm_job)
+            self.warm_job = None
+        elif warm_up <= now():
+            try_to_remove_job(self.warm_job)
+            self.trigger_warm_up(id=self.instance_id, name=self.name)
+        elif self.warm_job:
+            self.warm_job.reschedule('date', run_date=warm_up)
+        else:
+            self.warm_job = scheduler.add_job(self.trigger_warm_up, 'date', run_date=warm_up,
+                                              name="rec-warm-airtime-%i" % self.instance_id,
+                                              kwargs={'id': self.instance_id, 'name': self.name})
+            logger.info("Warm standby was scheduled at %s with job %s" % (str(warm_up), str(self.warm_job.name)))
+
+    def cancelled(self):
+        # shows also drop out of the schedule when Airtime considers them over, before the padded end of the recording
+        airtime_end = self.end - datetime.timedelta(seconds=self.padding)
+        return self.start > now() or now() < airtime_end
 
     def unschedule_and_stop_recording(self):
+            try_to_remove_job(self.warm_job)
+            self.recorder.cancel()
             try_to_remove_job(self.start_job)
             try_to_remove_job(self.end_job)
+            if state_store.store:
+                state_store.store.remove_broadcast(self.instance_id)
             if self.start < now() and self.end >= now():
                 self.recorder.stop()
+                if state_store.store:
+                    state_store.store.recording_stopped(self.instance_id)
 
 # TODO listen to cancel() event on job via add_listener()?! to than cancel or stop recording
 # TODO move schedule_recording etc. to Broadcast instance?!
@@ -188,7 +337,6 @@ class AirtimeBroadcastRecording(AirtimeBroadcast):
 # TODO leos bug report
 # TODO shows are created twice, once in next and once
 # TODO remove job if recording stopped via frontend. -> needs different connection to frontend / architecture!
-# TODO no MORE POLLING IN FRONTEND!
 # TODO many logger.info -> logger.debug
 
 
@@ -255,12 +403,18 @@ class AirtimeRecordingScheduler(object):
                 logger.info("Scheduling show with ID %i" % (self._broadcast.get_unique_id(),))
                 self._broadcast.schedule_recording()
 
+            if was_slot_updated:
+                status.publish('schedule', {'instance_id': self._broadcast.get_unique_id() if self._broadcast else None,
+                                            'name': self._broadcast.name if self._broadcast else None})
+
             return was_slot_updated
 
-    def __init__(self, airtime_api, url, filename):
+    def __init__(self, airtime_api, url, filename, padding=SECONDS_PADDING, warm_standby=SECONDS_WARM_STANDBY):
         self._api = airtime_api
         AirtimeRecordingScheduler.url = url
         AirtimeRecordingScheduler.filename = filename
+        AirtimeBroadcast.padding = padding
+        AirtimeBroadcastRecording.warm_standby = warm_standby
 
         # the API is not offering correct results on the previous show.
         # since we can not record past shows anyway we do not care.
@@ -268,23 +422,222 @@ class AirtimeRecordingScheduler(object):
         self.current = AirtimeRecordingScheduler.BroadcastSlot()
         self.next = AirtimeRecordingScheduler.BroadcastSlot()
 
-        self.update()
+        self._hash = None
+        self.interval = SECONDS_RELOAD
+        self.polls = 0
+        self.unchanged = 0
+        self.next_poll = None
+        self.restored = 0
+        self.time_to_armed = None
+
+        if state_store.store:
+            # arm what we know before asking Airtime, which may take a while or fail
+            self.restore()
+            try:
+                self.update()
+            except Exception as e:
+                logger.error("Updating the schedule failed, continuing with the stored one: %s" % e)
+        else:
+            self.update()
         self.job = None
         self.schedule_update()
 
+    def restore(self):
+        started = time.time()
+
+        broadcasts = [AirtimeBroadcastRecording(r,
+                                                url=AirtimeRecordingScheduler.url,
+                                                filename=AirtimeRecordingScheduler.filename,
+                                                auto_schedule_recording=False,
+                                                timezone=pytz.timezone(timezone))
+                      for r, timezone in state_store.store.broadcasts()]
+        by_id = dict((b.get_unique_id(), b) for b in broadcasts)
+
+        # recordings that were running are finished as they are, the show continues in a new file
+        interrupted = set()
+        for stream, default in make_recorder(AirtimeRecordingScheduler.url, AirtimeRecordingScheduler.filename).members():
+            for id, recording in state_store.store.recordings(stream).items():
+                recorder = dict(by_id[id].recorder.members())[stream] if id in by_id else default
+                recorder.finalize_file(recording['filename'], recording['name'],
+                                       datetime.datetime.fromtimestamp(recording['started']),
+                                       by_id[id].metadata() if id in by_id else None)
+                interrupted.add(id)
+        for id in interrupted:
+            state_store.store.recording_stopped(id)
+            if id in by_id:
+                by_id[id].continuation = True
+
+        self.place_restored(broadcasts)
+        for broadcast in broadcasts:
+            broadcast.schedule_recording()
+
+        self.restored = len(broadcasts)
+        self.time_to_armed = time.time() - started
+        logger.info("Restored %i broadcasts, armed after %.3f seconds." % (self.restored, self.time_to_armed))
+
+    def place_restored(self, broadcasts):
+        # put restored broadcasts where update() will look for them, so they are not scheduled twice
+        t = now()
+        for broadcast in broadcasts:
+            AirtimeRecordingScheduler.BroadcastSlot.scheduled_broadcasts[broadcast.get_unique_id()] = broadcast
+            if broadcast.start <= t < broadcast.end:
+                self.current._broadcast = broadcast
+            elif broadcast.start > t and (not self.next._broadcast or broadcast.start < self.next._broadcast.start):
+                self.next._broadcast = broadcast
+
 
     def update(self):
         # logger.debug("Updating schedule from Airtime using API")
-        r = self._api.get_live_info()
+        # past the cache (see api_cache.py), the poll before a boundary must see the current schedule
+        r = getattr(self._api, 'refresh_live_info', self._api.get_live_info)()
+        self.polls += 1
+
+        # live-info also contains the current time, so only the parts we use are compared
+        relevant = json.dumps([r['timezone'], r['currentShow'], r['nextShow']], sort_keys=True)
+        digest = hashlib.sha1(relevant.encode('utf-8')).hexdigest()
+        if digest == self._hash:
+            self.unchanged += 1
+            return False
+        self._hash = digest
 
         self.airtime_timezone = pytz.timezone(r['timezone'])
         self.current.update(r['currentShow'], now=True, others=[self.next._broadcast], timezone=self.airtime_timezone)
         self.next.update(r['nextShow'], others=[self.current._broadcast], timezone=self.airtime_timezone)
+        return True
+
+    def boundaries(self):
+        # all known points in time where a recording starts or ends
+        for slot in (self.current, self.next):
+            if slot._broadcast:
+                yield slot._broadcast.start
+                yield slot._broadcast.end
+
+    def next_poll_time(self):
+        # back off while nothing changes, but always wake up right before the next show starts or ends
+        t = now()
+        wake = t + datetime.timedelta(seconds=self.interval)
+        for boundary in self.boundaries():
+            before = boundary - datetime.timedelta(seconds=SECONDS_BEFORE_BOUNDARY)
+            if t < before < wake:
+                wake = before
+        return wake
+
+    def poll(self):
+        started = time.time()
+        try:
+            changed = self.update()
+            SCHEDULE_UPDATE.labels('changed' if changed else 'unchanged').observe(time.time() - started)
+            if changed:
+                self.interval = SECONDS_RELOAD
+            else:
+                self.interval = min(self.interval * 2, SECONDS_RELOAD_MAX)
+        except Exception as e:
+            SCHEDULE_UPDATE.labels('error').observe(time.time() - started)
+            logger.error("Updating the schedule failed: %s" % e)
+            self.interval = min(self.interval * 2, SECONDS_RELOAD_MAX)
+        finally:
+            self.job = None
+            self.schedule_update()
 
     def schedule_update(self):
         if self.job:
             logger.warning("Periodic update running already with job %s" % self.job.id)
             return
-        self.job = scheduler.add_job(self.update, 'interval', seconds=SECONDS_RELOAD)
-        logger.debug("Runing perodic update on job %s" % self.job.id)
+        self.next_poll = self.next_poll_time()
+        self.job = scheduler.add_job(self.poll, 'date', run_date=self.next_poll, name="schedule-update")
+        logger.debug("Next schedule update at %s on job %s" % (self.next_poll, self.job.id))
+
+    def status(self):
+        return {
+            'polls': self.polls,
+            'unchanged': self.unchanged,
+            'interval': self.interval,
+            'next_poll': self.next_poll.isoformat() if self.next_poll else None,
+            'restored': self.restored,
+            'time_to_armed': self.time_to_armed,
+            'warm_standby': AirtimeBroadcastRecording.warm_standby,
+            'lateness': {
+                'p99': dict((values[0], child.quantile(0.99)) for values, child in START_LATENESS.children()),
+                'recent': list(LATENESS),
+            },
+        }
+
+
+
+class AirtimeHorizonScheduler(AirtimeRecordingScheduler):
+    """
+    Loads all shows of the next days instead of only the current and the next one
+    and arms start and end jobs for all of them, so recordings keep happening
+    while Airtime is not reachable.
+    """
+
+    def __init__(self, airtime_api, url, filename, padding=SECONDS_PADDING, days=HORIZON_DAYS,
+                 warm_standby=SECONDS_WARM_STANDBY):
+        self.days = days
+        self.store = BroadcastStore()
+        super(AirtimeHorizonScheduler, self).__init__(airtime_api, url, filename, padding=padding,
+                                                      warm_standby=warm_standby)
 
+    def update(self):
+        r = self._api.get_live_info_v2(days=self.days, shows=HORIZON_MAX_SHOWS)
+        self.polls += 1
+
+        shows = r['shows']
+        current = shows.get('current')
+        broadcasts = ([current] if isinstance(current, dict) and current else []) + list(shows.get('next') or [])
+
+        relevant = json.dumps([r['station']['timezone'], broadcasts], sort_keys=True)
+        digest = hashlib.sha1(relevant.encode('utf-8')).hexdigest()
+        if digest == self._hash:
+            self.unchanged += 1
+            return False
+        self._hash = digest
+
+        self.airtime_timezone = pytz.timezone(r['station']['timezone'])
+        added, changed, removed = self.store.diff(broadcasts)
+
+        for id in removed:
+            broadcast = self.store.remove(id)
+            if broadcast.cancelled():
+                logger.info("Un-Scheduling show with ID %i" % id)
+                broadcast.unschedule_and_stop_recording()
+            else:
+                # ended, the end job stops the recording after the padding
+                logger.info("Show with ID %i ended, recording until %s" % (id, str(broadcast.end)))
+
+        for r in changed:
+            broadcast = self.store.by_id[self.store.key(r)]
+            broadcast.load_dict(r)
+            self.store.reindex(broadcast)
+            logger.info("Re-Scheduling show with ID %i" % broadcast.get_unique_id())
+            broadcast.schedule_recording()
+
+        for r in added:
+            broadcast = AirtimeBroadcastRecording(r,
+                                                  url=AirtimeRecordingScheduler.url,
+                                                  filename=AirtimeRecordingScheduler.filename,
+                                                  auto_schedule_recording=False,
+                                                  timezone=self.airtime_timezone)
+            self.store.add(broadcast)
+            logger.info("Scheduling show with ID %i" % broadcast.get_unique_id())
+            broadcast.schedule_recording()
+
+        status.publish('schedule', {'added': len(added), 'changed': len(changed), 'removed': len(removed)})
+        return True
+
+    def place_restored(self, broadcasts):
+        for broadcast in broadcasts:
+            self.store.add(broadcast)
+
+    def boundaries(self):
+        for broadcast in self.store.upcoming(now(), n=2):
+            yield broadcast.start
+            yield broadcast.end
+
+    def status(self):
+        response = super(AirtimeHorizonScheduler, self).status()
+        current = self.store.at(now())
+        response['horizon_days'] = self.days
+        response['broadcasts'] = len(self.store)
+        response['current'] = current.name if current else None
+        return response
@@ -0,0 +1,231 @@
+import logging
+import os
+import subprocess
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+
+from status_stream import status
+from upload import follow_file
+
+# Levels of the stream being recorded: the MP3 data is decoded by ffmpeg (or mpg123) to mono 16 bit
+# at a low sample rate, which is plenty for loudness and keeps the CPU use to a few percent.
+# Every second of samples gives one RMS / peak / silence record, computed for all complete
+# seconds at once with NumPy and appended to a sidecar file next to the recording.
+# The recording engine hands the data over through a bounded queue and never waits for the decoder:
+# a writer thread feeds it, and chunks that do not fit into the queue are dropped from the analysis.
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 8000
+SILENCE_DB = -50.0 # seconds with a lower RMS are silent
+SECONDS_DEAD_AIR = 30 # alarm after this many silent seconds in a row
+SIDECAR_EXTENSION = '.levels'
+READ_SIZE = SAMPLE_RATE * 2 # one second of samples
+SECONDS_WAIT_FOR_FILE = 10 # streamripper creates the file after it connected
+QUEUE_CHUNKS = 256 # ~1 minute of stream chunks waiting for the decoder
+
+# one record per second, levels in hundredths of dBFS
+LEVEL_DTYPE = np.dtype([('rms', '<i2'), ('peak', '<i2'), ('silent', 'u1')])
+FULL_SCALE = 32768.0
+FLOOR_DB = -100.0
+
+
+def which(program):
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        if os.access(os.path.join(path, program), os.X_OK):
+            return os.path.join(path, program)
+    return None
+
+
+def decoder_command(rate=SAMPLE_RATE):
+    if which('ffmpeg'):
+        return ['ffmpeg', '-loglevel', 'error', '-f', 'mp3', '-i', 'pipe:0',
+                '-ac', '1', '-ar', str(rate), '-f', 's16le', 'pipe:1']
+    if which('mpg123'):
+        return ['mpg123', '--quiet', '--mono', '--rate', str(rate), '--stdout', '-']
+    return None
+
+
+def levels(samples, rate=SAMPLE_RATE, silence_db=SILENCE_DB):
+    """Per second RMS, peak (dBFS) and silence flag of int16 samples. An incomplete last second is ignored."""
+    seconds = len(samples) // rate
+    blocks = samples[:seconds * rate].reshape(seconds, rate).astype(np.float32) / FULL_SCALE
+    with np.errstate(divide='ignore'):
+        rms = np.maximum(10 * np.log10(np.mean(blocks * blocks, axis=1)), FLOOR_DB)
+        peak = np.maximum(20 * np.log10(np.max(np.abs(blocks), axis=1)), FLOOR_DB)
+    records = np.zeros(seconds, dtype=LEVEL_DTYPE)
+    records['rms'] = np.round(rms * 100)
+    records['peak'] = np.round(peak * 100)
+    records['silent'] = rms < silence_db
+    return records
+
+
+def load_levels(path):
+    return np.fromfile(path, dtype=LEVEL_DTYPE)
+
+
+class LevelAnalyzer(object):
+    """Decodes the MP3 data passed to feed() and writes the levels to the current sidecar."""
+
+    def __init__(self, sidecar, rate=SAMPLE_RATE, dead_air=SECONDS_DEAD_AIR, command=None):
+        self.rate = rate
+        self.dead_air = dead_air
+        self.command = command or decoder_command(rate)
+        self.process = None
+        self.seconds = 0
+        self.silent_seconds = 0
+        self.last = None
+        self.alarm_since = None
+        self.dropped = 0 # chunks the decoder could not keep up with
+        self._pending = np.zeros(0, dtype='<i2')
+        self._queue = queue.Queue(maxsize=QUEUE_CHUNKS)
+        self._lock = threading.Lock()
+        self._sidecar = None
+        self._done = None # set when a followed file is complete
+        self.sinks = [] # get the decoded samples too, e.g. peaks.PeaksWriter
+        self.open_sidecar(sidecar)
+
+    def open_sidecar(self, path):
+        """Continues writing into a new sidecar, e.g. after a cut."""
+        with self._lock:
+            if self._sidecar:
+                self._sidecar.close()
+            self.sidecar = path
+            self._sidecar = open(path, 'ab')
+
+    def start(self):
+        if not self.command:
+            logger.error("Neither ffmpeg nor mpg123 found, can not analyze levels.")
+            return self
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._reader = threading.Thread(target=self._read, name='levels')
+        self._reader.daemon = True
+        self._reader.start()
+        self._writer = threading.Thread(target=self._write, name='levels-input')
+        self._writer.daemon = True
+        self._writer.start()
+        return self
+
+    def feed(self, data, block=False):
+        """Queues data for the decoder. Without block it is dropped when the decoder is behind."""
+        if self.process is None or self.process.poll() is not None:
+            return
+        try:
+            self._queue.put(data, block)
+        except queue.Full:
+            if not self.dropped:
+                logger.warning("Level analysis of %s is behind, dropping data." % self.sidecar)
+            self.dropped += 1
+
+    def _write(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            try:
+                self.process.stdin.write(data)
+            except (IOError, OSError, ValueError):
+                break # the decoder ended
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+
+    def tap(self, data, timestamp, boundaries):
+        # for StreamCaptureEngine.taps
+        self.feed(data)
+
+    def follow(self, path):
+        """Feeds the file as it is written, for engines without taps (streamripper)."""
+        self._done = threading.Event()
+
+        def run():
+            waited = 0
+            while not os.path.exists(path) and not self._done.is_set() and waited < SECONDS_WAIT_FOR_FILE:
+                waited += 0.5
+                self._done.wait(0.5)
+            try:
+                with open(path, 'rb') as f:
+                    for chunk in follow_file(f, self._done):
+                        self.feed(chunk, block=True)
+            except (IOError, OSError) as e:
+                logger.error("Can not follow %s: %s" % (path, e))
+            self._close_input()
+        follower = threading.Thread(target=run, name='levels-follow')
+        follower.daemon = True
+        follower.start()
+        return self
+
+    def _read(self):
+        while True:
+            data = self.process.stdout.read(READ_SIZE)
+            if not data:
+                break
+            self.add_samples(np.frombuffer(data, dtype='<i2'))
+        self.close()
+
+    def add_samples(self, samples):
+        for sink in self.sinks:
+            sink.add_samples(samples)
+        samples = np.concatenate((self._pending, samples))
+        records = levels(samples, self.rate)
+        self._pending = samples[len(records) * self.rate:]
+        if not len(records):
+            return
+        with self._lock:
+            if self._sidecar:
+                records.tofile(self._sidecar)
+                self._sidecar.flush()
+        self.seconds += len(records)
+        self.last = records[-1]
+        for silent in records['silent']:
+            self.silent_seconds = self.silent_seconds + 1 if silent else 0
+        if self.silent_seconds >= self.dead_air and self.alarm_since is None:
+            self.alarm_since = time.time() - self.silent_seconds
+            logger.warning("Dead air for %i seconds in %s" % (self.silent_seconds, self.sidecar))
+            status.publish('alarm', {'dead_air': self.silent_seconds, 'sidecar': self.sidecar})
+        elif self.silent_seconds < self.dead_air and self.alarm_since is not None:
+            self.alarm_since = None
+            status.publish('alarm', {'dead_air': 0, 'sidecar': self.sidecar})
+
+    def stop(self):
+        """Ends decoding. The rest of the decoded audio is still written, in the background."""
+        if self._done:
+            self._done.set() # the follower closes the input when it read everything
+        else:
+            self._close_input()
+
+    def _close_input(self):
+        # the writer closes the input after the queued data
+        if self.process is None:
+            return
+        while True:
+            try:
+                self._queue.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait() # the decoder is behind anyway
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        with self._lock:
+            if self._sidecar:
+                self._sidecar.close()
+                self._sidecar = None
+        for sink in self.sinks:
+            sink.close()
+
+    def status(self):
+        return {'rms_db': float(self.last['rms']) / 100 if self.last is not None else None,
+                'peak_db': float(self.last['peak']) / 100 if self.last is not None else None,
+                'seconds': self.seconds, 'silent_seconds': self.silent_seconds, 'dropped': self.dropped,
+                'dead_air': self.alarm_since is not None}
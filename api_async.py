@@ -0,0 +1,68 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# Concurrent calls to the Airtime API: independent requests are submitted together
+# and each one gets its own deadline, so a status summary takes as long as the slowest
+# call that answered in time instead of the sum of all calls.
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 4
+SECONDS_DEADLINE = 5
+# deadlines per API action in seconds, everything else uses SECONDS_DEADLINE
+deadlines = {
+    'get_live_info': 3,
+    'get_on_air_light': 3,
+}
+
+
+class AsyncAirtimeApi(object):
+    """Runs the methods of an AirtimeApiClient (or a wrapper of it) on a thread pool."""
+
+    def __init__(self, api, workers=WORKERS):
+        self.api = api
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _method(self, action):
+        method = getattr(self.api, action, None)
+        if method is None:
+            # actions of api_config without a wrapper method on the client
+            method = getattr(self.api.services, action)
+        return method
+
+    def submit(self, action, *args, **kwargs):
+        return self.executor.submit(self._method(action), *args, **kwargs)
+
+    def gather(self, calls):
+        """
+        Runs the calls, a dict of key -> action name or (action name, args), concurrently.
+        Returns (results, errors), both by key: a call that failed or missed its deadline
+        is only in errors, so the results of the others can still be used.
+        """
+        started = time.time()
+        futures = {}
+        for key, call in calls.items():
+            action, args = (call, ()) if isinstance(call, str) else call
+            futures[key] = (action, self.submit(action, *args))
+
+        results, errors = {}, {}
+        for key, (action, future) in futures.items():
+            remaining = started + deadlines.get(action, SECONDS_DEADLINE) - time.time()
+            try:
+                results[key] = future.result(timeout=max(remaining, 0))
+            except TimeoutError:
+                # the request keeps its thread until it returns, but nobody waits for it
+                future.cancel()
+                logger.warning("%s did not answer within its deadline.", action)
+                errors[key] = 'timeout'
+            except Exception as e:
+                logger.warning("%s failed: %s", action, e)
+                errors[key] = str(e) or e.__class__.__name__
+        return results, errors
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
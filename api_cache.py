@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+
+# Caching layer in front of the Airtime API.
+# Every open controller tab polls /status-summary/ and the schedule polls live-info on its own.
+# All of them share the same upstream data, so we fetch it once and hand it out to everyone.
+# The schedule must not act on data up to TTL + STALE old, it fetches with refresh() and fills the cache for the others.
+
+logger = logging.getLogger(__name__)
+
+SECONDS_TTL = 2 # values younger than this are served without asking Airtime
+SECONDS_STALE = 30 # values younger than TTL + STALE are served while a refresh runs in the background
+
+CACHED_CALLS = ('get_live_info', 'get_on_air_light')
+
+
+class CachedApiCall(object):
+    """
+    Single-flight, TTL-bounded cache for one API call without arguments.
+    Concurrent callers that miss the cache wait for the one fetch already in flight.
+    """
+
+    def __init__(self, fetch, ttl=SECONDS_TTL, stale=SECONDS_STALE, name=None, clock=time.time):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale = stale
+        self.name = name or getattr(fetch, '__name__', 'call')
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._in_flight = None # threading.Event of the running fetch
+        self._value = None
+        self._value_time = None
+        self._error = None
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.fetches = 0
+
+    def age(self):
+        if self._value_time is None:
+            return None
+        return self.clock() - self._value_time
+
+    def get(self):
+        with self._lock:
+            age = self.age()
+            if age is not None and age < self.ttl:
+                self.hits += 1
+                return self._value
+
+            if age is not None and age < self.ttl + self.stale:
+                # stale-while-revalidate: answer now, refresh for the next caller
+                self.stale_hits += 1
+                if not self._in_flight:
+                    self._in_flight = threading.Event()
+                    thread = threading.Thread(target=self._refresh, args=(self._in_flight,), name="cache-%s" % self.name)
+                    thread.daemon = True
+                    thread.start()
+                return self._value
+
+            self.misses += 1
+        return self._fetch()
+
+    def refresh(self):
+        """Fetches now, whatever the age of the cached value. The result is cached for the other callers."""
+        return self._fetch()
+
+    def _fetch(self):
+        # joins the fetch in flight, it started after the cached value
+        with self._lock:
+            if self._in_flight:
+                leader = False
+                in_flight = self._in_flight
+            else:
+                leader = True
+                in_flight = self._in_flight = threading.Event()
+
+        if leader:
+            self._refresh(in_flight)
+        else:
+            in_flight.wait()
+
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            return self._value
+
+    def _refresh(self, in_flight):
+        try:
+            value = self.fetch()
+        except Exception as e:
+            logger.warning("Fetching %s failed: %s" % (self.name, e))
+            with self._lock:
+                self.errors += 1
+                self._error = e
+        else:
+            with self._lock:
+                self.fetches += 1
+                self._value = value
+                self._value_time = self.clock()
+                self._error = None
+        finally:
+            with self._lock:
+                self._in_flight = None
+            in_flight.set()
+
+    def invalidate(self):
+        with self._lock:
+            self._value_time = None
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.stale_hits + self.misses
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'fetches': self.fetches,
+                'errors': self.errors,
+                'hit_ratio': float(self.hits + self.stale_hits) / requests if requests else None,
+                'age': self.age(),
+                'ttl': self.ttl,
+                'stale': self.stale,
+            }
+
+
+class CachedAirtimeApi(object):
+    """
+    Wraps an AirtimeApiClient. The calls in CACHED_CALLS go through a shared CachedApiCall,
+    everything else is passed through to the client unchanged.
+    """
+
+    def __init__(self, api, ttl=SECONDS_TTL, stale=SECONDS_STALE):
+        self._api = api
+        self._calls = dict((name, CachedApiCall(getattr(api, name), ttl=ttl, stale=stale, name=name))
+                           for name in CACHED_CALLS)
+
+    def __getattr__(self, item):
+        return getattr(self._api, item)
+
+    def get_live_info(self):
+        return self._calls['get_live_info'].get()
+
+    def get_on_air_light(self):
+        return self._calls['get_on_air_light'].get()
+
+    def refresh_live_info(self):
+        return self._calls['get_live_info'].refresh()
+
+    def invalidate(self):
+        for call in self._calls.values():
+            call.invalidate()
+
+    def stats(self):
+        return dict((name, call.stats()) for name, call in self._calls.items())
@@ -17,6 +17,9 @@ import json
 import base64
 import traceback
 from configobj import ConfigObj
+from requests.adapters import HTTPAdapter
+from metrics import Family
+from retry_policy import RetryPolicy
 
 AIRTIME_API_VERSION = "1.1"
 
@@ -93,6 +96,21 @@ api_config['update_metadata_on_tunein'] = 'update-metadata-on-tunein/api_key/%%a
 # compare line 201: actions = dict ... if '%%api_key%%' in v
 api_config['get_live_info'] = 'live-info/api_key/%%api_key%%'
 api_config['get_on_air_light'] = 'on-air-light/api_key/%%api_key%%/format/json'
+# all shows of the next days (recorded-shows only lists shows with the record flag, we record everything)
+api_config['get_live_info_v2'] = 'live-info-v2/api_key/%%api_key%%/days/%%days%%/shows/%%shows%%'
+
+# connections kept open to Airtime (keep-alive), shared by all actions
+API_POOL_SIZE = 4
+API_CONNECT_TIMEOUT = 3.05
+# read timeouts per action in seconds, everything else uses ApiRequest.API_HTTP_REQUEST_TIMEOUT
+api_timeouts = {
+    'get_live_info': 5,
+    'get_on_air_light': 5,
+    'get_live_info_v2': 15,
+    'update_source_status': 10,
+}
+
+API_LATENCY = Family('airtime_api_request_seconds', 'Latency of Airtime API requests', ['action'])
 
 
 ################################################################################
@@ -134,32 +152,39 @@ class ApiRequest(object):
 
     API_HTTP_REQUEST_TIMEOUT = 30 # 30 second HTTP request timeout
 
-    def __init__(self, name, url, logger=None):
+    def __init__(self, name, url, logger=None, session=None, timeout=None):
         self.name = name
         self.url  = url
         self.__req = None
         if logger is None: self.logger = logging
         else: self.logger = logger
+        self.session = session or requests.Session()
+        self.timeout = timeout or ApiRequest.API_HTTP_REQUEST_TIMEOUT
 
     def __call__(self,_post_data=None, **kwargs):
         final_url = self.url.params(**kwargs).url()
-        if _post_data is not None: _post_data = urllib.urlencode(_post_data)
         self.logger.debug(final_url)
+        started = time.time()
         try:
-            req = urllib2.Request(final_url, _post_data)
-            f = urllib2.urlopen(req, timeout=ApiRequest.API_HTTP_REQUEST_TIMEOUT)
-            content_type = f.info().getheader('Content-Type')
-            response = f.read()
-        #Everything that calls an ApiRequest should be catching URLError explicitly
+            timeout = (API_CONNECT_TIMEOUT, self.timeout)
+            if _post_data is not None:
+                f = self.session.post(final_url, data=_post_data, timeout=timeout)
+            else:
+                f = self.session.get(final_url, timeout=timeout)
+            f.raise_for_status()
+            content_type = f.headers.get('Content-Type')
+            response = f.content
+        #Everything that calls an ApiRequest should be catching exceptions explicitly
         #(according to the other comments in this file and a cursory grep through the code)
-        #Note that URLError can occur for timeouts as well as socket.timeout
-        except socket.timeout:
+        except requests.exceptions.Timeout:
             self.logger.error('HTTP request to %s timed out', final_url)
             raise
         except Exception, e:
             #self.logger.error('Exception: %s', e)
             #self.logger.error("traceback: %s", traceback.format_exc())
             raise
+        finally:
+            API_LATENCY.labels(self.name).observe(time.time() - started)
 
         try:
             if content_type == 'application/json':
@@ -178,11 +203,9 @@ class ApiRequest(object):
 
     def retry(self, n, delay=5):
         """Try to send request n times. If after n times it fails then
-        we finally raise exception"""
-        for i in range(0,n-1):
-            try: return self.__req()
-            except Exception: time.sleep(delay)
-        return self.__req()
+        we finally raise exception. Waits grow exponentially from delay (with jitter).
+        Blocks the caller: use retry_policy.retries.submit() to retry in the background."""
+        return RetryPolicy(attempts=n, base=delay).call(self.__req)
 
 class RequestProvider(object):
     """ Creates the available ApiRequest instance that can be read from
@@ -197,12 +220,18 @@ class RequestProvider(object):
                self.config["general"]["base_url"], str(self.config["general"]["base_port"]),
                self.config["general"]["base_dir"], self.config["api_base"],
                '%%action%%'))
+        # One session for all actions, so connections to Airtime are reused (keep-alive)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=API_POOL_SIZE, pool_maxsize=API_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         # Now we must discover the possible actions
         actions = dict( (k,v) for k,v in cfg.iteritems() if '%%api_key%%' in v)
         for action_name, action_value in actions.iteritems():
             new_url = self.url.params(action=action_value).params(
                 api_key=self.config["general"]['api_key'])
-            self.requests[action_name] = ApiRequest(action_name, new_url)
+            self.requests[action_name] = ApiRequest(action_name, new_url, session=self.session,
+                                                    timeout=api_timeouts.get(action_name))
 
     def available_requests(self)    : return self.requests.keys()
     def __contains__(self, request) : return request in self.requests
@@ -289,7 +318,9 @@ class AirtimeApiClient(object):
         response = ''
 
         retries = int(self.config["upload_retries"])
-        retries_wait = int(self.config["upload_wait"])
+        # upload_wait between the attempts, as configured: not capped at the default max_delay, no jitter
+        wait = int(self.config["upload_wait"])
+        policy = RetryPolicy(attempts=retries, base=wait, max_delay=wait, jitter=False)
 
         url = self.construct_rest_url("upload_file_url")
 
@@ -336,11 +367,32 @@ class AirtimeApiClient(object):
                 logger.error("Exception: %s", e)
                 logger.error("traceback: %s", traceback.format_exc())
 
-            #wait some time before next retry
-            time.sleep(retries_wait)
+            #wait some time before next retry, but not after the last one
+            if i < retries - 1:
+                time.sleep(policy.delay(i + 1))
 
         return response
 
+    def upload_recorded_show_stream(self, stream):
+        """
+        Uploads a upload.MultipartStream. The body is read from the file while it is sent,
+        so memory use does not grow with the file. Airtime has no resumable uploads,
+        so a retry sends the whole file again (from disk). Raises if all attempts failed.
+        """
+        url = self.construct_rest_url("upload_file_url")
+        # an upload runs for minutes (a live upload for the whole show), the attempts limit it
+        wait = int(self.config["upload_wait"])
+        policy = RetryPolicy(attempts=int(self.config["upload_retries"]), base=wait, max_delay=wait, jitter=False,
+                             deadline=None)
+
+        def post():
+            self.logger.debug("Uploading %s", stream.path)
+            request = requests.post(url, data=stream, headers={'Content-Type': stream.content_type},
+                                    timeout=(API_CONNECT_TIMEOUT, float(ApiRequest.API_HTTP_REQUEST_TIMEOUT)))
+            request.raise_for_status()
+            return request.json()
+        return policy.call(post)
+
     def check_live_stream_auth(self, username, password, dj_type):
         try:
             return self.services.check_live_stream_auth(
@@ -589,6 +641,9 @@ class AirtimeApiClient(object):
     def get_on_air_light(self):
         return self.services.get_on_air_light()
 
+    def get_live_info_v2(self, days=1, shows=100):
+        return self.services.get_live_info_v2(days=days, shows=shows)
+
 
 class InvalidContentType(Exception):
     pass
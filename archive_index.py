@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""
+Index of the recordings archive: which file holds which show (Airtime instance id, name, time).
+
+Updated by post-processing whenever a recording is finished. To (re-)build it from an existing tree:
+
+    python archive_index.py recordings.sqlite '/media/storage/recordings/Studio-Live/%Y/%m/%d/radio-%station_%Y-%m-%d-%H-%M-%S_%label.mp3'
+"""
+import argparse
+import datetime
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mp3 import find_frame, parse_header
+from postprocess import id3_size, read_id3
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = ('.mp3', '.aac', '.ogg', '.opus', '.flac')
+WORKERS = 8
+LIMIT = 100
+HEADER_READ_SIZE = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    path TEXT PRIMARY KEY,
+    instance_id INTEGER,
+    name TEXT,
+    station TEXT,
+    start REAL,
+    end REAL,
+    duration REAL,
+    size INTEGER,
+    sha256 TEXT,
+    indexed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recordings_instance_id ON recordings (instance_id);
+CREATE INDEX IF NOT EXISTS recordings_name ON recordings (name, start);
+CREATE INDEX IF NOT EXISTS recordings_start ON recordings (start);
+"""
+COLUMNS = ('path', 'instance_id', 'name', 'station', 'start', 'end', 'duration', 'size', 'sha256', 'indexed')
+
+
+#########
+# FILES
+#########
+
+def pattern_root(pattern):
+    """The directory of a filename pattern up to the first part with strftime() codes or tokens."""
+    root = []
+    for part in os.path.dirname(os.path.abspath(pattern)).split(os.sep):
+        if '%' in part:
+            break
+        root.append(part)
+    return os.sep.join(root) or os.sep
+
+
+_CODES = {'Y': r'(\d{4})', 'm': r'(\d{2})', 'd': r'(\d{2})', 'H': r'(\d{2})', 'M': r'(\d{2})', 'S': r'(\d{2})',
+          'station': r'([^/]*?)', 'label': r'([^/]*?)'}
+
+
+def pattern_regex(pattern):
+    """
+    Regex for the paths a filename pattern produces and the names of its groups.
+    The extension is not part of the match, every audio extension is accepted.
+    """
+    names, regex = [], ''
+    for part in re.split(r'(%station|%label|%[a-zA-Z])', os.path.splitext(os.path.abspath(pattern))[0]):
+        if part.startswith('%'):
+            code = part[1:]
+            regex += _CODES.get(code, r'([^/]*?)')
+            names.append(code)
+        else:
+            regex += re.escape(part)
+    return re.compile('^' + regex + r'\.\w+$'), names
+
+
+def parse_path(path, patterns):
+    """Start (timestamp) and label of a recording from its path, None where they can not be found."""
+    for regex, names in patterns:
+        match = regex.match(os.path.abspath(path))
+        if not match:
+            continue
+        values = {}
+        for name, value in zip(names, match.groups()):
+            values.setdefault(name, value)
+        start = None
+        if all(code in values for code in 'YmdHMS'):
+            dt = datetime.datetime(*[int(values[code]) for code in 'YmdHMS'])
+            start = time.mktime(dt.timetuple()) # local time, like the filenames
+        return start, values.get('label')
+    return None, None
+
+
+def patterns_for(pattern):
+    # format_filename() strips separators when the label is empty, e.g. "..._%label" -> "..."
+    patterns = [pattern_regex(pattern)]
+    without_label = re.sub(r'[ _.-]?%label', '', pattern)
+    if without_label != pattern:
+        patterns.append(pattern_regex(without_label))
+    return patterns
+
+
+def mp3_duration(path, size):
+    """Duration from the bitrate of the first frame, our streams have a constant bitrate."""
+    with open(path, 'rb') as f:
+        head = f.read(10)
+        skip = id3_size(head)
+        f.seek(skip)
+        buf = f.read(HEADER_READ_SIZE)
+    pos = find_frame(buf)
+    header = parse_header(buf, pos) if pos is not None else None
+    if header is None:
+        return None
+    return (size - skip - pos) * 8.0 / header.bitrate
+
+
+def describe(path, patterns=(), metadata=None, sha256=None):
+    """Row of a recording: from metadata where given, otherwise from its tags and path."""
+    metadata = dict(metadata or {})
+    size = os.path.getsize(path)
+    if not metadata.get('instance_id'):
+        try:
+            for key, value in read_id3(path).items():
+                metadata.setdefault(key, value)
+        except (IOError, OSError, ValueError):
+            pass
+    start, label = parse_path(path, patterns)
+    start = metadata.get('started') or start
+    duration = mp3_duration(path, size) if path.lower().endswith('.mp3') else None
+    if start is None:
+        start = os.path.getmtime(path) - (duration or 0)
+    return {'path': os.path.abspath(path), 'instance_id': metadata.get('instance_id'),
+            'name': metadata.get('name') or label, 'station': metadata.get('station'),
+            'start': start, 'end': start + duration if duration is not None else None, 'duration': duration,
+            'size': size, 'sha256': sha256, 'indexed': time.time()}
+
+
+#########
+# INDEX
+#########
+
+class ArchiveIndex(object):
+
+    def __init__(self, path, patterns=()):
+        self.path = path
+        self.patterns = list(patterns)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            with self._db:
+                return self._db.execute(sql, params).fetchall()
+
+    def put(self, row):
+        self.put_many([row])
+
+    def put_many(self, rows):
+        sql = "INSERT OR REPLACE INTO recordings (%s) VALUES (%s)" % (', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+        with self._lock:
+            with self._db:
+                self._db.executemany(sql, [tuple(row.get(column) for column in COLUMNS) for row in rows])
+
+    def add(self, path, metadata=None, sha256=None):
+        self.put(describe(path, self.patterns, metadata, sha256))
+
+    def moved(self, old, new, size=None):
+        self._execute("UPDATE recordings SET path = ?, size = coalesce(?, size) WHERE path = ?",
+                      (os.path.abspath(new), size, os.path.abspath(old)))
+
+    def remove(self, path):
+        self._execute("DELETE FROM recordings WHERE path = ?", (os.path.abspath(path),))
+
+    def find(self, instance_id=None, name=None, start=None, end=None, limit=LIMIT):
+        """Recordings matching all given filters, the newest first. start / end select those overlapping the range."""
+        where, params = [], []
+        if instance_id is not None:
+            where.append("instance_id = ?")
+            params.append(instance_id)
+        if name is not None:
+            where.append("name = ?")
+            params.append(name)
+        if start is not None:
+            where.append("coalesce(end, start) >= ?")
+            params.append(start)
+        if end is not None:
+            where.append("start < ?")
+            params.append(end)
+        sql = "SELECT * FROM recordings%s ORDER BY start DESC LIMIT ?" % (" WHERE " + " AND ".join(where) if where else "")
+        return [dict(row) for row in self._execute(sql, params + [limit])]
+
+    def status(self):
+        count, size, first, last = self._execute("SELECT count(*), sum(size), min(start), max(start) FROM recordings")[0]
+        return {'recordings': count, 'bytes': size or 0, 'first': first, 'last': last}
+
+    def rebuild(self, root, workers=WORKERS):
+        """Indexes all audio files under root, reading their tags and headers in parallel. Returns the number of files."""
+        paths = [os.path.join(directory, filename)
+                 for directory, _, filenames in os.walk(root) for filename in filenames
+                 if os.path.splitext(filename)[1].lower() in AUDIO_EXTENSIONS]
+
+        def row(path):
+            try:
+                return describe(path, self.patterns)
+            except (IOError, OSError) as e:
+                logger.warning("Can not index %s: %s" % (path, e))
+                return None
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            rows = [r for r in executor.map(row, paths) if r is not None]
+        finally:
+            executor.shutdown()
+        self.put_many(rows)
+        return len(rows)
+
+
+index = None # set when started with an archive database
+
+
+def index_recording(job):
+    # post-processing stage
+    if index:
+        index.add(job.path, job.metadata, job.sha256)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the index of an existing recordings tree.")
+    parser.add_argument('database', help='SQLite file of the index (see --archive-db of recorder.py).')
+    parser.add_argument('pattern', help='Filename pattern of the recordings, as passed to recorder.py.')
+    parser.add_argument('--root', help='Directory to scan. Default: the fixed part of the pattern.')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='Files read in parallel.')
+    args = parser.parse_args()
+
+    started = time.time()
+    archive = ArchiveIndex(args.database, patterns_for(args.pattern))
+    count = archive.rebuild(args.root or pattern_root(args.pattern), workers=args.workers)
+    print("Indexed %i recordings in %.1f seconds." % (count, time.time() - started))
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Build and serving of the controller (public/) by the recorder itself, see --ui.
+#
+#     python assets.py public dist
+#
+# copies public/ to dist/ with the content hash in every filename but the HTML pages, rewrites the references
+# in HTML and CSS to the new names and writes gzip (and brotli, if installed) compressed variants next to the files.
+# Hashed files never change, so browsers may cache them forever. The pages are revalidated with their ETag,
+# which is cheap: 304 without a body while nothing changed.
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json' # original path -> built path
+HASH_LENGTH = 10
+PAGE_EXTENSIONS = ('.html',) # entry points, keep their names
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.svg', '.txt', '.ico', '.ttf', '.otf', '.eot', '.json')
+MIN_COMPRESSION = 0.9 # a variant is only kept if it is smaller than this part of the file
+ENCODINGS = (('br', '.br'), ('gzip', '.gz')) # by preference
+CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDATE = 'no-cache'
+MIMETYPES = {
+    '.woff2': 'font/woff2',
+    '.woff': 'font/woff',
+    '.ttf': 'font/ttf',
+    '.otf': 'font/otf',
+    '.eot': 'application/vnd.ms-fontobject',
+    '.svg': 'image/svg+xml',
+    '.ico': 'image/x-icon',
+}
+
+HTML_REFERENCE = re.compile(r'''((?:href|src)\s*=\s*["'])([^"']+)(["'])''')
+CSS_REFERENCES = (re.compile(r'''(url\(\s*["']?)([^"')]+?)(["']?\s*\))'''),
+                  re.compile(r'''(@import\s+["'])([^"']+)(["'])'''))
+
+
+#########
+# BUILD
+#########
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(path, data):
+    name, extension = posixpath.splitext(path)
+    return '%s.%s%s' % (name, content_hash(data), extension)
+
+
+def compress(data):
+    """Precompressed variants of data by file extension, e.g. {'.gz': ...}."""
+    variants = {}
+    buf = io.BytesIO()
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buf, compresslevel=9, mtime=0) as f:
+        f.write(data)
+    variants['.gz'] = buf.getvalue()
+    if brotli:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return dict((extension, variant) for extension, variant in variants.items()
+                if len(variant) < len(data) * MIN_COMPRESSION)
+
+
+class Builder(object):
+
+    def __init__(self, source, target):
+        self.source = source
+        self.target = target
+        self.files = set() # relative paths with /
+        self.built = {} # relative path -> built relative path
+        self._building = set()
+
+    def build(self):
+        for directory, _, filenames in os.walk(self.source):
+            for filename in filenames:
+                path = os.path.relpath(os.path.join(directory, filename), self.source)
+                self.files.add(path.replace(os.sep, '/'))
+        for path in sorted(self.files):
+            self.output(path)
+        with open(os.path.join(self.target, MANIFEST), 'w') as f:
+            json.dump(self.built, f, indent=2, sort_keys=True, separators=(',', ': '))
+        logger.info("Built %i files from %s into %s" % (len(self.built), self.source, self.target))
+        return self.built
+
+    def output(self, path):
+        """Writes path to the target, after the files it references. Returns its built path."""
+        if path in self.built:
+            return self.built[path]
+        self._building.add(path)
+        with open(os.path.join(self.source, path), 'rb') as f:
+            data = f.read()
+        extension = posixpath.splitext(path)[1].lower()
+        if extension in PAGE_EXTENSIONS:
+            data = self.rewrite(path, data, [HTML_REFERENCE])
+        elif extension == '.css':
+            data = self.rewrite(path, data, CSS_REFERENCES)
+        name = path if extension in PAGE_EXTENSIONS else hashed_name(path, data)
+        destination = os.path.join(self.target, name)
+        if not os.path.exists(os.path.dirname(destination)):
+            os.makedirs(os.path.dirname(destination))
+        with open(destination, 'wb') as f:
+            f.write(data)
+        if extension in COMPRESSIBLE_EXTENSIONS:
+            for variant_extension, variant in compress(data).items():
+                with open(destination + variant_extension, 'wb') as f:
+                    f.write(variant)
+        self._building.discard(path)
+        self.built[path] = name
+        return name
+
+    def rewrite(self, path, data, patterns):
+        directory = posixpath.dirname(path)
+
+        def replace(match):
+            reference = match.group(2)
+            if ':' in reference or reference.startswith(('/', '#')):
+                return match.group(0) # absolute, data: or an anchor
+            cut = min([i for i in (reference.find('?'), reference.find('#')) if i >= 0] or [len(reference)])
+            referenced = posixpath.normpath(posixpath.join(directory, reference[:cut]))
+            if referenced not in self.files or referenced in self._building:
+                return match.group(0) # missing (e.g. a font format that was never added) or an import cycle
+            built = posixpath.relpath(self.output(referenced), directory or '.')
+            return match.group(1) + built + reference[cut:] + match.group(3)
+
+        text = data.decode('utf-8')
+        for pattern in patterns:
+            text = pattern.sub(replace, text)
+        return text.encode('utf-8')
+
+
+def build(source, target):
+    return Builder(source, target).build()
+
+
+#########
+# SERVE
+#########
+
+class Asset(object):
+
+    def __init__(self, path, immutable):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.etag = content_hash(self.data)
+        extension = os.path.splitext(path)[1].lower()
+        self.mimetype = MIMETYPES.get(extension) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.mimetype.startswith('text/') or self.mimetype == 'application/javascript':
+            self.mimetype += '; charset=utf-8'
+        self.cache_control = CACHE_IMMUTABLE if immutable else CACHE_REVALIDATE
+        self.variants = {}
+        for encoding, variant_extension in ENCODINGS:
+            if os.path.exists(path + variant_extension):
+                with open(path + variant_extension, 'rb') as f:
+                    self.variants[encoding] = f.read()
+
+
+def accepted_encodings(header):
+    accepted = set()
+    for token in (header or '').split(','):
+        parts = [part.strip() for part in token.split(';')]
+        quality = [part for part in parts[1:] if part.startswith('q=')]
+        try:
+            if quality and float(quality[0][2:]) <= 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(parts[0].lower())
+    return accepted
+
+
+class Bundle(object):
+    """The files of a build (or any directory), in memory. Files named in its manifest are immutable."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        manifest = {}
+        if os.path.exists(os.path.join(directory, MANIFEST)):
+            with open(os.path.join(directory, MANIFEST)) as f:
+                manifest = json.load(f)
+        immutable = set(name for path, name in manifest.items() if name != path)
+        self.assets = {}
+        variants = tuple(variant_extension for encoding, variant_extension in ENCODINGS)
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                if filename == MANIFEST or filename.endswith(variants):
+                    continue
+                path = os.path.relpath(os.path.join(root, filename), directory).replace(os.sep, '/')
+                self.assets[path] = Asset(os.path.join(root, filename), path in immutable)
+        logger.info("Serving %i files from %s" % (len(self.assets), directory))
+
+    def response(self, filename, accept_encoding=None, if_none_match=None):
+        """Status, headers and body for a request of filename."""
+        if not filename or filename.endswith('/'):
+            filename += 'index.html'
+        asset = self.assets.get(filename)
+        if asset is None:
+            return 404, {}, b''
+        accepted = accepted_encodings(accept_encoding)
+        encoding = ([encoding for encoding, _ in ENCODINGS if encoding in asset.variants and encoding in accepted] or [None])[0]
+        etag = '"%s%s"' % (asset.etag, '-' + encoding if encoding else '')
+        headers = {'Content-Type': asset.mimetype, 'Cache-Control': asset.cache_control, 'ETag': etag,
+                   'Vary': 'Accept-Encoding'}
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        if if_none_match and (if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]):
+            return 304, headers, b''
+        return 200, headers, asset.variants[encoding] if encoding else asset.data
+
+
+bundle = None # set when the service starts with --ui
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the controller for --ui: hashed filenames and precompressed variants.')
+    parser.add_argument('source', nargs='?', default='public')
+    parser.add_argument('target', nargs='?', default='dist')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if brotli is None:
+        logger.warning("brotli is not installed, only gzip variants are written.")
+    build(args.source, args.target)
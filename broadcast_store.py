@@ -0,0 +1,76 @@
+import bisect
+
+# Time-indexed store for the broadcasts of the schedule horizon.
+# Broadcasts are kept sorted by start for "what is on at t" lookups
+# and by instance_id for diffing a freshly loaded schedule against what is already scheduled.
+
+
+def instance_id(r):
+    return int(r['instance_id'])
+
+
+class BroadcastStore(object):
+
+    def __init__(self, key=instance_id):
+        self.key = key # unique id of a broadcast dict
+        self.by_id = {}
+        self._starts = []
+        self._broadcasts = []
+
+    def __len__(self):
+        return len(self._broadcasts)
+
+    def __iter__(self):
+        return iter(list(self._broadcasts))
+
+    def __contains__(self, id):
+        return id in self.by_id
+
+    def add(self, broadcast):
+        id = broadcast.get_unique_id()
+        if id in self.by_id:
+            self.remove(id)
+        i = bisect.bisect_right(self._starts, broadcast.start)
+        self._starts.insert(i, broadcast.start)
+        self._broadcasts.insert(i, broadcast)
+        self.by_id[id] = broadcast
+
+    def remove(self, id):
+        broadcast = self.by_id.pop(id)
+        i = self._broadcasts.index(broadcast)
+        del self._starts[i]
+        del self._broadcasts[i]
+        return broadcast
+
+    def reindex(self, broadcast):
+        # after load_dict() changed start / end
+        self.remove(broadcast.get_unique_id())
+        self.add(broadcast)
+
+    def at(self, t):
+        """The broadcast running at t, or None. Shows do not overlap in Airtime, so only the last one started counts."""
+        i = bisect.bisect_right(self._starts, t) - 1
+        if i >= 0 and self._broadcasts[i].end > t:
+            return self._broadcasts[i]
+        return None
+
+    def upcoming(self, t, n=None):
+        """Broadcasts running at or starting after t, sorted by start."""
+        i = bisect.bisect_right(self._starts, t)
+        if i > 0 and self._broadcasts[i - 1].end > t:
+            i -= 1
+        return self._broadcasts[i:i + n if n else None]
+
+    def diff(self, dicts):
+        """Compares a loaded schedule with the store. Returns (added dicts, changed dicts, removed ids)."""
+        added, changed = [], []
+        seen = set()
+        for r in dicts:
+            id = self.key(r)
+            seen.add(id)
+            if id not in self.by_id:
+                added.append(r)
+            elif not self.by_id[id].is_same_dict(r):
+                changed.append(r)
+        removed = [id for id in self.by_id if id not in seen]
+        return added, changed, removed
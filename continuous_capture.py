@@ -0,0 +1,277 @@
+import calendar
+import datetime
+import glob
+import logging
+import os
+import re
+import threading
+import time
+
+from mp3 import FrameIndex
+from status_stream import status
+from stream_engine import StreamCaptureEngine
+
+# Continuous capture mode.
+# One native engine records the stream 24/7 into segment files, while a frame index
+# (wall-clock time -> byte offset) is written next to each segment.
+# Per-show files are cut out of the segments afterwards by copying byte ranges,
+# so shows can also be re-cut later, e.g. when the schedule was edited after the fact.
+# The engine reconnects by itself, but it gives up when the first connection fails. A supervisor thread starts
+# a new engine (in a new segment) then, with exponential backoff while it keeps failing, and raises an alarm.
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SECONDS = 24 * 60 * 60
+SEGMENT_PATTERN = 'capture-%Y-%m-%d-%H-%M-%S'
+SEGMENT_EXTENSION = '.mp3'
+INDEX_EXTENSION = '.idx'
+KEEP_DAYS = 7
+SECONDS_EXPORT_DELAY = 10 # the stream arrives a bit late, wait for the last frames of a show
+COPY_CHUNK_SIZE = 1024 * 1024
+SECONDS_SUPERVISE = 1 # check of the engine, 0 for no supervisor
+SECONDS_BACKOFF = 1 # until the next restart while the engine keeps failing, doubled every time
+SECONDS_BACKOFF_MAX = 60
+UTC_OFFSET = re.compile(r'(Z|([+-])(\d\d):?(\d\d))$')
+
+
+def timestamp(dt):
+    """Seconds since the epoch for naive (local time) and timezone aware datetimes."""
+    if dt.tzinfo is None:
+        return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1e6
+
+
+def parse_time(value):
+    """
+    Local time as used in filenames, e.g. 2020-07-21T20:00:00 or 2020-07-21 20:00:00.5.
+    With Z or an offset (2020-07-21T18:00:00Z, 2020-07-21T20:00:00+02:00) it is converted to local time.
+    Returns a naive datetime.
+    """
+    offset = UTC_OFFSET.search(value)
+    text = value[:offset.start()] if offset else value
+    text = text.strip().replace('T', ' ')
+    for fmt in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+        try:
+            dt = datetime.datetime.strptime(text, fmt)
+            break
+        except ValueError:
+            pass
+    else:
+        raise ValueError("Can not parse time %r" % value)
+    if not offset:
+        return dt
+    if offset.group(2):
+        minutes = int(offset.group(3)) * 60 + int(offset.group(4))
+        dt -= datetime.timedelta(minutes=minutes if offset.group(2) == '+' else -minutes)
+    return datetime.datetime.fromtimestamp(calendar.timegm(dt.timetuple()) + dt.microsecond / 1e6)
+
+
+def copy_range(src, dst, offset, length):
+    # kernel side copy where possible, chunked copy otherwise
+    sendfile = getattr(os, 'sendfile', None)
+    if sendfile:
+        try:
+            while length > 0:
+                sent = sendfile(dst.fileno(), src.fileno(), offset, length)
+                if sent == 0:
+                    break
+                offset += sent
+                length -= sent
+            return
+        except OSError:
+            pass
+    src.seek(offset)
+    while length > 0:
+        data = src.read(min(COPY_CHUNK_SIZE, length))
+        if not data:
+            break
+        dst.write(data)
+        length -= len(data)
+
+
+class CaptureSegment(object):
+
+    def __init__(self, path, index=None):
+        self.path = path
+        self.index_path = os.path.splitext(path)[0] + INDEX_EXTENSION
+        self.start = time.mktime(time.strptime(os.path.splitext(os.path.basename(path))[0], SEGMENT_PATTERN))
+        self.index = index # only kept in memory for the segment being written
+
+    def load_index(self):
+        return self.index or FrameIndex.load(self.index_path)
+
+    def remove(self):
+        for path in (self.path, self.index_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class ContinuousCapture(object):
+
+    def __init__(self, url, directory, segment_seconds=SEGMENT_SECONDS, keep_days=KEEP_DAYS,
+                 supervise_seconds=SECONDS_SUPERVISE, clock=time.time):
+        self.url = url
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.keep_days = keep_days
+        self.supervise_seconds = supervise_seconds
+        self.clock = clock
+        self.engine = None
+        self.segments = []
+        self.restarts = 0
+        self.down_since = None # since when no engine is receiving
+        self._backoff = SECONDS_BACKOFF
+        self._next_restart = 0
+        self._rotating = False
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def segment_path(self, t):
+        name = time.strftime(SEGMENT_PATTERN, time.localtime(t))
+        return os.path.join(self.directory, name + SEGMENT_EXTENSION)
+
+    def start(self):
+        if self.running(): return
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.segments = sorted((CaptureSegment(path) for path in glob.glob(os.path.join(self.directory, '*' + SEGMENT_EXTENSION))),
+                               key=lambda s: s.start)
+        self._stop_event.clear()
+        self._start_engine()
+        logger.info("Continuous capture started in %s" % self.directory)
+        if self.supervise_seconds:
+            thread = threading.Thread(target=self.supervise, name='capture-supervisor')
+            thread.daemon = True
+            thread.start()
+
+    def _start_engine(self):
+        # segment names have seconds, a restart must not write over the segment of the engine that failed
+        path = self.segment_path(max(time.time(), self.segments[-1].start + 1 if self.segments else 0))
+        self._open_segment(path)
+        self.engine = StreamCaptureEngine(self.url, path)
+        self.engine.taps.append(self._tap)
+        self.engine.start()
+
+    def supervise(self):
+        while not self._stop_event.wait(self.supervise_seconds):
+            try:
+                self.check()
+            except Exception as e:
+                logger.exception("Capture check failed: %s" % e)
+
+    def check(self):
+        t = self.clock()
+        if self._stop_event.is_set():
+            return
+        if self.running():
+            if self.down_since is not None and self.engine.started is not None:
+                logger.info("Continuous capture receives again after %.1f seconds." % (t - self.down_since))
+                status.publish('alarm', {'capture_running': True, 'directory': self.directory})
+                self.down_since = None
+                self._backoff = SECONDS_BACKOFF
+            return
+        if self.down_since is None:
+            self.down_since = t
+            status.publish('alarm', {'capture_running': False, 'directory': self.directory})
+        if t < self._next_restart:
+            return
+        logger.error("Continuous capture stopped, restarting it (%i restarts)." % self.restarts)
+        self._start_engine()
+        self.restarts += 1
+        self._next_restart = t + self._backoff
+        self._backoff = min(self._backoff * 2, SECONDS_BACKOFF_MAX)
+
+    def stop(self):
+        self._stop_event.set()
+        if not self.engine: return
+        self.engine.terminate()
+        self.engine.wait()
+        with self._lock:
+            self.segments[-1].index.close()
+
+    def running(self):
+        return bool(self.engine) and self.engine.poll() is None
+
+    def _open_segment(self, path):
+        with self._lock:
+            if self.segments and self.segments[-1].index:
+                self.segments[-1].index.close()
+                self.segments[-1].index = None
+            segment = CaptureSegment(path)
+            segment.index = FrameIndex(segment.index_path)
+            self.segments.append(segment)
+            self._rotating = False
+            self._remove_old_segments()
+
+    def _remove_old_segments(self):
+        keep_after = time.time() - self.keep_days * 24 * 60 * 60
+        # a segment is old when the following one started before keep_after
+        while len(self.segments) > 1 and self.segments[1].start < keep_after:
+            logger.info("Removing old capture segment %s" % self.segments[0].path)
+            self.segments.pop(0).remove()
+
+    def _tap(self, data, t, boundaries):
+        # runs in the engine thread for every chunk
+        if self.engine.filename != self.segments[-1].path:
+            self._open_segment(self.engine.filename)
+        if boundaries:
+            self.segments[-1].index.append(boundaries[0] - self.engine.file_start, t)
+        if not self._rotating and t - self.segments[-1].start >= self.segment_seconds:
+            self._rotating = True
+            self.engine.request_cut(self.segment_path(t))
+
+    def export(self, start, end, filename):
+        """Copies everything recorded between the timestamps start and end to filename. Returns the number of bytes."""
+        if self.engine:
+            self.engine.flush()
+        with self._lock:
+            segments = list(self.segments)
+            if segments and segments[-1].index:
+                segments[-1].index.flush()
+
+        ranges = []
+        for i, segment in enumerate(segments):
+            segment_end = segments[i + 1].start if i + 1 < len(segments) else time.time()
+            if segment_end <= start or segment.start >= end or not os.path.exists(segment.path):
+                continue
+            index = segment.load_index()
+            begin = index.offset_at(start) if start > segment.start else 0
+            if begin is None:
+                continue
+            finish = index.offset_at(end)
+            if finish is None:
+                finish = os.path.getsize(segment.path)
+            if finish > begin:
+                ranges.append((segment.path, begin, finish - begin))
+
+        if not ranges:
+            raise ValueError("Nothing was captured between %s and %s." % (time.ctime(start), time.ctime(end)))
+
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        size = 0
+        with open(filename + '.part', 'wb') as dst:
+            for path, offset, length in ranges:
+                with open(path, 'rb') as src:
+                    copy_range(src, dst, offset, length)
+                size += length
+        os.rename(filename + '.part', filename)
+        logger.info("Exported %i bytes to %s" % (size, filename))
+        return size
+
+    def status(self):
+        return {
+            'running': self.running(),
+            'down_since': datetime.datetime.fromtimestamp(self.down_since).isoformat() if self.down_since else None,
+            'restarts': self.restarts,
+            'directory': self.directory,
+            'segments': len(self.segments),
+            'current_segment': self.segments[-1].path if self.segments else None,
+            'first_capture': datetime.datetime.fromtimestamp(self.segments[0].start).isoformat() if self.segments else None,
+        }
+
+
+capture = None # set when running in continuous capture mode
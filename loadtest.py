@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+import argparse
+import threading
+import time
+
+import requests
+
+# Load test of the API of a running recorder, e.g. to compare --server waitress and --server werkzeug:
+#
+#     python loadtest.py http://localhost:5000/status-summary/ --clients 20 --seconds 30
+#
+# Every client sends the next request as soon as it has the response (keep-alive) and the requests per second,
+# latency percentiles and errors of all of them are printed at the end.
+# Do not run it against a recorder with --airtime-conf unless the Airtime cache (--api-cache-ttl) is warm,
+# otherwise Airtime is load tested as well.
+
+SECONDS_TIMEOUT = 10
+
+
+def client(url, until, latencies, errors, lock):
+    session = requests.Session()
+    while time.time() < until:
+        started = time.time()
+        try:
+            response = session.get(url, timeout=SECONDS_TIMEOUT)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            with lock:
+                errors.append(type(e).__name__)
+            continue
+        with lock:
+            latencies.append(time.time() - started)
+
+
+def percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)] if values else 0
+
+
+def run(url, clients, seconds):
+    latencies, errors, lock = [], [], threading.Lock()
+    until = time.time() + seconds
+    threads = [threading.Thread(target=client, args=(url, until, latencies, errors, lock)) for _ in range(clients)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    latencies.sort()
+    return {'requests': len(latencies), 'errors': len(errors), 'requests_per_second': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.5), 'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else 0}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test of a route of the recorder API.')
+    parser.add_argument('url', help='e.g. http://localhost:5000/status-summary/')
+    parser.add_argument('--clients', type=int, default=10, help='Concurrent clients.')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of the test.')
+    args = parser.parse_args()
+
+    result = run(args.url, args.clients, args.seconds)
+    print("%(requests)i requests, %(errors)i errors, %(requests_per_second).1f requests/s" % result)
+    print("latency p50 %.1f ms, p99 %.1f ms, max %.1f ms" % (result['p50'] * 1000, result['p99'] * 1000, result['max'] * 1000))
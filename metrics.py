@@ -0,0 +1,155 @@
+import bisect
+import threading
+import time
+
+# Small, dependency free metrics: histograms with fixed buckets and counters, grouped by label values.
+# Observing is a bisect and a few additions under a per-metric lock,
+# so recording threads are never blocked by someone reading the values.
+# exposition() renders all of them in the Prometheus text format.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+INF = '+Inf' # upper bound of the last bucket, as in Prometheus. float('inf') is not valid JSON.
+
+REGISTRY = [] # all families, in the order they were created
+COLLECTORS = [] # functions returning (name, help, type, [(labels dict, value)]) when scraped
+
+
+class Histogram(object):
+
+    type = 'histogram'
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative, buckets = 0, []
+        for le, n in zip(self.buckets + (INF,), counts):
+            cumulative += n
+            buckets.append((le, cumulative))
+        return {'buckets': buckets, 'sum': total, 'count': count}
+
+    def quantile(self, q):
+        """Upper bound of the bucket the q-quantile falls into, INF above the largest bucket."""
+        snapshot = self.snapshot()
+        if not snapshot['count']:
+            return None
+        rank = q * snapshot['count']
+        for le, cumulative in snapshot['buckets']:
+            if cumulative >= rank:
+                return le
+
+
+class Counter(object):
+
+    type = 'counter'
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class _Timer(object):
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.time() - self.started)
+
+
+class Family(object):
+    """One metric per combination of label values, e.g. one latency histogram per API action."""
+
+    def __init__(self, name, help, labels=(), factory=Histogram, register=True):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.factory = factory
+        self.type = factory().type # factories may be functions returning histograms with other buckets
+        self._children = {}
+        self._lock = threading.Lock()
+        if register:
+            if any(family.name == name for family in REGISTRY):
+                # observations of the second one would never be exported
+                raise ValueError("Metric %s is defined twice." % name)
+            REGISTRY.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self.factory())
+        return child
+
+    def children(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+    def snapshot(self):
+        return dict((','.join(str(v) for v in values), child.snapshot()) for values, child in self.children())
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, ('%s' % (v,)).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{%s}' % ','.join('%s="%s"' % pair for pair in escaped)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition(families=None, collectors=None):
+    """All metrics in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for family in REGISTRY if families is None else families:
+        lines.append('# HELP %s %s' % (family.name, family.help))
+        lines.append('# TYPE %s %s' % (family.name, family.type))
+        for values, child in family.children():
+            snapshot = child.snapshot()
+            if family.type == 'histogram':
+                for le, count in snapshot['buckets']:
+                    lines.append('%s_bucket%s %s' % (family.name, _labels(family.label_names, values, [('le', _number(le))]), count))
+                lines.append('%s_sum%s %s' % (family.name, _labels(family.label_names, values), _number(snapshot['sum'])))
+                lines.append('%s_count%s %s' % (family.name, _labels(family.label_names, values), snapshot['count']))
+            else:
+                lines.append('%s%s %s' % (family.name, _labels(family.label_names, values), _number(snapshot)))
+    for collect in COLLECTORS if collectors is None else collectors:
+        name, help, type, samples = collect()
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, type))
+        for labels, value in samples:
+            lines.append('%s%s %s' % (name, _labels(sorted(labels), [labels[k] for k in sorted(labels)]), _number(value)))
+    return '\n'.join(lines) + '\n'
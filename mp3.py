@@ -0,0 +1,207 @@
+import bisect
+import collections
+import os
+import struct
+from array import array
+
+# Minimal MPEG audio frame parsing.
+# We never decode audio here, we only need to know where frames start,
+# so files can be cut (and later spliced) without breaking a frame.
+
+FrameHeader = collections.namedtuple('FrameHeader', 'length bitrate samplerate samples channels')
+
+# kbit/s, index 1-14 (0 is "free", 15 is invalid)
+BITRATES = {
+    (1, 1): (32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+# by version bits: 0 = MPEG 2.5, 2 = MPEG 2, 3 = MPEG 1
+SAMPLERATES = {
+    0: (11025, 12000, 8000),
+    2: (22050, 24000, 16000),
+    3: (44100, 48000, 32000),
+}
+
+HEADER_SIZE = 4
+
+
+def parse_header(buf, pos=0):
+    """Returns a FrameHeader for the frame starting at buf[pos] or None if there is no valid header."""
+    if pos < 0 or pos + HEADER_SIZE > len(buf):
+        return None
+    h = struct.unpack_from('>I', buf, pos)[0]
+    if h & 0xFFE00000 != 0xFFE00000:
+        return None
+    version_bits = (h >> 19) & 3
+    layer_bits = (h >> 17) & 3
+    bitrate_index = (h >> 12) & 0xF
+    samplerate_index = (h >> 10) & 3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or samplerate_index == 3:
+        return None
+
+    layer = 4 - layer_bits
+    version = 1 if version_bits == 3 else 2
+    bitrate = BITRATES[(version, layer)][bitrate_index - 1] * 1000
+    samplerate = SAMPLERATES[version_bits][samplerate_index]
+    padding = (h >> 9) & 1
+    channels = 1 if ((h >> 6) & 3) == 3 else 2
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // samplerate + padding) * 4
+    else:
+        samples = 576 if (layer == 3 and version == 2) else 1152
+        length = samples // 8 * bitrate // samplerate + padding
+
+    return FrameHeader(length, bitrate, samplerate, samples, channels)
+
+
+def find_frame(buf, pos=0):
+    """
+    Returns the offset of the first frame at or after pos.
+    A header only counts if the next frame header follows it (or the buffer ends before),
+    which filters out most sync words that are just audio data.
+    """
+    while True:
+        pos = buf.find(b'\xff', pos)
+        if pos < 0:
+            return None
+        header = parse_header(buf, pos)
+        if header is not None:
+            following = pos + header.length
+            if following + HEADER_SIZE > len(buf) or parse_header(buf, following) is not None:
+                return pos
+        pos += 1
+
+
+class FrameTracker(object):
+    """
+    Follows frame boundaries across the chunks of a stream.
+    feed() returns the absolute offsets of all frames starting in the chunk.
+    """
+
+    def __init__(self):
+        self.offset = 0 # bytes fed so far
+        self.next_frame = None # absolute offset of the next expected header, None if out of sync
+        self.frames = 0
+        self.samples = 0
+        self.header = None # last header seen
+        self._tail = b''
+
+    def feed(self, data):
+        buf = self._tail + data if self._tail else data
+        base = self.offset - len(self._tail)
+        self.offset += len(data)
+        boundaries = []
+
+        pos = self.next_frame - base if self.next_frame is not None else 0
+        while pos + HEADER_SIZE <= len(buf):
+            header = parse_header(buf, pos) if self.next_frame is not None else None
+            if header is None:
+                # (re-)synchronize
+                found = find_frame(buf, pos)
+                if found is None:
+                    self.next_frame = None
+                    pos = max(pos, len(buf) - HEADER_SIZE + 1)
+                    break
+                pos = found
+                self.next_frame = base + pos
+                continue
+            boundaries.append(base + pos)
+            self.header = header
+            self.frames += 1
+            self.samples += header.samples
+            pos += header.length
+            self.next_frame = base + pos
+
+        self._tail = buf[pos:] if pos < len(buf) else b''
+        return boundaries
+
+    def resync(self):
+        # the next data does not continue the last frame, e.g. after a reconnect
+        self.next_frame = None
+        self._tail = b''
+
+    def duration(self):
+        """Seconds of audio in the frames seen so far."""
+        if not self.header:
+            return 0.0
+        return float(self.samples) / self.header.samplerate
+
+
+class FrameIndex(object):
+    """
+    Maps wall-clock time to byte offsets of frames in a file, built while the file is written.
+    Lookups are a binary search. With a path, every entry is also appended to a sidecar file,
+    so the index survives restarts.
+    """
+
+    RECORD = struct.Struct('<dd') # time, offset
+
+    def __init__(self, path=None):
+        self.path = path
+        self.times = array('d')
+        self.offsets = array('d') # doubles are exact up to 2^53 bytes
+        self._file = None
+        if path:
+            if os.path.exists(path):
+                self._load(path)
+            self._file = open(path, 'ab')
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        index._load(path)
+        return index
+
+    def _load(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        size = self.RECORD.size
+        for pos in range(0, len(data) - size + 1, size):
+            t, offset = self.RECORD.unpack_from(data, pos)
+            self.times.append(t)
+            self.offsets.append(offset)
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, offset, timestamp):
+        if self.times and timestamp < self.times[-1]:
+            timestamp = self.times[-1] # clock went backwards, keep the index sorted
+        self.times.append(timestamp)
+        self.offsets.append(offset)
+        if self._file:
+            self._file.write(self.RECORD.pack(timestamp, offset))
+
+    def offset_at(self, timestamp):
+        """Offset of the first indexed frame at or after timestamp. None if timestamp is after the last entry."""
+        i = bisect.bisect_left(self.times, timestamp)
+        if i == len(self.times):
+            return None
+        return int(self.offsets[i])
+
+    def time_at(self, offset):
+        """Time of the last indexed frame at or before offset."""
+        i = bisect.bisect_right(self.offsets, offset)
+        return self.times[max(i - 1, 0)] if self.times else None
+
+    def first_time(self):
+        return self.times[0] if self.times else None
+
+    def last_time(self):
+        return self.times[-1] if self.times else None
+
+    def flush(self):
+        if self._file:
+            self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
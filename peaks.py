@@ -0,0 +1,118 @@
+import os
+import struct
+import threading
+
+import numpy as np
+
+# Waveform peaks of recordings in the .dat format of audiowaveform (version 1, 8 bit),
+# which waveform-data.js and peaks.js read. There is one file per zoom level, written while
+# recording from the samples the level analysis decodes anyway, so they are complete at stop.
+# Coarser levels are computed from the min / max pairs of the finest one, not from the samples.
+
+RESOLUTIONS = (256, 2048, 16384) # samples per pixel, each a multiple of the previous one
+HEADER = struct.Struct('<iIiiI') # version, flags (1: 8 bit), sample rate, samples per pixel, length
+VERSION = 1
+FLAG_8_BIT = 1
+
+
+def peaks_path(recording, samples_per_pixel):
+    return '%s.peaks-%i.dat' % (recording, samples_per_pixel)
+
+
+class PeaksWriter(object):
+
+    def __init__(self, recording, rate, resolutions=RESOLUTIONS):
+        for finer, coarser in zip(resolutions, resolutions[1:]):
+            assert coarser % finer == 0
+        self.rate = rate
+        self.resolutions = tuple(resolutions)
+        self._lock = threading.Lock()
+        self._files = []
+        self.open(recording)
+
+    def open(self, recording):
+        """Starts the files of a new recording, e.g. after a cut."""
+        with self._lock:
+            self._close()
+            self.recording = recording
+            self._files = []
+            for samples_per_pixel in self.resolutions:
+                f = open(peaks_path(recording, samples_per_pixel), 'w+b')
+                f.write(HEADER.pack(VERSION, FLAG_8_BIT, self.rate, samples_per_pixel, 0))
+                self._files.append(f)
+            self._lengths = [0] * len(self.resolutions)
+            self._pending_samples = np.zeros(0, dtype='<i2')
+            # min and max of the finest level not yet used by the coarser ones
+            self._pending = [(np.zeros(0, dtype='<i2'), np.zeros(0, dtype='<i2')) for _ in self.resolutions]
+
+    def add_samples(self, samples):
+        with self._lock:
+            if not self._files:
+                return
+            samples = np.concatenate((self._pending_samples, samples))
+            n = len(samples) // self.resolutions[0]
+            blocks = samples[:n * self.resolutions[0]].reshape(n, self.resolutions[0])
+            self._pending_samples = samples[n * self.resolutions[0]:]
+            mins, maxs = blocks.min(axis=1), blocks.max(axis=1)
+            self._write(0, mins, maxs)
+            for level in range(1, len(self.resolutions)):
+                factor = self.resolutions[level] // self.resolutions[level - 1]
+                mins = np.concatenate((self._pending[level][0], mins))
+                maxs = np.concatenate((self._pending[level][1], maxs))
+                n = len(mins) // factor
+                self._pending[level] = (mins[n * factor:], maxs[n * factor:])
+                mins = mins[:n * factor].reshape(n, factor).min(axis=1)
+                maxs = maxs[:n * factor].reshape(n, factor).max(axis=1)
+                self._write(level, mins, maxs)
+
+    def _write(self, level, mins, maxs):
+        if not len(mins):
+            return
+        pairs = np.empty(2 * len(mins), dtype=np.int8)
+        pairs[0::2] = mins >> 8
+        pairs[1::2] = maxs >> 8
+        f = self._files[level]
+        f.seek(0, os.SEEK_END)
+        pairs.tofile(f)
+        self._lengths[level] += len(mins)
+        # keep the header valid, so the file can be read while recording
+        f.seek(HEADER.size - 4)
+        f.write(struct.pack('<I', self._lengths[level]))
+        f.flush()
+
+    def _close(self):
+        for f in self._files:
+            f.close()
+        self._files = []
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+def zoom_levels(recording):
+    """Header fields of the peaks files of a recording, by samples per pixel."""
+    levels = {}
+    directory, name = os.path.split(recording)
+    for filename in os.listdir(directory or '.'):
+        if filename.startswith(name + '.peaks-') and filename.endswith('.dat'):
+            with open(os.path.join(directory, filename), 'rb') as f:
+                version, flags, rate, samples_per_pixel, length = HEADER.unpack(f.read(HEADER.size))
+            levels[samples_per_pixel] = {'sample_rate': rate, 'samples_per_pixel': samples_per_pixel, 'length': length,
+                                         'seconds': float(length) * samples_per_pixel / rate}
+    return levels
+
+
+def read_range(recording, samples_per_pixel, start=0, end=None):
+    """
+    A .dat file with the pixels between the seconds start and end of one zoom level.
+    Only the header and the requested range are read.
+    """
+    with open(peaks_path(recording, samples_per_pixel), 'rb') as f:
+        version, flags, rate, samples_per_pixel, length = HEADER.unpack(f.read(HEADER.size))
+        bytes_per_pair = 2 if flags & FLAG_8_BIT else 4
+        first = min(int(start * rate // samples_per_pixel), length)
+        last = length if end is None else max(first, min(int(-(-end * rate // samples_per_pixel)), length))
+        f.seek(HEADER.size + first * bytes_per_pair)
+        data = f.read((last - first) * bytes_per_pair)
+    return HEADER.pack(version, flags, rate, samples_per_pixel, len(data) // bytes_per_pair) + data
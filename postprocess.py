@@ -0,0 +1,295 @@
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+from collections import deque
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from metrics import Family
+from status_stream import status
+
+# Everything that happens to a recording after its file was closed: rename to the final name,
+# remove streamripper's cue sheets, ID3 tags from the broadcast, checksum and upload to Airtime.
+# Jobs are queued and run by a few worker threads, so stopping or cutting returns right away.
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 2
+KEEP_JOBS = 20 # finished jobs listed in the status
+COPY_BUFFER_SIZE = 1024 * 1024
+
+STAGE_SECONDS = Family('postprocess_stage_seconds', 'Duration of the post-processing stages', ['stage'])
+
+
+class PostProcessJob(object):
+
+    def __init__(self, path, filename, metadata=None):
+        self.source = path # as it was written
+        self.path = path # the closed file, where it is now
+        self.filename = filename # its final name
+        self.metadata = metadata or {} # name, description, image_path, instance_id of the broadcast
+        self.queued = time.time()
+        self.stage = 'queued'
+        self.timings = {}
+        self.errors = {}
+        self.sha256 = None
+
+    def to_dict(self):
+        return {'filename': self.filename, 'stage': self.stage, 'queued': self.queued,
+                'timings': self.timings, 'errors': self.errors, 'sha256': self.sha256}
+
+
+#########
+# STAGES
+#########
+
+def rename(job):
+    if job.path != job.filename:
+        directory = os.path.dirname(job.filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        os.rename(job.path, job.filename)
+        # files written next to the recording (levels, peaks, ...) are named like it plus an extension
+        directory, name = os.path.split(job.path)
+        for sidecar in os.listdir(directory or os.getcwd()):
+            if sidecar.startswith(name + '.'):
+                os.rename(os.path.join(directory, sidecar), job.filename + sidecar[len(name):])
+        job.path = job.filename
+        status.publish('recorder', {'action': 'rename', 'filename': job.filename})
+
+
+def remove_cues(job):
+    # streamripper always writes a cue sheet with -a, which we need
+    for cue in glob.glob(os.path.join(os.path.dirname(job.source) or os.getcwd(), '*.cue')):
+        try:
+            os.remove(cue)
+        except OSError:
+            pass
+
+
+def write_tags(job):
+    if os.path.splitext(job.path)[1].lower() != '.mp3' or not job.metadata:
+        return
+    tag = id3_tag(job.metadata)
+    with open(job.path, 'rb') as src:
+        skip = id3_size(src.read(10))
+        src.seek(skip)
+        with open(job.path + '.tagged', 'wb') as dst:
+            dst.write(tag)
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+    os.rename(job.path + '.tagged', job.path)
+
+
+def checksum(job):
+    digest = hashlib.sha256()
+    with open(job.path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+            digest.update(chunk)
+    job.sha256 = digest.hexdigest()
+    with open(job.path + '.sha256', 'w') as f:
+        # same format as sha256sum, so `sha256sum -c` can check it
+        f.write("%s  %s\n" % (job.sha256, os.path.basename(job.path)))
+
+
+#########
+# ID3v2.3
+#########
+
+def _unicode(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return u'%s' % value
+
+
+def _syncsafe(n):
+    return struct.pack('>4B', (n >> 21) & 0x7f, (n >> 14) & 0x7f, (n >> 7) & 0x7f, n & 0x7f)
+
+
+def _frame(id, data):
+    return id + struct.pack('>IH', len(data), 0) + data
+
+
+def _text(value):
+    # encoding 1: UTF-16 with BOM
+    return b'\x01' + _unicode(value).encode('utf-16')
+
+
+def _description(value):
+    return _unicode(value).encode('utf-16') + b'\x00\x00'
+
+
+def id3_tag(metadata):
+    frames = []
+    if metadata.get('name'):
+        frames.append(_frame(b'TIT2', _text(metadata['name'])))
+    if metadata.get('station'):
+        frames.append(_frame(b'TPE1', _text(metadata['station'])))
+    if metadata.get('description'):
+        frames.append(_frame(b'COMM', b'\x01eng' + _description(u'') + _unicode(metadata['description']).encode('utf-16')))
+    if metadata.get('instance_id') is not None:
+        frames.append(_frame(b'TXXX', b'\x01' + _description(u'airtime_instance_id') + _unicode(metadata['instance_id']).encode('utf-16')))
+    if metadata.get('image_path'):
+        frames.append(_frame(b'WXXX', b'\x01' + _description(u'image') + _unicode(metadata['image_path']).encode('latin-1', 'replace')))
+    body = b''.join(frames)
+    return b'ID3\x03\x00\x00' + _syncsafe(len(body)) + body
+
+
+def _decode(encoding, data):
+    if encoding == 1:
+        return data.decode('utf-16', 'replace').rstrip(u'\x00')
+    if encoding == 3:
+        return data.decode('utf-8', 'replace').rstrip(u'\x00')
+    return data.decode('latin-1').rstrip(u'\x00')
+
+
+def _split_description(encoding, data):
+    # the description is terminated by one (latin-1, utf-8) or two (utf-16) zero bytes
+    if encoding == 1:
+        for i in range(0, len(data) - 1, 2):
+            if data[i:i + 2] == b'\x00\x00':
+                return data[:i], data[i + 2:]
+    elif b'\x00' in data:
+        return tuple(data.split(b'\x00', 1))
+    return data, b''
+
+
+def read_id3(path):
+    """The fields written by id3_tag(), read back from the ID3v2.3 tag of the file. Empty if it has none."""
+    with open(path, 'rb') as f:
+        header = f.read(10)
+        size = id3_size(header)
+        data = f.read(size - 10) if size else b''
+    metadata = {}
+    pos = 0
+    while pos + 10 <= len(data) and data[pos:pos + 1] != b'\x00':
+        id = data[pos:pos + 4]
+        length = struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        body = data[pos + 10:pos + 10 + length]
+        pos += 10 + length
+        if not body:
+            continue
+        encoding = struct.unpack('>B', body[:1])[0]
+        if id == b'TIT2':
+            metadata['name'] = _decode(encoding, body[1:])
+        elif id == b'TPE1':
+            metadata['station'] = _decode(encoding, body[1:])
+        elif id == b'COMM':
+            metadata['description'] = _decode(encoding, _split_description(encoding, body[4:])[1])
+        elif id == b'TXXX':
+            description, value = _split_description(encoding, body[1:])
+            if _decode(encoding, description) == u'airtime_instance_id':
+                metadata['instance_id'] = int(_decode(encoding, value))
+    return metadata
+
+
+def id3_size(header):
+    """Length of the ID3v2 tag that starts with the 10 bytes header, 0 if there is none."""
+    if len(header) < 10 or header[:3] != b'ID3':
+        return 0
+    b = struct.unpack('>4B', header[6:10])
+    size = (b[0] << 21) | (b[1] << 14) | (b[2] << 7) | b[3]
+    footer = 10 if struct.unpack('>B', header[5:6])[0] & 0x10 else 0
+    return 10 + size + footer
+
+
+#########
+# WORKERS
+#########
+
+class PostProcessor(object):
+
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self.stages = [('rename', rename), ('cues', remove_cues), ('tags', write_tags), ('checksum', checksum)]
+        self.queue = queue.Queue()
+        self.active = []
+        self.finished = deque(maxlen=KEEP_JOBS)
+        self.processed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def add_stage(self, name, fn, before=None):
+        names = [n for n, _ in self.stages]
+        self.stages.insert(names.index(before) if before in names else len(self.stages), (name, fn))
+
+    def remove_stage(self, name):
+        self.stages = [(n, fn) for n, fn in self.stages if n != name]
+
+    def start(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name='postprocess-%i' % len(self._threads))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, path, filename, metadata=None):
+        """Queues a closed recording. Returns the job right away."""
+        job = PostProcessJob(path, filename, metadata)
+        self.start()
+        self.queue.put(job)
+        return job
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                break
+            with self._lock:
+                self.active.append(job)
+            try:
+                self.process(job)
+            finally:
+                with self._lock:
+                    self.active.remove(job)
+                    self.finished.append(job)
+                    self.processed += 1
+                    self.failed += bool(job.errors)
+                self.queue.task_done()
+
+    def process(self, job):
+        for name, fn in list(self.stages):
+            job.stage = name
+            started = time.time()
+            try:
+                fn(job)
+            except Exception as e:
+                logger.error("Post-processing %s failed in %s: %s" % (job.path, name, e))
+                job.errors[name] = str(e)
+            finally:
+                job.timings[name] = time.time() - started
+                STAGE_SECONDS.labels(name).observe(job.timings[name])
+        job.stage = 'done'
+        status.publish('postprocess', {'filename': job.filename, 'errors': job.errors})
+
+    def join(self):
+        self.queue.join()
+
+    def stop(self):
+        for _ in self._threads:
+            self.queue.put(None)
+        self._threads = []
+
+    def status(self):
+        with self._lock:
+            active = [job.to_dict() for job in self.active]
+            finished = [job.to_dict() for job in self.finished]
+            processed, failed = self.processed, self.failed
+        stages = {}
+        for (name,), histogram in STAGE_SECONDS.children():
+            snapshot = histogram.snapshot()
+            stages[name] = {'count': snapshot['count'], 'seconds': snapshot['sum'], 'p99': histogram.quantile(0.99)}
+        return {'queue': self.queue.qsize(), 'workers': self.workers, 'active': active, 'finished': finished,
+                'processed': processed, 'failed': failed, 'stages': stages}
+
+
+postprocessor = PostProcessor()
@@ -18,12 +18,16 @@
 # + auto-finish recordings after duration
 
 # The service is called and configured only via command line arguments.
+# With --streams-conf one process records several streams from a config file (see streams.py).
 # Each recording is handeled in a separate process (streamripper).
 # (v1 showed that doing the recording in python causes high CPU utilization and synchronizing problems.)
+# Alternatively (--engine native) one thread keeps the stream connection open and only copies bytes,
+# without decoding anything, so cuts happen on a frame boundary without losing audio.
 
 # Requirements_
 # + streamrippper (binary), alternative: python-streamripper or radiorec
 # + flask
+# + waitress (optional, see server.py)
 # + airtime_api (REQUIRES PYTHON 2!)
 
 
@@ -33,17 +37,48 @@ install_aliases()
 from flask import Flask
 from flask import jsonify
 from flask import request
+from flask import g
+from flask import stream_with_context
 from flask_cors import CORS
 import logging, os
 import threading
 import argparse
 import datetime
+import functools
 import subprocess
 from urllib.request import urlopen, urlparse
 import signal
 import sys
 import time
-from airtime_schedule import AirtimeRecordingScheduler, scheduler
+if __name__ == "__main__":
+    # the scheduler imports this module as recorder (make_recorder), that must not be a second copy
+    # whose globals (airtime_api, args, metrics) were never set up
+    sys.modules['recorder'] = sys.modules[__name__]
+from airtime_schedule import AirtimeRecordingScheduler, AirtimeHorizonScheduler, scheduler, SECONDS_PADDING
+from api_cache import CachedAirtimeApi, SECONDS_TTL, SECONDS_STALE
+from api_async import AsyncAirtimeApi
+from retry_policy import retries
+from status_stream import status, wait_slots, format_sse, SharedSummary, SECONDS_HEARTBEAT, SECONDS_REFRESH, SECONDS_LONG_POLL
+from stream_engine import StreamCaptureEngine, SECONDS_READ_TIMEOUT
+import stream_health
+import server
+import assets
+import redundant
+from redundant import RedundantCapture
+from recorder_pool import pool, POOL_SIZE, RECORDER_STARTS, RECORDER_RESTARTS, CUT_GAP
+import continuous_capture
+from continuous_capture import parse_time
+from ring_buffer import RingBuffer
+import state_store
+from postprocess import postprocessor, id3_tag, WORKERS as POSTPROCESS_WORKERS
+from upload import MultipartStream, LiveUpload, live_uploads
+from analysis import LevelAnalyzer, SIDECAR_EXTENSION as LEVELS_EXTENSION, SECONDS_DEAD_AIR
+import peaks
+import archive_index
+import retention
+import streams
+import metrics
+from metrics import Family
 
 app = Flask(__name__)
 cors = CORS(app, resources={r"/*": {"origins": "*"}})
@@ -68,19 +103,112 @@ parser = argparse.ArgumentParser(description=__doc__)
 # parser.add_argument(
 #     '-t', '--subtype', type=str, help='sound file subtype (e.g. "PCM_24")')
 parser.add_argument(
-    '-s', '--stream', required=True, type=str,
+    '-s', '--stream', type=str,
     help='Stream url to record with streamripper.')
+parser.add_argument(
+    '--streams-conf', type=str, metavar='FILE',
+    help='Record several streams in one process, configured in FILE (see streams.py). Replaces --stream and FILENAME.')
 parser.add_argument(
     '-p', '--port', type=int, required=True, help='web server port for API requests. If empty server will not be started.')
+parser.add_argument(
+    '--server', choices=('auto', 'waitress', 'werkzeug'), default='auto',
+    help='HTTP server. "auto" uses waitress if it is installed, otherwise the Werkzeug server with a thread pool.')
+parser.add_argument(
+    '--threads', type=int, default=server.THREADS,
+    help='Threads handling API requests. Every open /status-stream/ holds one of them, %i are kept for the '
+         'other requests, further status streams are refused.' % server.THREADS_RESERVED)
+parser.add_argument(
+    '--request-timeout', type=float, default=server.SECONDS_REQUEST_TIMEOUT,
+    help='Seconds to read a request or write a response before the connection is closed.')
+parser.add_argument(
+    '--ui', type=str, metavar='DIRECTORY',
+    help='Serve the controller at /ui/ from DIRECTORY, built from public/ with assets.py (or public/ itself, without long caching).')
+parser.add_argument(
+    '--engine', choices=('streamripper', 'native'), default='streamripper',
+    help='Recording engine. "native" keeps one connection to the stream and cuts without losing audio.')
+parser.add_argument(
+    '--secondary-stream', type=str, metavar='URL',
+    help='Record the same program from URL as well and fill gaps of --stream with it (needs --engine native).')
+parser.add_argument(
+    '--stall-seconds', type=float, default=stream_health.SECONDS_STALL,
+    help='Reconnect (native engine) or restart (streamripper) a recording that got no data for this long. 0 to wait for the process to end.')
+parser.add_argument(
+    '--stall-grace-seconds', type=float, default=stream_health.SECONDS_GRACE,
+    help='Time a streamripper recording gets for its first data before it counts as stalled.')
+parser.add_argument(
+    '--ring-buffer-minutes', type=float, default=0,
+    help='Keep the last minutes of the stream in a buffer, so cuts can be requested retroactively (needs --engine native).')
+parser.add_argument(
+    '--continuous-capture', type=str, metavar='DIRECTORY',
+    help='Record the stream 24/7 into DIRECTORY and cut scheduled shows out of it when they ended (instead of starting and stopping recordings).')
+parser.add_argument(
+    '--horizon-days', type=int, default=0,
+    help='Load and schedule all shows of the next days instead of only the current and the next show.')
+parser.add_argument(
+    '--state-db', type=str, metavar='FILE',
+    help='SQLite file to keep the schedule and running recordings in. After a restart, jobs are re-armed from it before Airtime is asked.')
+parser.add_argument(
+    '--pool-size', type=int, default=POOL_SIZE,
+    help='Maximum number of recordings running at the same time (manual and scheduled, including overlaps). Per scheduled stream with --streams-conf.')
+parser.add_argument(
+    '--padding', type=int, default=SECONDS_PADDING,
+    help='Seconds to start scheduled recordings earlier and stop them later. Back-to-back shows will overlap.')
+parser.add_argument(
+    '--warm-standby', type=float, default=0, metavar='SECONDS',
+    help='Connect scheduled recordings this many seconds early and start the file exactly at the start of the show (needs --engine native).')
+parser.add_argument(
+    '--archive-db', type=str, metavar='FILE',
+    help='SQLite index of all finished recordings (by show, instance id and time). Build it for an existing tree with archive_index.py.')
+parser.add_argument(
+    '--min-free-mb', type=int, default=retention.MIN_FREE_BYTES // (1024 * 1024),
+    help='Refuse to start a recording if less space would be left after it (for its scheduled duration, otherwise one hour).')
+parser.add_argument(
+    '--hot-days', type=int, default=0, help='Move recordings older than this many days to --cold-dir.')
+parser.add_argument(
+    '--cold-dir', type=str, metavar='DIRECTORY', help='Directory for old recordings, e.g. on a bigger, slower disk.')
+parser.add_argument(
+    '--cold-days', type=int, default=0, help='Delete recordings from --cold-dir after this many more days.')
+parser.add_argument(
+    '--transcode-kbps', type=int, default=0, help='Transcode MP3 recordings to this bitrate when moving them to --cold-dir.')
+parser.add_argument(
+    '--delete-incomplete', action='store_true', help='Delete incomplete recordings that were not written for an hour.')
+parser.add_argument(
+    '--postprocess-workers', type=int, default=POSTPROCESS_WORKERS,
+    help='Threads that rename, tag and checksum finished recordings in the background.')
+parser.add_argument(
+    '--no-id3-tags', action='store_true', help='Do not write ID3 tags (show name, description, ...) to finished recordings.')
+parser.add_argument(
+    '--upload', action='store_true', help='Upload finished recordings to Airtime (needs --airtime-conf).')
+parser.add_argument(
+    '--upload-live', action='store_true', help='Start uploading while recording, so the upload ends right after the show (needs --upload).')
+parser.add_argument(
+    '--analysis', action='store_true',
+    help='Decode the recording (with ffmpeg or mpg123) and keep the level of every second in a .levels file next to it.')
+parser.add_argument(
+    '--peaks', action='store_true', help='Write waveform peaks (.dat files of audiowaveform) while recording (needs --analysis).')
+parser.add_argument(
+    '--dead-air-seconds', type=int, default=SECONDS_DEAD_AIR, help='Raise a dead air alarm after this many silent seconds (needs --analysis).')
 parser.add_argument(
     '--debug', help='Output debug messages.', action='store_true')
 parser.add_argument(
     '-v', '--verbose', help='Output info messages.', action='store_true')
 parser.add_argument(
     '--airtime-conf', type=str, help='Airtime config file to read. Usually: /etc/airtime/airtime.conf')
+parser.add_argument(
+    '--api-cache-ttl', type=float, default=SECONDS_TTL, help='Seconds to serve live-info / on-air-light from cache before asking Airtime again.')
+parser.add_argument(
+    '--api-cache-stale', type=float, default=SECONDS_STALE, help='Seconds after the TTL a cached value is still served while it is refreshed in the background.')
 parser.add_argument(
     'filename', nargs='?', metavar='FILENAME', help='audio file to store recording to. Use %station and %label to include metadata, strftime() codes for time.')
 args = parser.parse_args()
+if not args.stream and not args.streams_conf:
+    parser.error("Either --stream or --streams-conf is required.")
+if args.streams_conf and args.continuous_capture:
+    parser.error("--continuous-capture records only one stream, it can not be used with --streams-conf.")
+if args.secondary_stream and args.engine != 'native':
+    parser.error("--secondary-stream needs --engine native.")
+if args.secondary_stream and args.streams_conf:
+    parser.error("Set the secondary stream per stream in the --streams-conf file.")
 
 if args.verbose:
     log.setLevel(logging.INFO)
@@ -92,12 +220,16 @@ if args.debug:
 # from past.translation import autotranslate
 # autotranslate('api_client')
 # autotranslation did not work.
-from api_client import AirtimeApiClient
+from api_client import AirtimeApiClient, API_LATENCY
 airtime_api = None
+airtime_async = None
 
 DEFAULT_FILENAME = "stream-rec_%station_%Y-%m-%d-%H-%M-%S.ext"
 MAX_DURATION_IN_SEC = 24 * 60 * 60 # 24h
 MAX_SILENCE_IN_SEC = 60 * 10 # 10min
+SECONDS_COMMIT_TIMEOUT = 5 # a prepared recording has to start writing this long after the start of the show
+
+HTTP_LATENCY = Family('http_request_seconds', "Duration of requests to this API.", ['route', 'method'])
 
 class STATES(object):
     ERROR = -2
@@ -110,6 +242,26 @@ class STATES(object):
 # HELPERS
 #########
 
+def filename_patterns():
+    if streams.streams:
+        return [stream.filename for stream in streams.streams.values()]
+    return [args.filename or DEFAULT_FILENAME]
+
+
+def recordings_roots():
+    # the directories the streams record into, without the ones inside another
+    roots = sorted(set(os.path.abspath(archive_index.pattern_root(pattern)) for pattern in filename_patterns()))
+    return [root for root in roots if not any(root.startswith(other + os.sep) for other in roots)]
+
+
+def recording_path(filename):
+    # filenames passed to the API must be inside a recordings tree
+    path = os.path.realpath(filename)
+    if not any(path.startswith(os.path.realpath(root) + os.sep) for root in recordings_roots()):
+        raise ValueError("%s is not a recording." % filename)
+    return path
+
+
 def slugify(value):
     """
     Normalizes string, converts to lowercase, removes non-alpha characters,
@@ -127,10 +279,18 @@ def slugify(value):
 #########
 
 
+def serialized(method):
+    # start, stop, restart and cut of a recorder come from requests, scheduler jobs and the watchdog, one at a time
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._control:
+            return method(self, *args, **kwargs)
+    return locked
+
+
 class StreamRecorderWithAirtime(object):
 
     # class variables
-    process = None
 
     # url =
     # start_time = None
@@ -138,14 +298,16 @@ class StreamRecorderWithAirtime(object):
     # max_duration = time.timedelta(hours=24)
     filename_pattern = DEFAULT_FILENAME
     #directory = None
-    process = None
+    process = None # per instance, see RecorderPool for how many can run at once
 
-    def __init__(self, url, filename_pattern = DEFAULT_FILENAME):
+    def __init__(self, url, filename_pattern = DEFAULT_FILENAME, check_url=True, secondary_url=None):
         self.start_time = None
 
         # check if url exists, fails if it does not
-        urlopen(url)
+        if check_url:
+            urlopen(url)
         self.url = url
+        self.secondary_url = secondary_url or args.secondary_stream
         url_name, self.extension = os.path.splitext(url)
         self.filename_pattern, filename_extension = os.path.splitext(filename_pattern)
         if not self.extension:
@@ -155,22 +317,186 @@ class StreamRecorderWithAirtime(object):
         self.directory = None
         self.filename = None
         self._filename = None
-
-    def start(self, name=None):
-        if self.running(): return
-        self.start_time = datetime.datetime.now()
-        self.generate_filename_and_directory(label='incomplete')
+        self.ring_buffer = None
+        self.analyzer = None
+        self.metadata = {} # of the broadcast, for the tags of the file
+        self.name = None
+        self.standby_name = None
+        self.refusal = None # (HTTP status, reason) of the last refused start
+        self._control = threading.RLock() # see serialized
+
+    @serialized
+    def start(self, name=None, metadata=None, duration=None):
+        # duration: expected seconds, for the disk space check
+        # returns False if it was refused, the reason is in refusal
+        if self.running(): return True
+        if not self.reserve(datetime.datetime.now(), metadata, duration):
+            return False
         self.record_stream_to_file()
-        if not name:
-            self.name = slugify(get_show_name())
-        else:
-            self.name = slugify(name)
+        self.begin_analysis()
+        self.begin_naming(name)
+        status.publish('recorder', {'action': 'start', 'filename': self.filename})
+        return True
+
+    @serialized
+    def prepare(self, at, name=None, metadata=None, duration=None):
+        """
+        Warm standby: connects to the stream now and starts the file with the first frame received at the datetime at.
+        Call commit() at that time. Only the native engine can do that, streamripper writes from the moment it runs.
+        """
+        if self.running() or args.engine != 'native':
+            return
+        if not self.reserve(at, metadata, duration):
+            return
+        self.standby_name = name
+        self.record_stream_to_file(commit_at=continuous_capture.timestamp(at))
+        self.begin_analysis()
+
+    def standby(self):
+        return self.running() and getattr(self.process, 'commit_at', None) is not None and self.process.committed is None
+
+    def commit(self, timeout=SECONDS_COMMIT_TIMEOUT):
+        """Waits until the prepared recording started its file. Returns the lateness in seconds, None if it did not start."""
+        lateness = self.process.wait_committed(timeout)
+        if lateness is None:
+            log.error("Prepared recording of %s did not start." % self._filename)
+            if self.analyzer:
+                self.analyzer.stop()
+            return None
+        self.begin_naming(self.standby_name)
+        status.publish('recorder', {'action': 'start', 'filename': self.filename, 'lateness': lateness})
+        return lateness
+
+    @serialized
+    def cancel(self):
+        # drops a prepared recording before it wrote anything, e.g. when the show was moved or removed
+        if not self.standby():
+            return
+        log.info("Cancelling prepared recording %s" % self._filename)
+        self.stop_recording()
+        if self.analyzer:
+            self.analyzer.stop()
+            self.analyzer = None
+        pool.release(self)
+        directory, name = os.path.split(os.path.abspath(self._filename))
+        for sidecar in [f for f in os.listdir(directory) if f.startswith(name + '.')]:
+            os.remove(os.path.join(directory, sidecar)) # empty levels and peaks files
+        self.process = None
+
+    def members(self):
+        # like RecorderGroup, the stream id is only set in multi-stream mode
+        return [('', self)]
+
+    def reserve(self, start_time, metadata=None, duration=None):
+        # everything that has to happen before the recording process is started
+        self.metadata = metadata or {}
+        self.start_time = start_time
+        self.generate_filename_and_directory(label='incomplete')
+        self.refusal = None
+        if retention.manager and not retention.manager.has_space(self.directory, duration):
+            self.refusal = (507, "Can not start recording. Not enough disk space in %s." % self.directory)
+        elif not pool.acquire(self):
+            self.refusal = (503, "Can not start recording. All %i recorders are busy." % pool.size)
+        if self.refusal:
+            log.error(self.refusal[1])
+            status.publish('recorder', {'action': 'refused', 'filename': self.filename, 'reason': self.refusal[1]})
+            return False
+        return True
 
+    def begin_naming(self, name=None):
+        # without a name (manual recordings) it is asked from Airtime, which must not delay the start
+        if name:
+            self.name = slugify(name)
+            self.begin_upload()
+            return
+        self.name = None
+        thread = threading.Thread(target=self.resolve_name, args=(self._filename,), name='show-name')
+        thread.daemon = True
+        thread.start()
+
+    def resolve_name(self, filename):
+        name = get_show_name()
+        if self._filename == filename: # not cut or stopped in the meantime
+            self.name = slugify(name or u'')
+            self.begin_upload()
+
+    @serialized
+    def cut(self, name=None, at=None, metadata=None):
+        # at: datetime to move the cut back to, must still be in the ring buffer
+        # returns False if the engine failed to cut at and the recording was restarted now instead
+        start_offset = None
+        if at is not None:
+            if not self.running() or not self.ring_buffer:
+                raise ValueError("Retroactive cuts need a running recording with --engine native and --ring-buffer-minutes.")
+            start_offset = self.ring_buffer.offset_at(continuous_capture.timestamp(at))
+            if start_offset is None or start_offset < self.process.file_start:
+                raise ValueError("%s is not in the buffer of the current recording." % at)
+
+        # without an engine that can swap files a cut is stop + start
+        if not self.running() or not hasattr(self.process, 'cut'):
+            self.restart('cut', name, metadata)
+            return True
+        log.debug("Recording cut called.")
+        previous_filename, previous_start_time, previous_name = self._filename, self.start_time, self.name
+        previous_metadata = self.file_metadata()
+        self.start_time = at or datetime.datetime.now()
+        self.generate_filename_and_directory(label='incomplete')
+        self._filename = self.filename.replace('%', '')
+        try:
+            self.process.cut(self._filename, start=start_offset, history=self.ring_buffer)
+        except RuntimeError as e:
+            log.error("Cut failed, restarting recording: %s" % e)
+            self.start_time = previous_start_time
+            self._filename = previous_filename
+            self.restart('cut-failed', name, metadata)
+            return at is None
+        CUT_GAP.labels(args.engine).observe(0) # the engine writes on into the new file
+        if self.analyzer:
+            self.analyzer.open_sidecar(self._filename + LEVELS_EXTENSION)
+            for sink in self.analyzer.sinks:
+                sink.open(self._filename)
+        self.metadata = metadata or {}
+        self.finalize_file(previous_filename, previous_name, previous_start_time, previous_metadata)
+        self.moved(previous_filename)
+        self.begin_naming(name)
+        status.publish('recorder', {'action': 'start', 'filename': self.filename})
+        return True
+
+    @serialized
+    def restart(self, reason, name=None, metadata=None, expected_filename=None):
+        """
+        expected_filename: only restart while this file is recorded, it may have been stopped or cut in the meantime.
+        Returns whether the recorder runs.
+        """
+        if expected_filename is not None and (not self.running() or self._filename != expected_filename):
+            return False
+        if not self.running():
+            self.start(name=name, metadata=metadata)
+            return self.running()
+        stopped, previous_filename = time.time(), self._filename
+        self.stop()
+        self.start(name=name, metadata=metadata)
+        if self.running():
+            self.moved(previous_filename)
+        RECORDER_RESTARTS.labels(args.engine, reason).inc()
+        CUT_GAP.labels(args.engine).observe(time.time() - stopped)
+        return self.running()
+
+    def moved(self, previous_filename):
+        # a scheduled recording is restored from its current file after a crash, not from the finalized one
+        if state_store.store:
+            state_store.store.recording_moved(previous_filename, self._filename, continuous_capture.timestamp(self.start_time))
+
+    @serialized
     def stop(self):
         log.debug("Recording stop called.")
         if not self.running(): return
         self.stop_recording()
+        if self.analyzer:
+            self.analyzer.stop()
+        pool.release(self)
         self.update_filename()
+        status.publish('recorder', {'action': 'stop', 'filename': self.filename})
 
     def duration(self):
         try:
@@ -178,10 +504,9 @@ class StreamRecorderWithAirtime(object):
         except TypeError:
             return datetime.timedelta()
 
-    @classmethod
-    def running(cls):
-        if cls.process:
-            return cls.process.poll() is None
+    def running(self):
+        if self.process:
+            return self.process.poll() is None
         else:
             return False
 
@@ -194,40 +519,94 @@ class StreamRecorderWithAirtime(object):
         else:
             self.generate_filename_and_directory(label='')
 
-        print(os.path.join(self.directory, self.filename))
-        try:
-            log.debug("Current filename: " + self._filename)
-            log.debug("New filename: " + self.filename)
-            os.rename(self._filename, self.filename)
-            self._filename = self.filename
-        except OSError:
-            log.warn("Could not rename file. Original file not found?")
-
-    def generate_filename_and_directory(self, label='unnamed'):
+        log.debug("Current filename: " + self._filename)
+        log.debug("New filename: " + self.filename)
+        # renamed in the background, see postprocess
+        finish_upload(self._filename)
+        postprocessor.submit(self._filename, self.filename, self.file_metadata())
+        self._filename = self.filename
+
+    def finalize_file(self, path, name, start_time, metadata=None):
+        # rename a file that is not written anymore, e.g. the first part of a cut
+        filename = self.format_filename(label=name or '', start_time=start_time)
+        log.debug("Finalizing %s as %s" % (path, filename))
+        finish_upload(path)
+        postprocessor.submit(path, filename, metadata)
+        return filename
+
+    def begin_analysis(self):
+        if not args.analysis or not self.running():
+            return
+        self.analyzer = LevelAnalyzer(self._filename + LEVELS_EXTENSION, dead_air=args.dead_air_seconds)
+        if args.peaks:
+            self.analyzer.sinks.append(peaks.PeaksWriter(self._filename, self.analyzer.rate))
+        self.analyzer.start()
+        if hasattr(self.process, 'taps'):
+            self.process.taps.append(self.analyzer.tap)
+        else:
+            self.analyzer.follow(self._filename)
+
+    def begin_upload(self):
+        # upload the file while it is recorded, see upload_recording() for the rest
+        if not (args.upload and args.upload_live and airtime_api and self.running()):
+            return
+        if isinstance(self.process, RedundantCapture):
+            return # gaps are filled after the recording, the finished file is uploaded
+        prefix = id3_tag(self.file_metadata()) if self.extension == '.mp3' and not args.no_id3_tags else b''
+        live_uploads[self._filename] = LiveUpload(self._filename, airtime_api.upload_recorded_show_stream, prefix=prefix)
+        live_uploads[self._filename].start()
+
+    def file_metadata(self):
+        metadata = {'name': self.name, 'station': self.station_name,
+                    'started': continuous_capture.timestamp(self.start_time)}
+        metadata.update(self.metadata)
+        return metadata
+
+    def format_filename(self, label='unnamed', start_time=None):
         filename = self.filename_pattern
         filename = filename.replace('%station', self.station_name)
         filename = filename.replace('%label', label)
-        filename = self.start_time.strftime(filename)
+        filename = (start_time or self.start_time).strftime(filename)
         filename = filename.strip(" _.")
         filename += self.extension
 
-        log.info('File: ' + repr(filename))
-
         directory = os.path.dirname(filename) or os.getcwd()
         if not os.path.exists(directory):
             os.makedirs(directory)
+        return filename
 
-        self.directory = directory
+    def generate_filename_and_directory(self, label='unnamed'):
+        filename = self.format_filename(label=label)
+
+        log.info('File: ' + repr(filename))
+
+        self.directory = os.path.dirname(filename) or os.getcwd()
         self.filename = filename
 
-    def record_stream_to_file(self):
+    def record_stream_to_file(self, commit_at=None):
         # alternative to streamripper: https://github.com/jpaille/streamripper
-        # TODO add max duration
         # TODO remove .cue files
-        log.debug('Starting streamripper')
         self._filename = self.filename.replace('%', '') # make sure no tokens are left. otherwise we will not find the file again.
+        if args.engine == 'native':
+            log.debug('Starting native recording engine')
+            kwargs = dict(max_duration=MAX_DURATION_IN_SEC, silence_length=MAX_SILENCE_IN_SEC, commit_at=commit_at,
+                          read_timeout=args.stall_seconds or SECONDS_READ_TIMEOUT)
+            if self.secondary_url:
+                self.process = RedundantCapture(self.url, self.secondary_url, self._filename, **kwargs)
+            else:
+                self.process = StreamCaptureEngine(self.url, self._filename, **kwargs)
+            if args.ring_buffer_minutes:
+                if not self.ring_buffer:
+                    self.ring_buffer = RingBuffer(minutes=args.ring_buffer_minutes)
+                self.ring_buffer.attach(self.process)
+            self.process.start()
+            if commit_at is None:
+                self.start_time = datetime.datetime.now()
+            RECORDER_STARTS.labels(args.engine).inc()
+            return
+        log.debug('Starting streamripper')
         # streamripper manpage: http://manpages.ubuntu.com/manpages/bionic/man1/streamripper.1.html
-        self.__class__.process = subprocess.Popen([
+        self.process = subprocess.Popen([
             'streamripper',
             self.url,
             '-l', # Run for a predetermined length of time, in seconds
@@ -246,20 +625,16 @@ class StreamRecorderWithAirtime(object):
             self._filename
         ])
         self.start_time = datetime.datetime.now() # update starttime for more precision
+        RECORDER_STARTS.labels(args.engine).inc()
         #set_recording_state(STATES.RECORDING)
 
     def stop_recording(self):
         if not self.running(): return
         log.info('Finishing file ' + repr(self._filename))
-        self.__class__.process.terminate()
-        self.__class__.process.wait()
-        log.debug('Streamripper terminated.')
-        # you can not get rid of the .cue, if you use the -a flag, which we need.
-        try:
-            cue = os.path.join(self.directory, "*.cue")
-            os.system("rm %s" % cue)
-        except:
-            pass
+        self.process.terminate()
+        self.process.wait()
+        log.debug('Recording process terminated.')
+        # you can not get rid of the .cue, if you use the -a flag, which we need. postprocess removes it.
 
 #########
 # DIRECT AIRTIME API "PROXY"
@@ -285,31 +660,146 @@ def get_bootstrap_info():
     response = airtime_api.get_bootstrap_info()
     return Response(json.dumps(response), status=200, mimetype='application/json')
 
+@app.route("/airtime/api-latency/")
+def get_api_latency():
+    response = API_LATENCY.snapshot()
+    return Response(json.dumps(response), status=200, mimetype='application/json')
+
+@app.route("/airtime/cache-stats/")
+def get_cache_stats():
+    response = airtime_api.stats() if airtime_api else {}
+    return Response(json.dumps(response), status=200, mimetype='application/json')
+
 #########
 # ACTIONS: not used in production
 #########
 
+def notify_source_status(sourcename, source_status):
+    # retried in the background, the request thread only gets the handle
+    return retries.submit('update_source_status', lambda: airtime_api.services.update_source_status(
+        sourcename=sourcename, status=source_status))
+
+def accepted(message, handle, status=202):
+    response = {'message': message, 'outcome': '/retries/%i/' % handle.id, 'retry': handle.to_dict()}
+    return Response(json.dumps(response), status=status, mimetype='application/json')
+
 @app.route("/disconnect-master/")
 def disconect_master():
-    response = airtime_api.notify_source_status('master_dj', 'false')
-    return Response(json.dumps(response), status=200, mimetype='application/json')
+    handle = notify_source_status('master_dj', 'false')
+    return accepted("Disconnection of Master Source (master_dj) requested.", handle)
 
 @app.route("/connect-master/")
 def connect_master():
-    response = airtime_api.notify_source_status('master_dj', 'true')
-    return Response(json.dumps(response), status=200, mimetype='application/json')
+    handle = notify_source_status('master_dj', 'true')
+    return accepted("Connection of Master Source (master_dj) requested.", handle)
+
+@app.route("/retries/")
+def get_retries_status():
+    return Response(json.dumps(retries.status()), status=200, mimetype='application/json')
+
+@app.route("/retries/<int:id>/")
+def get_retry(id):
+    handle = retries.get(id)
+    if handle is None:
+        return Response("Unknown or expired retry id.", status=404, mimetype='application/json')
+    return Response(json.dumps(handle.to_dict()), status=200, mimetype='application/json')
 
 #########
 # CUSTOM STATUS API
 #########
 
-@app.route("/status-summary/")
-def get_status_summary():
+def status_summary():
     response = {}
     response['recorder'] = get_recorder_status()
-    if airtime_api:
-        response['live_info'] = airtime_api.get_live_info()
-        response['on_air_light'] = airtime_api.get_on_air_light()
+    if streams.streams:
+        response['streams'] = dict((id, get_recorder_status(stream.recorder)) for id, stream in streams.streams.items())
+    response['pool'] = pool.status()
+    if continuous_capture.capture:
+        response['capture'] = continuous_capture.capture.status()
+    if airtime_async:
+        # both at once, a slow or failing call leaves its key at None and is reported in upstream_errors
+        results, errors = airtime_async.gather({'live_info': 'get_live_info', 'on_air_light': 'get_on_air_light'})
+        response['live_info'] = results.get('live_info')
+        response['on_air_light'] = results.get('on_air_light')
+        if errors:
+            response['upstream_errors'] = errors
+    return response
+
+
+def status_summary_key(summary):
+    # everything but the running clocks, browsers advance the recording clock themselves
+    def recorder_key(recorder):
+        recorder = dict(recorder, text=None, duration=None)
+        if 'levels' in recorder:
+            recorder['levels'] = recorder['levels']['dead_air']
+        if 'redundant' in recorder:
+            recorder['redundant'] = dict((leg, (leg_status['connected'], leg_status['gaps']))
+                                         for leg, leg_status in recorder['redundant'].items())
+        if 'health' in recorder:
+            recorder['health'] = (recorder['health']['reconnects'], recorder['health']['stalled'] > 0)
+        return recorder
+    recorder_pool = dict(summary['pool'], overlap=None)
+    key = dict(summary, recorder=recorder_key(summary['recorder']), pool=recorder_pool)
+    if 'streams' in summary:
+        key['streams'] = dict((id, recorder_key(recorder)) for id, recorder in summary['streams'].items())
+    return json.dumps(key, sort_keys=True)
+
+
+shared_summary = SharedSummary(status_summary, status_summary_key, status)
+
+
+@app.route("/status-summary/")
+def get_status_summary():
+    return Response(json.dumps(status_summary()), status=200, mimetype='application/json')
+
+
+def too_many_waiting():
+    return Response("Too many status streams, use /status-summary/.", status=503, mimetype='application/json',
+                    headers={'Retry-After': str(SECONDS_LONG_POLL)})
+
+
+@app.route("/status-stream/")
+def get_status_stream():
+    # Server-Sent Events: the full summary when something changed, a comment as heartbeat otherwise.
+    if not wait_slots.acquire():
+        return too_many_waiting()
+
+    def generate():
+        try:
+            last_key = None
+            last_sent = 0
+            yield "retry: 2000\n\n"
+            while not status.closed:
+                version, summary, key = shared_summary.get()
+                if key != last_key:
+                    last_key = key
+                    last_sent = time.time()
+                    yield format_sse('status', json.dumps(summary), id=version)
+                elif time.time() - last_sent >= SECONDS_HEARTBEAT:
+                    last_sent = time.time()
+                    yield ": heartbeat\n\n"
+                status.wait(version, timeout=SECONDS_REFRESH)
+        finally:
+            wait_slots.release()
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), status=200, mimetype='text/event-stream', headers=headers)
+
+
+@app.route("/status-stream/poll/")
+def get_status_long_poll():
+    # long-poll fallback for clients without EventSource: returns as soon as the version passed as ?since= is outdated
+    since = request.args.get('since', type=int)
+    timeout = min(request.args.get('timeout', SECONDS_LONG_POLL, type=float), SECONDS_LONG_POLL)
+    if not wait_slots.acquire():
+        return too_many_waiting()
+    try:
+        version = status.version
+        if since is not None:
+            version = status.wait(since, timeout=timeout)
+    finally:
+        wait_slots.release()
+    response = {'version': version, 'events': status.events_since(since if since is not None else version),
+                'summary': shared_summary.get()[1]}
     return Response(json.dumps(response), status=200, mimetype='application/json')
 
 
@@ -320,11 +810,21 @@ def get_status_summary():
 current_filename = None
 
 
-def get_recorder_status():
-    if RECORDER.running():
-        label = "%s: %s" % ("REC", str(RECORDER.duration()).split('.')[0])
-        filename = RECORDER.filename
-        return { 'status': STATES.RECORDING, 'text': label, 'filename': filename }
+def get_recorder_status(recorder=None):
+    recorder = recorder or RECORDER
+    if recorder.running():
+        label = "%s: %s" % ("REC", str(recorder.duration()).split('.')[0])
+        filename = recorder.filename
+        response = { 'status': STATES.RECORDING, 'text': label, 'filename': filename,
+                     'duration': recorder.duration().total_seconds() }
+        if recorder.analyzer:
+            response['levels'] = recorder.analyzer.status()
+        if isinstance(recorder.process, RedundantCapture):
+            response['redundant'] = recorder.process.status()
+        health = stream_health.watchdog.status(recorder) if stream_health.watchdog else None
+        if health:
+            response['health'] = health
+        return response
     else:
         return { 'status': STATES.IDLE, 'text': "IDLE", 'filename': '-'}
 
@@ -337,27 +837,42 @@ def get_show_name():
         return name
 
 
+def request_cut(recorder):
+    try:
+        at = parse_time(request.args['at']) if 'at' in request.args else None
+        honoured = recorder.cut(at=at)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype='application/json')
+    status.publish('recorder', {'action': 'cut', 'filename': recorder.filename})
+    if not honoured:
+        return Response("Cut at %s failed, the recording was restarted in a new file now." % at, status=500,
+                        mimetype='application/json')
+    return Response("New file requested.", status=200, mimetype='application/json')
+
+
 @app.route("/recording-request-cut/")
 def cut():
-    RECORDER.stop()
-    RECORDER.start()
-    return Response("New file requested.", status=200, mimetype='application/json')
+    return request_cut(RECORDER)
 
 
 @app.route("/recording-disconnect-stop/")
 def disconnect_stop():
     RECORDER.stop()
-    response = airtime_api.notify_source_status('master_dj', 'false')
-    # gives no response on success or failure :/
-    return Response("Disconnection of Master Source (master_dj) requested.", status=200, mimetype='application/json')
+    handle = notify_source_status('master_dj', 'false')
+    # Airtime gives no response on success or failure :/ the outcome only tells if the request went through
+    return accepted("Disconnection of Master Source (master_dj) requested.", handle)
 
 
 @app.route("/recording-connect-start/")
 def connect_start():
-    RECORDER.start()
-    response = airtime_api.notify_source_status('master_dj', 'true')
-    # gives no response on success or failure :/
-    return Response("Connection of Master Source (master_dj) requested.", status=200, mimetype='application/json')
+    started = RECORDER.start()
+    # the show goes on air without a recording as well
+    handle = notify_source_status('master_dj', 'true')
+    # Airtime gives no response on success or failure :/ the outcome only tells if the request went through
+    if not started:
+        code, reason = RECORDER.refusal
+        return accepted("%s Connection of Master Source (master_dj) requested." % reason, handle, status=code)
+    return accepted("Connection of Master Source (master_dj) requested.", handle)
 
 
 @app.route("/recording-stop/")
@@ -366,10 +881,209 @@ def rec_stop():
     return Response("Recording stopped.", status=200, mimetype='application/json')
 
 
+def start_recording(recorder):
+    if not recorder.start():
+        code, reason = recorder.refusal
+        return Response(reason, status=code, mimetype='application/json')
+    return Response("Recording started.", status=200, mimetype='application/json')
+
+
 @app.route("/recording-start/")
 def rec_start():
-    RECORDER.start()
-    return Response("Recording started.", status=200, mimetype='application/json')
+    return start_recording(RECORDER)
+
+
+#########
+# STREAMS API: with --streams-conf, the routes above act on the first stream
+#########
+
+def stream_recorder(id):
+    stream = streams.streams.get(id)
+    return stream.recorder if stream else None
+
+
+def unknown_stream(id):
+    return Response("Unknown stream %s." % id, status=404, mimetype='application/json')
+
+
+@app.route("/streams/")
+def get_streams():
+    response = dict((id, dict(get_recorder_status(stream.recorder), url=stream.url, schedule=stream.schedule))
+                    for id, stream in streams.streams.items())
+    return Response(json.dumps(response), status=200, mimetype='application/json')
+
+
+@app.route("/streams/<id>/status/")
+def get_stream_status(id):
+    recorder = stream_recorder(id)
+    if not recorder:
+        return unknown_stream(id)
+    return Response(json.dumps(get_recorder_status(recorder)), status=200, mimetype='application/json')
+
+
+@app.route("/streams/<id>/recording-request-cut/")
+def stream_cut(id):
+    recorder = stream_recorder(id)
+    if not recorder:
+        return unknown_stream(id)
+    return request_cut(recorder)
+
+
+@app.route("/streams/<id>/recording-stop/")
+def stream_rec_stop(id):
+    recorder = stream_recorder(id)
+    if not recorder:
+        return unknown_stream(id)
+    recorder.stop()
+    return Response("Recording stopped.", status=200, mimetype='application/json')
+
+
+@app.route("/streams/<id>/recording-start/")
+def stream_rec_start(id):
+    recorder = stream_recorder(id)
+    if not recorder:
+        return unknown_stream(id)
+    return start_recording(recorder)
+
+
+@app.route("/schedule/status/")
+def get_schedule_status():
+    return Response(json.dumps(SCHEDULE.status()), status=200, mimetype='application/json')
+
+
+@app.route("/postprocess/status/")
+def get_postprocess_status():
+    return Response(json.dumps(postprocessor.status()), status=200, mimetype='application/json')
+
+
+@app.route("/upload/status/")
+def get_upload_status():
+    response = [upload.status() for upload in list(live_uploads.values())]
+    return Response(json.dumps(response), status=200, mimetype='application/json')
+
+
+@app.route("/archive/")
+def get_archive():
+    # ?instance_id=<id>&name=<show>&start=<time>&end=<time>&limit=<n>, all optional
+    if not archive_index.index:
+        return Response("Started without --archive-db.", status=404, mimetype='application/json')
+    try:
+        start = continuous_capture.timestamp(parse_time(request.args['start'])) if 'start' in request.args else None
+        end = continuous_capture.timestamp(parse_time(request.args['end'])) if 'end' in request.args else None
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype='application/json')
+    response = archive_index.index.find(instance_id=request.args.get('instance_id', type=int),
+                                        name=request.args.get('name'), start=start, end=end,
+                                        limit=request.args.get('limit', archive_index.LIMIT, type=int))
+    return Response(json.dumps(response), status=200, mimetype='application/json')
+
+
+@app.route("/retention/status/")
+def get_retention_status():
+    response = retention.manager.status() if retention.manager else {}
+    return Response(json.dumps(response), status=200, mimetype='application/json')
+
+
+@app.route("/archive/status/")
+def get_archive_status():
+    response = archive_index.index.status() if archive_index.index else {}
+    return Response(json.dumps(response), status=200, mimetype='application/json')
+
+
+@app.route("/peaks/")
+def get_peaks():
+    # ?filename=<recording>: zoom levels; &zoom=<samples per pixel>&start=<seconds>&end=<seconds>: .dat data
+    try:
+        recording = recording_path(request.args['filename'])
+        if 'zoom' not in request.args:
+            levels = sorted(peaks.zoom_levels(recording).values(), key=lambda level: level['samples_per_pixel'])
+            return Response(json.dumps(levels), status=200, mimetype='application/json')
+        data = peaks.read_range(recording, request.args.get('zoom', type=int),
+                                start=request.args.get('start', 0, type=float), end=request.args.get('end', type=float))
+    except (KeyError, ValueError, TypeError) as e:
+        return Response(str(e), status=400, mimetype='application/json')
+    except (IOError, OSError):
+        return Response("No peaks for this zoom level.", status=404, mimetype='application/json')
+    return Response(data, status=200, mimetype='application/octet-stream')
+
+
+@app.route("/capture/status/")
+def get_capture_status():
+    response = continuous_capture.capture.status() if continuous_capture.capture else {'running': False}
+    return Response(json.dumps(response), status=200, mimetype='application/json')
+
+
+@app.route("/capture/export/")
+def capture_export():
+    # (re-)cut a file from the continuous capture, e.g. after the schedule was changed late
+    if not continuous_capture.capture:
+        return Response("Continuous capture is not enabled.", status=404, mimetype='application/json')
+    try:
+        start = parse_time(request.args['start'])
+        end = parse_time(request.args['end'])
+    except (KeyError, ValueError) as e:
+        return Response("Parameters start and end are required: %s" % e, status=400, mimetype='application/json')
+    label = slugify(request.args.get('label', u'recut'))
+    filename = RECORDER.format_filename(label=label, start_time=start)
+    try:
+        size = continuous_capture.capture.export(continuous_capture.timestamp(start), continuous_capture.timestamp(end), filename)
+    except ValueError as e:
+        return Response(str(e), status=404, mimetype='application/json')
+    return Response(json.dumps({'filename': filename, 'bytes': size}), status=200, mimetype='application/json')
+
+
+#########
+# METRICS
+#########
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.time()
+
+
+@app.after_request
+def observe_request(response):
+    # streamed responses (status stream) are observed when they start, not when they end
+    if 'request_started' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_LATENCY.labels(route, request.method).observe(time.time() - g.request_started)
+    return response
+
+
+#########
+# CONTROLLER
+#########
+
+@app.route("/ui/")
+@app.route("/ui/<path:filename>")
+def get_ui(filename=''):
+    if not assets.bundle:
+        return Response("Start with --ui to serve the controller.", status=404, mimetype='text/plain')
+    status, headers, body = assets.bundle.response(filename, accept_encoding=request.headers.get('Accept-Encoding'),
+                                                   if_none_match=request.headers.get('If-None-Match'))
+    return Response(body, status=status, headers=headers)
+
+
+@app.route("/metrics")
+def get_metrics():
+    # Prometheus text format, rendered from snapshots so recording threads are not held up
+    return Response(metrics.exposition(), status=200, mimetype='text/plain; version=0.0.4')
+
+
+def finish_upload(path):
+    # the file is closed, the live upload sends the rest and ends
+    if path in live_uploads:
+        live_uploads[path].done.set()
+
+
+def upload_recording(job):
+    # post-processing stage: wait for the live upload or upload the finished file
+    live = live_uploads.pop(job.source, None)
+    if live:
+        if live.finish():
+            return
+        log.warning("Live upload of %s failed (%s), uploading the finished file." % (job.source, live.error))
+    airtime_api.upload_recorded_show_stream(MultipartStream(job.path))
 
 
 def connect_to_airtime_api(airtime_config='airtime.conf'):
@@ -383,20 +1097,97 @@ def connect_to_airtime_api(airtime_config='airtime.conf'):
 if __name__ == "__main__":
 
     if args.airtime_conf:
-        airtime_api = connect_to_airtime_api(args.airtime_conf)
+        # scheduler, status summary and proxy calls share one cache
+        airtime_api = CachedAirtimeApi(connect_to_airtime_api(args.airtime_conf),
+                                       ttl=args.api_cache_ttl, stale=args.api_cache_stale)
+        airtime_async = AsyncAirtimeApi(airtime_api)
 
     port = args.port or None # default port 5000
     debug = args.debug or False
 
-    RECORDER = StreamRecorderWithAirtime(args.stream, args.filename)
-    SCHEDULE = AirtimeRecordingScheduler(airtime_api, url=args.stream, filename=args.filename)
+    if args.streams_conf:
+        for stream in streams.load_config(args.streams_conf):
+            streams.streams[stream.id] = stream
+        first = list(streams.streams.values())[0]
+        args.stream, args.filename = first.url, first.filename
+        if args.engine != 'native' and any(stream.secondary for stream in streams.streams.values()):
+            parser.error("Secondary streams need --engine native.")
+
+    # retention and the API only touch files in these trees, never the whole filesystem
+    if os.sep in recordings_roots():
+        parser.error("Every filename pattern needs a directory without strftime() codes or tokens, e.g. /media/recordings/%Y/...")
+
+    # every stream records the scheduled shows, so they need their slots
+    pool.size = args.pool_size * max(len(streams.scheduled()), 1)
+    if args.warm_standby and args.engine != 'native':
+        log.warning("Warm standby needs --engine native, streamripper is started at the start of the show.")
+    postprocessor.workers = args.postprocess_workers
+    if args.no_id3_tags:
+        postprocessor.remove_stage('tags')
+    if args.secondary_stream or any(stream.secondary for stream in streams.streams.values()):
+        postprocessor.add_stage('merge', redundant.merge_recording, before='rename')
+    if args.archive_db:
+        archive_index.index = archive_index.ArchiveIndex(args.archive_db,
+                                                         sum([archive_index.patterns_for(p) for p in filename_patterns()], []))
+        postprocessor.add_stage('index', archive_index.index_recording)
+    if args.upload and airtime_api:
+        postprocessor.add_stage('upload', upload_recording)
+    retention.manager = retention.RetentionManager(recordings_roots(), hot_days=args.hot_days, cold_dir=args.cold_dir,
+                                                   cold_days=args.cold_days, transcode_kbps=args.transcode_kbps,
+                                                   incomplete=args.delete_incomplete,
+                                                   min_free=args.min_free_mb * 1024 * 1024)
+    postprocessor.add_stage('retention', retention.track_recording)
+    if args.cold_dir or args.delete_incomplete:
+        retention.manager.start_scan()
+        scheduler.add_job(retention.manager.apply, 'interval', minutes=retention.MINUTES_INTERVAL, name='retention')
+    postprocessor.start()
+    if args.ui:
+        assets.bundle = assets.Bundle(args.ui)
+    if args.stall_seconds:
+        stream_health.watchdog = stream_health.Watchdog(pool.recorders, stall_seconds=args.stall_seconds,
+                                                        grace_seconds=args.stall_grace_seconds)
+        stream_health.watchdog.start()
+    if args.continuous_capture:
+        continuous_capture.capture = continuous_capture.ContinuousCapture(args.stream, args.continuous_capture)
+        continuous_capture.capture.start()
+    if args.state_db:
+        state_store.store = state_store.StateStore(args.state_db)
+
+    if args.horizon_days:
+        SCHEDULE = AirtimeHorizonScheduler(airtime_api, url=args.stream, filename=args.filename, padding=args.padding,
+                                           days=args.horizon_days, warm_standby=args.warm_standby)
+    else:
+        SCHEDULE = AirtimeRecordingScheduler(airtime_api, url=args.stream, filename=args.filename, padding=args.padding,
+                                             warm_standby=args.warm_standby)
+    for stream in streams.streams.values():
+        stream.recorder = StreamRecorderWithAirtime(stream.url, stream.filename, secondary_url=stream.secondary)
+    RECORDER = list(streams.streams.values())[0].recorder if streams.streams else StreamRecorderWithAirtime(args.stream, args.filename)
 
     log.debug("Starting Webserver at %i" % port)
-    # Do not use run(debug=True)! It will run a second instance of the process, thus a second scheduler etc.
-    app.run(port=port, host='localhost')
+    # Do not use run(debug=True) or a server with worker processes! It would run a second instance of the process,
+    # thus a second scheduler etc. The server only uses threads and returns on SIGTERM, so the recordings are stopped.
+    # waiting status clients must leave threads for the control API
+    wait_slots.limit = max(1, args.threads - server.THREADS_RESERVED)
+    server.serve(app, 'localhost', port, threads=args.threads, timeout=args.request_timeout, engine=args.server)
 
     print("Shutting down...")
-    RECORDER.stop()
+    status.close() # the threads of open status streams are joined when the process exits
+    # no more starts, a job that is running is finished first so its recording is stopped below
+    scheduler.shutdown(wait=True)
+    if stream_health.watchdog:
+        stream_health.watchdog.stop() # stopping is not a stall
+    # manual and scheduled recordings, including the ones of every broadcast
+    for recorder in set(list(pool.active) + [RECORDER] + [stream.recorder for stream in streams.streams.values()]):
+        if recorder.standby():
+            recorder.cancel()
+        else:
+            recorder.stop()
+    if airtime_async:
+        airtime_async.shutdown()
+    retries.shutdown()
+    if continuous_capture.capture:
+        continuous_capture.capture.stop()
+    postprocessor.join() # let the queued jobs finish, the last recording was just stopped
     # try:
     #     os.system("rm *.cue")
     # except OSError:
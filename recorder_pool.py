@@ -0,0 +1,122 @@
+import collections
+import os
+import threading
+import time
+
+import metrics
+from metrics import Family, Counter, Histogram
+
+# Keeps track of all running recorders.
+# Back-to-back shows overlap by the start / end padding, so for a moment two recorders run at once.
+# The pool limits how many may run in parallel and records how long they overlapped.
+
+POOL_SIZE = 3 # manual recorder + two scheduled shows overlapping at a boundary
+MAX_OVERLAPS = 50
+SECONDS_STARTING = 5 # a recorder that just acquired a slot is not running yet
+
+# here and not in recorder.py, which is imported a second time by the scheduler when it runs as __main__
+RECORDER_STARTS = Family('recorder_starts_total', "Recording processes started.", ['engine'], factory=Counter)
+RECORDER_RESTARTS = Family('recorder_restarts_total', "Recordings stopped and started again to cut them.", ['engine', 'reason'],
+                           factory=Counter)
+CUT_GAP = Family('recording_cut_gap_seconds', "Time between the end of a file and the start of the next one when cutting.",
+                 ['engine'], factory=lambda: Histogram((0, 0.1, 0.25, 0.5, 1, 2, 5, 10)))
+
+
+class RecorderPool(object):
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self.active = {} # recorder -> time it was acquired
+        self.overlaps = collections.deque(maxlen=MAX_OVERLAPS)
+        self._overlap_started = None
+        self._lock = threading.Lock()
+
+    def acquire(self, recorder):
+        """Reserves a slot for recorder. Returns False if the pool is full."""
+        with self._lock:
+            self._prune()
+            if recorder in self.active:
+                return True
+            if len(self.active) >= self.size:
+                return False
+            self.active[recorder] = time.time()
+            if len(self.active) > 1 and self._overlap_started is None:
+                self._overlap_started = time.time()
+            return True
+
+    def release(self, recorder):
+        with self._lock:
+            self.active.pop(recorder, None)
+            self._prune()
+            self._end_overlap()
+
+    def _prune(self):
+        # recorders that ended on their own (e.g. maximum duration reached) do not hold a slot
+        now = time.time()
+        for recorder in [r for r, t in self.active.items() if now - t > SECONDS_STARTING and not r.running()]:
+            del self.active[recorder]
+        self._end_overlap()
+
+    def _end_overlap(self):
+        if len(self.active) <= 1 and self._overlap_started is not None:
+            self.overlaps.append({'start': self._overlap_started, 'duration': time.time() - self._overlap_started})
+            self._overlap_started = None
+
+    def recorders(self):
+        with self._lock:
+            return list(self.active)
+
+    def status(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'occupancy': len(self.active),
+                'recordings': sorted(r.filename for r in self.active if r.filename),
+                'overlap': time.time() - self._overlap_started if self._overlap_started else 0,
+                'overlaps': list(self.overlaps),
+            }
+
+
+pool = RecorderPool()
+
+
+#########
+# METRICS
+#########
+
+_written = {} # recorder -> (bytes, time) at the previous scrape
+
+
+def bytes_written(recorder):
+    # the native engine counts what it received, streamripper only leaves the file
+    if hasattr(recorder.process, 'bytes_received'):
+        return recorder.process.bytes_received
+    try:
+        return os.path.getsize(recorder._filename)
+    except (OSError, TypeError):
+        return 0
+
+
+def collect_bytes_per_second():
+    # rate since the previous scrape, since the start of the recording on the first one
+    samples, now = [], time.time()
+    recorders = [r for r in list(pool.active) if r.running()]
+    for recorder in recorders:
+        written = bytes_written(recorder)
+        before, then = _written.get(recorder) or (0, 0)
+        if not then or written < before:
+            # first scrape or a new file after a restart
+            before, then = 0, time.mktime(recorder.start_time.timetuple())
+        _written[recorder] = (written, now)
+        if now > then:
+            samples.append(({'recording': os.path.basename(recorder._filename)}, (written - before) / (now - then)))
+    for recorder in [r for r in list(_written) if r not in recorders]:
+        del _written[recorder]
+    return 'recording_bytes_per_second', "Bytes written per second by each running recording.", 'gauge', samples
+
+
+def collect_pool():
+    return 'recorder_pool_occupancy', "Recorders holding a slot of the pool.", 'gauge', [({}, len(pool.active))]
+
+
+metrics.COLLECTORS.extend([collect_bytes_per_second, collect_pool])
@@ -0,0 +1,300 @@
+import bisect
+import logging
+import os
+import threading
+import time
+
+from continuous_capture import copy_range
+from mp3 import FrameIndex, find_frame, parse_header
+from status_stream import status
+from stream_engine import StreamCaptureEngine, SECONDS_READ_TIMEOUT
+
+# Redundant capture: the same program is recorded from a primary and a secondary stream at the same time.
+# Both files get a frame index (wall-clock time -> byte offset) next to them. The monitor raises an alarm when
+# one of them gets no data, and when the recording is finished, merge() splices the frames the secondary received
+# while the primary was stalled or disconnected into the primary file.
+# The streams are matched by arrival time only, so a splice can repeat or skip up to a chunk (~0.25 s),
+# plus the difference in latency of the two streams.
+
+logger = logging.getLogger(__name__)
+
+SECONDARY_EXTENSION = '.secondary'
+INDEX_EXTENSION = '.idx'
+SECONDS_GAP = 2 # no data for this long is a gap
+SECONDS_CATCH_UP = 5 # after a stall the server may send what was buffered, so the bytes are compared this much later
+SECONDS_MONITOR = 1
+HEADER_READ_SIZE = 64 * 1024
+
+
+def secondary_path(path):
+    return path + SECONDARY_EXTENSION
+
+
+def index_path(path):
+    return path + INDEX_EXTENSION
+
+
+class Leg(object):
+    """One of the two recordings: its engine and the frame index of its current file."""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.index = FrameIndex(index_path(engine.filename))
+        self.filename = engine.filename
+        self.file_start = None
+        self.last_data = time.time()
+        self.bytes = 0
+        self.stalled = None # since when no data arrived
+        self.gaps = [] # (start, end) of the stalls of this recording
+        self.disconnected = False
+        self._lock = threading.Lock()
+        engine.taps.append(self.tap)
+
+    def tap(self, data, timestamp, boundaries):
+        # runs in the engine thread for every chunk that was written
+        with self._lock:
+            if self.engine.filename != self.filename:
+                # cut: the previous file ends where the new one starts
+                self.index.append(self.engine.file_start - self.file_start, timestamp)
+                self.index.close()
+                self.index = FrameIndex(index_path(self.engine.filename))
+                self.filename, self.file_start = self.engine.filename, None
+            if self.file_start is None:
+                self.file_start = self.engine.file_start
+            if boundaries:
+                self.index.append(boundaries[0] - self.file_start, timestamp)
+            self.last_data = timestamp
+            self.bytes += len(data)
+            if self.stalled is not None:
+                self.gaps.append((self.stalled, timestamp))
+                logger.warning("%s stream of %s is back after %.1f seconds." % (self.name, self.filename, timestamp - self.stalled))
+                status.publish('alarm', {'gap': 0, 'stream': self.name, 'filename': self.filename})
+                self.stalled = None
+
+    def check(self, t):
+        # runs in the monitor thread
+        if self.engine.commit_at is not None and self.engine.committed is None:
+            self.last_data = t # warm standby, nothing is written yet
+            return
+        if self.engine.poll() is not None and not self.disconnected:
+            self.disconnected = True
+            logger.error("%s stream of %s disconnected." % (self.name, self.filename))
+            status.publish('alarm', {'disconnected': True, 'stream': self.name, 'filename': self.filename})
+        with self._lock:
+            if self.stalled is None and t - self.last_data > SECONDS_GAP:
+                self.stalled = self.last_data
+                logger.warning("No data from the %s stream of %s since %.1f seconds." % (self.name, self.filename, t - self.last_data))
+                status.publish('alarm', {'gap': t - self.last_data, 'stream': self.name, 'filename': self.filename})
+
+    def close(self, t):
+        with self._lock:
+            # the end of the recording, a stall until here shows up as a gap in the index
+            if self.file_start is not None:
+                self.index.append(self.engine.bytes_received - self.file_start, t)
+            self.index.close()
+
+    def status(self, t):
+        return {'connected': self.engine.poll() is None, 'bytes': self.bytes, 'seconds_since_data': t - self.last_data,
+                'gaps': len(self.gaps) + (1 if self.stalled is not None else 0),
+                'gap_seconds': sum(end - start for start, end in self.gaps) + (t - self.stalled if self.stalled else 0)}
+
+
+class RedundantCapture(object):
+    """
+    Records url and secondary_url at the same time. Used like the engine of the primary:
+    taps, cuts, standby and the Popen interface, but it keeps running while one of the streams does.
+    """
+
+    def __init__(self, url, secondary_url, filename, **kwargs):
+        self.primary = StreamCaptureEngine(url, filename, **kwargs)
+        self.secondary = StreamCaptureEngine(secondary_url, secondary_path(filename), **kwargs)
+        self.started = time.time()
+        self.legs = [Leg('primary', self.primary), Leg('secondary', self.secondary)]
+        # a primary that connects late has a gap at the beginning
+        self.legs[0].index.append(0, kwargs.get('commit_at') or self.started)
+        self._stop_event = threading.Event()
+        self._monitor = threading.Thread(target=self.monitor, name='redundant-monitor')
+        self._monitor.daemon = True
+
+    def __getattr__(self, item):
+        # taps, file_start, bytes_received, committed, ... are the ones of the primary
+        return getattr(self.primary, item)
+
+    def start(self):
+        self.primary.start()
+        self.secondary.start()
+        self._monitor.start()
+
+    def monitor(self):
+        while not self._stop_event.wait(SECONDS_MONITOR):
+            t = time.time()
+            for leg in self.legs:
+                leg.check(t)
+
+    # subprocess.Popen interface
+
+    def poll(self):
+        if self.primary.poll() is None or self.secondary.poll() is None:
+            return None
+        return self.primary.poll()
+
+    def terminate(self):
+        self.primary.terminate()
+        self.secondary.terminate()
+
+    kill = terminate
+
+    def wait(self, timeout=None):
+        self.primary.wait(timeout)
+        self.secondary.wait(timeout)
+        self._stop_event.set()
+        t = time.time()
+        for leg in self.legs:
+            leg.close(t)
+        return self.primary.returncode
+
+    # engine
+
+    def commit(self, at=None):
+        at = at or time.time()
+        self.primary.commit(at)
+        self.secondary.commit(at)
+
+    def cut(self, filename, timeout=SECONDS_READ_TIMEOUT, start=None, history=None):
+        # the secondary has no history, it is cut at the next frame after the request
+        done = self.secondary.request_cut(secondary_path(filename))
+        self.primary.cut(filename, timeout=timeout, start=start, history=history)
+        # the first part is merged as soon as it is finalized, so the secondary must have left it too
+        if not done.wait(timeout) and self.secondary.poll() is None:
+            logger.warning("Secondary stream was not cut to %s in time." % secondary_path(filename))
+
+    def status(self):
+        t = time.time()
+        return dict((leg.name, leg.status(t)) for leg in self.legs)
+
+
+#########
+# MERGE
+#########
+
+def byte_rate(path):
+    """Bytes per second of an MP3 file from its first frame, None if it has none."""
+    try:
+        with open(path, 'rb') as f:
+            buf = f.read(HEADER_READ_SIZE)
+    except (IOError, OSError):
+        return None
+    pos = find_frame(buf)
+    header = parse_header(buf, pos) if pos is not None else None
+    return header.bitrate / 8.0 if header else None
+
+
+def load_index(path):
+    # entries behind the end of the file were moved to the next one by a retroactive cut
+    index = FrameIndex.load(index_path(path))
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    times, offsets = [], []
+    for t, offset in zip(index.times, index.offsets):
+        if offset <= size:
+            times.append(t)
+            offsets.append(int(offset))
+    return times, offsets
+
+
+def find_gaps(times, offsets, rate, threshold=SECONDS_GAP, catch_up=SECONDS_CATCH_UP):
+    """Indexes i of the entries after which audio was lost: no data for threshold seconds, and not sent later either."""
+    gaps = []
+    for i in range(len(times) - 1):
+        if times[i + 1] - times[i] <= threshold:
+            continue
+        j = min(bisect.bisect_left(times, times[i + 1] + catch_up), len(times) - 1)
+        lost = (times[j] - times[i]) - (offsets[j] - offsets[i]) / rate
+        if lost > threshold:
+            gaps.append(i)
+    return gaps
+
+
+def seconds_of(path, size):
+    rate = byte_rate(path)
+    return size / rate if rate else 0
+
+
+def promote(path, secondary, secondary_times):
+    """Replaces path with the recording of the secondary. Returns it as one filled gap."""
+    size = os.path.getsize(secondary)
+    os.rename(secondary, path)
+    for sidecar in (index_path(path), index_path(secondary)):
+        try:
+            os.remove(sidecar)
+        except OSError:
+            pass
+    logger.warning("The primary recording of %s is incomplete, it was replaced by the secondary one." % path)
+    if not secondary_times:
+        return [(0, 0, size)]
+    return [(secondary_times[0], secondary_times[-1], size)]
+
+
+def merge(path):
+    """
+    Splices what the secondary recorded during the gaps of the primary into path and removes the files of the secondary.
+    If the primary has less audio than the secondary even so (e.g. it never connected), the secondary becomes path.
+    Returns the filled gaps as (start, end, bytes).
+    """
+    secondary = secondary_path(path)
+    if not os.path.exists(secondary):
+        return []
+    secondary_times, secondary_offsets = load_index(secondary) if os.path.exists(index_path(secondary)) else ([], [])
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if not size:
+        return promote(path, secondary, secondary_times)
+    if not os.path.exists(index_path(path)):
+        return [] # no gaps to find, the secondary is kept
+    times, offsets = load_index(path)
+    rate = byte_rate(path) or byte_rate(secondary)
+    filled, ranges, position = [], [], 0
+    if rate and secondary_times:
+        for i in find_gaps(times, offsets, rate):
+            # what the secondary received while the primary did not
+            begin = bisect.bisect_right(secondary_times, times[i])
+            end = bisect.bisect_left(secondary_times, times[i + 1])
+            if begin >= len(secondary_offsets):
+                continue
+            end_offset = secondary_offsets[end] if end < len(secondary_offsets) else os.path.getsize(secondary)
+            if end_offset <= secondary_offsets[begin]:
+                continue
+            ranges.append((path, position, offsets[i + 1] - position))
+            ranges.append((secondary, secondary_offsets[begin], end_offset - secondary_offsets[begin]))
+            position = offsets[i + 1]
+            filled.append((times[i], times[i + 1], end_offset - secondary_offsets[begin]))
+    ranges.append((path, position, size - position))
+
+    # e.g. the primary disconnected for good before the end, which is no gap between two entries
+    merged_seconds = seconds_of(path, sum(length for source, offset, length in ranges if length > 0))
+    if seconds_of(secondary, os.path.getsize(secondary)) - merged_seconds > SECONDS_GAP:
+        return promote(path, secondary, secondary_times)
+
+    if filled:
+        with open(path + '.merged', 'wb') as dst:
+            for source, offset, length in ranges:
+                if length > 0:
+                    with open(source, 'rb') as src:
+                        copy_range(src, dst, offset, length)
+        os.rename(path + '.merged', path)
+        logger.info("Filled %i gaps of %s from the secondary stream." % (len(filled), path))
+    # the primary is complete now, the secondary is not needed anymore
+    for sidecar in (index_path(path), secondary, index_path(secondary)):
+        try:
+            os.remove(sidecar)
+        except OSError:
+            pass
+    return filled
+
+
+def merge_recording(job):
+    # post-processing stage, before the recording is renamed
+    filled = merge(job.path)
+    if filled:
+        job.metadata['gaps'] = [(start, end) for start, end, size in filled]
+        status.publish('recorder', {'action': 'merge', 'filename': job.filename, 'gaps': len(filled),
+                                    'seconds': sum(end - start for start, end, size in filled)})
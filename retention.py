@@ -0,0 +1,237 @@
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import archive_index
+from postprocess import PostProcessJob, checksum
+
+# Disk space of the recordings tree: the files are walked once at start, afterwards the sizes are
+# updated from what the recorder itself writes, moves and deletes. Policies run periodically:
+# move recordings older than N days to a cold directory (optionally transcoded to a lower bitrate),
+# delete them from there after M days, delete incomplete files that are not written anymore.
+# Recordings are refused when the projected free space is not enough for the show.
+
+logger = logging.getLogger(__name__)
+
+BYTES_PER_SECOND = 128000 // 8 # until the first recording finished
+SECONDS_DEFAULT_DURATION = 60 * 60 # for recordings without a known end
+MIN_FREE_BYTES = 500 * 1024 * 1024
+SECONDS_INCOMPLETE_IDLE = 60 * 60 # incomplete files not written for this long are left over from crashes
+INCOMPLETE_LABEL = 'incomplete'
+AUDIO_EXTENSIONS = archive_index.AUDIO_EXTENSIONS
+DAY = 24 * 60 * 60
+MINUTES_INTERVAL = 15 # policies run this often
+
+
+def free_bytes(path):
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+class RetentionManager(object):
+
+    def __init__(self, roots, hot_days=0, cold_dir=None, cold_days=0, transcode_kbps=0, incomplete=False,
+                 min_free=MIN_FREE_BYTES, clock=time.time):
+        # the recordings trees, one per stream unless they share one
+        self.roots = [os.path.abspath(root) for root in (roots if isinstance(roots, (list, tuple)) else [roots])]
+        self.hot_days = hot_days
+        self.cold_dir = cold_dir
+        self.cold_days = cold_days
+        self.transcode_kbps = transcode_kbps
+        self.incomplete = incomplete
+        self.min_free = min_free
+        self.clock = clock
+        self.bytes_per_second = BYTES_PER_SECOND
+        self.files = {} # path -> [size, mtime]
+        self.total = 0
+        self.scanned = False
+        self.actions = {'moved': 0, 'transcoded': 0, 'deleted': 0, 'refused': 0, 'failed': 0}
+        self._lock = threading.Lock()
+
+    #########
+    # USAGE
+    #########
+
+    def scan(self):
+        """The only walk of the trees, when the service starts."""
+        for top in self.roots + [self.cold_dir]:
+            if not top:
+                continue
+            for directory, _, filenames in os.walk(top):
+                for filename in filenames:
+                    self.add(os.path.join(directory, filename))
+        self.scanned = True
+        logger.info("%i files with %i bytes in the recordings trees." % (len(self.files), self.total))
+
+    def start_scan(self):
+        thread = threading.Thread(target=self.scan, name='retention-scan')
+        thread.daemon = True
+        thread.start()
+
+    def add(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        path = os.path.abspath(path)
+        with self._lock:
+            previous = self.files.get(path)
+            self.total += st.st_size - (previous[0] if previous else 0)
+            self.files[path] = [st.st_size, st.st_mtime]
+
+    def discard(self, path):
+        with self._lock:
+            previous = self.files.pop(os.path.abspath(path), None)
+            if previous:
+                self.total -= previous[0]
+
+    def observe(self, size, seconds):
+        # bitrate of a finished recording, for the projections
+        if seconds > 60:
+            self.bytes_per_second = 0.8 * self.bytes_per_second + 0.2 * size / seconds
+
+    #########
+    # SPACE
+    #########
+
+    def projected_free(self, directory, seconds=None):
+        """Free bytes in directory after recording for seconds."""
+        return free_bytes(directory) - (seconds or SECONDS_DEFAULT_DURATION) * self.bytes_per_second
+
+    def has_space(self, directory, seconds=None):
+        projected = self.projected_free(directory, seconds)
+        if projected < self.min_free:
+            logger.error("Only %i MB would be left in %s after recording %i seconds."
+                         % (projected // (1024 * 1024), directory, seconds or SECONDS_DEFAULT_DURATION))
+            self.actions['refused'] += 1
+            return False
+        return True
+
+    #########
+    # POLICIES
+    #########
+
+    def apply(self):
+        """Runs all policies on the tracked files. Returns the number of files changed."""
+        if not self.scanned:
+            return 0
+        now = self.clock()
+        with self._lock:
+            files = sorted(self.files.items(), key=lambda item: item[1][1])
+        changed = 0
+        for path, (size, mtime) in files:
+            name, extension = os.path.splitext(path)
+            if extension.lower() not in AUDIO_EXTENSIONS:
+                continue # sidecars go with their recording
+            try:
+                # the mtime of the scan is old for a file that is still written, so stat it again
+                if self.incomplete and self.root_of(path) and INCOMPLETE_LABEL in os.path.basename(name) \
+                        and now - os.path.getmtime(path) > SECONDS_INCOMPLETE_IDLE:
+                    self.delete(path)
+                elif self.cold_dir and self.is_cold(path):
+                    if self.cold_days and now - mtime > (self.hot_days + self.cold_days) * DAY:
+                        self.delete(path)
+                    else:
+                        continue
+                elif self.root_of(path) is None:
+                    continue # only files in the recordings trees are touched
+                elif self.cold_dir and self.hot_days and now - mtime > self.hot_days * DAY:
+                    self.move_to_cold(path)
+                else:
+                    continue
+                changed += 1
+            except (IOError, OSError, subprocess.CalledProcessError) as e:
+                logger.error("Retention of %s failed: %s" % (path, e))
+                self.actions['failed'] += 1
+        return changed
+
+    def is_cold(self, path):
+        return path.startswith(os.path.abspath(self.cold_dir) + os.sep)
+
+    def root_of(self, path):
+        for root in self.roots:
+            if path.startswith(root + os.sep):
+                return root
+        return None
+
+    def sidecars(self, path):
+        directory, name = os.path.split(path)
+        return [os.path.join(directory, f) for f in os.listdir(directory) if f.startswith(name + '.')]
+
+    def move_to_cold(self, path):
+        root = self.root_of(path)
+        relative = os.path.relpath(path, root)
+        if len(self.roots) > 1:
+            relative = os.path.join(os.path.basename(root), relative) # keep the trees apart
+        target = os.path.join(os.path.abspath(self.cold_dir), relative)
+        if not os.path.exists(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        sidecars = self.sidecars(path)
+        transcode = self.transcode_kbps and path.lower().endswith('.mp3')
+        if transcode:
+            mtime = os.path.getmtime(path)
+            self.transcode(path, target)
+            os.utime(target, (mtime, mtime)) # the cold days count from the recording, like for moved files
+            os.remove(path)
+            self.actions['transcoded'] += 1
+        else:
+            shutil.move(path, target)
+        self.discard(path)
+        self.add(target)
+        for sidecar in sidecars:
+            sidecar_target = target + sidecar[len(path):]
+            shutil.move(sidecar, sidecar_target)
+            self.discard(sidecar)
+            self.add(sidecar_target)
+        if transcode:
+            # the checksum of the original does not fit anymore
+            checksum(PostProcessJob(target, target))
+            os.utime(target + '.sha256', (mtime, mtime))
+            self.add(target + '.sha256')
+        if archive_index.index:
+            archive_index.index.moved(path, target, size=os.path.getsize(target))
+        self.actions['moved'] += 1
+        logger.info("Moved %s to %s" % (path, target))
+
+    def transcode(self, path, target):
+        # keeps the tags, as ID3v2.3 like postprocess writes them
+        subprocess.check_call(['ffmpeg', '-loglevel', 'error', '-y', '-i', path, '-map_metadata', '0',
+                               '-id3v2_version', '3', '-b:a', '%ik' % self.transcode_kbps, '-f', 'mp3',
+                               target + '.part'])
+        os.rename(target + '.part', target)
+
+    def delete(self, path):
+        for sidecar in [path] + self.sidecars(path):
+            os.remove(sidecar)
+            self.discard(sidecar)
+        if archive_index.index:
+            archive_index.index.remove(path)
+        self.actions['deleted'] += 1
+        logger.info("Deleted %s" % path)
+
+    def status(self):
+        with self._lock:
+            hot = sum(size for path, (size, mtime) in self.files.items() if not (self.cold_dir and self.is_cold(path)))
+            total, count = self.total, len(self.files)
+        response = {'files': count, 'bytes': total, 'hot_bytes': hot, 'cold_bytes': total - hot,
+                    'scanned': self.scanned, 'bytes_per_second': self.bytes_per_second, 'actions': dict(self.actions)}
+        try:
+            response['free_bytes'] = min(free_bytes(root) for root in self.roots)
+        except OSError:
+            pass
+        return response
+
+
+manager = None # set when the service starts
+
+
+def track_recording(job):
+    # post-processing stage
+    if manager:
+        for path in [job.path] + manager.sidecars(job.path):
+            manager.add(path)
+        if job.metadata.get('started'):
+            manager.observe(os.path.getsize(job.path), os.path.getmtime(job.path) - job.metadata['started'])
@@ -0,0 +1,204 @@
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Retries of Airtime API calls without blocking the caller: exponential backoff with jitter,
+# an overall deadline and a circuit breaker per endpoint, so a flaky Airtime is not hammered
+# and a request thread only submits the call and returns a handle to poll.
+
+logger = logging.getLogger(__name__)
+
+ATTEMPTS = 5
+SECONDS_BASE_DELAY = 1
+SECONDS_MAX_DELAY = 30
+SECONDS_DEADLINE = 60
+BREAKER_FAILURES = 5 # consecutive failed attempts that open the circuit of an endpoint
+SECONDS_BREAKER_RESET = 60 # open circuits let one trial call through after this
+WORKERS = 4
+KEEP_HANDLES = 100
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class RetryPolicy(object):
+
+    def __init__(self, attempts=ATTEMPTS, base=SECONDS_BASE_DELAY, max_delay=SECONDS_MAX_DELAY,
+                 deadline=SECONDS_DEADLINE, factor=2, jitter=True):
+        # deadline: seconds since the first attempt after which no retry starts, None for calls that take long
+        self.attempts = attempts
+        self.base = base
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.factor = factor
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        """Seconds to wait after the attempt (counting from 1) failed."""
+        delay = min(self.max_delay, self.base * self.factor ** (attempt - 1))
+        if self.jitter:
+            # "full jitter": callers that failed together do not retry together
+            delay = random.uniform(0, delay)
+        return delay
+
+    def call(self, fn, breaker=None, handle=None, sleep=time.sleep, clock=time.time):
+        """Calls fn until it returns, raising the last exception when attempts or deadline are used up."""
+        started = clock()
+        attempt = 0
+        while True:
+            if breaker and not breaker.allow():
+                raise CircuitOpen("Circuit for %s is open." % breaker.name)
+            attempt += 1
+            if handle:
+                handle.attempts = attempt
+            try:
+                result = fn()
+            except Exception as e:
+                if breaker:
+                    breaker.failure()
+                delay = self.delay(attempt)
+                if attempt >= self.attempts or (self.deadline is not None and clock() + delay - started > self.deadline):
+                    raise
+                logger.info("Attempt %i failed (%s), retrying in %.1fs.", attempt, e, delay)
+                if handle:
+                    handle.error = str(e)
+                sleep(delay)
+            else:
+                if breaker:
+                    breaker.success()
+                return result
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset=SECONDS_BREAKER_RESET, clock=time.time):
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self.clock = clock
+        self.consecutive = 0
+        self.opened = None
+        self.trial = None # when the trial call of the half-open circuit was let through
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return 'closed'
+        if self.clock() - self.opened >= self.reset:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened is None:
+                return True
+            t = self.clock()
+            if t - self.opened < self.reset:
+                return False
+            # half-open: one trial call, the others are rejected until it succeeded or failed
+            # (or until it did not report back for reset seconds)
+            if self.trial is not None and t - self.trial < self.reset:
+                return False
+            self.trial = t
+            return True
+
+    def success(self):
+        with self._lock:
+            self.consecutive = 0
+            self.opened = None
+            self.trial = None
+
+    def failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self.consecutive >= self.failures or self.opened is not None:
+                # a failed trial call in half-open state opens the circuit again
+                if self.opened is None:
+                    logger.warning("Opening circuit for %s after %i failures.", self.name, self.consecutive)
+                self.opened = self.clock()
+            self.trial = None
+
+    def status(self):
+        return {'state': self.state, 'failures': self.consecutive}
+
+
+class RetryHandle(object):
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.state = 'pending'
+        self.attempts = 0
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name, 'state': self.state, 'attempts': self.attempts,
+                'result': self.result, 'error': self.error, 'submitted': self.submitted, 'finished': self.finished}
+
+
+class RetryExecutor(object):
+
+    def __init__(self, workers=WORKERS, keep=KEEP_HANDLES):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.keep = keep
+        self.handles = OrderedDict()
+        self.breakers = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def breaker(self, name):
+        with self._lock:
+            if name not in self.breakers:
+                self.breakers[name] = CircuitBreaker(name)
+            return self.breakers[name]
+
+    def submit(self, name, fn, policy=None):
+        """Runs fn with retries in the background. name selects the circuit breaker (one per endpoint)."""
+        policy = policy or RetryPolicy()
+        breaker = self.breaker(name)
+        with self._lock:
+            handle = RetryHandle(next(self._ids), name)
+            self.handles[handle.id] = handle
+            while len(self.handles) > self.keep:
+                self.handles.popitem(last=False)
+        self.executor.submit(self._run, handle, fn, policy, breaker)
+        return handle
+
+    def _run(self, handle, fn, policy, breaker):
+        handle.state = 'running'
+        try:
+            handle.result = policy.call(fn, breaker=breaker, handle=handle)
+            handle.error = None
+            handle.state = 'succeeded'
+        except Exception as e:
+            logger.error("%s failed after %i attempts: %s", handle.name, handle.attempts, e)
+            handle.error = str(e) or e.__class__.__name__
+            handle.state = 'failed'
+        finally:
+            handle.finished = time.time()
+            handle.done.set()
+
+    def get(self, id):
+        return self.handles.get(id)
+
+    def status(self):
+        with self._lock:
+            breakers = dict((name, b.status()) for name, b in self.breakers.items())
+            pending = sum(1 for h in self.handles.values() if not h.done.is_set())
+        return {'breakers': breakers, 'pending': pending}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+retries = RetryExecutor()
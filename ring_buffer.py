@@ -0,0 +1,108 @@
+import bisect
+import mmap
+import tempfile
+import threading
+from array import array
+
+# Rolling buffer of the last minutes of the stream, for cuts that are requested too late.
+# The bytes live in a memory-mapped temporary file of fixed size, so memory use does not
+# grow with the length of the buffer. Offsets are stream offsets as counted by the engine.
+
+MINUTES = 10
+BYTES_PER_SECOND = 320 * 1000 // 8 # highest MP3 bitrate, so N minutes always fit
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class RingBuffer(object):
+
+    def __init__(self, minutes=MINUTES, capacity=None):
+        self.capacity = capacity or int(minutes * 60 * BYTES_PER_SECOND)
+        self._file = tempfile.TemporaryFile()
+        self._file.truncate(self.capacity)
+        self._map = mmap.mmap(self._file.fileno(), self.capacity)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.start = None # oldest stream offset still in the buffer
+            self.end = None
+            # frame boundaries with their receive time, entries before _head are dropped
+            self._times = array('d')
+            self._offsets = array('d')
+            self._head = 0
+
+    def attach(self, engine):
+        """Feeds every chunk the engine writes into the buffer."""
+        self.reset()
+
+        def tap(data, timestamp, boundaries):
+            self.write(data, timestamp, boundaries, engine.bytes_received - len(data))
+        engine.taps.append(tap)
+
+    def write(self, data, timestamp, boundaries, offset):
+        with self._lock:
+            if self.end != offset:
+                # first chunk or the stream restarted
+                self.start = self.end = offset
+                del self._times[:]
+                del self._offsets[:]
+                self._head = 0
+
+            if len(data) > self.capacity:
+                offset += len(data) - self.capacity
+                data = data[-self.capacity:]
+            pos = offset % self.capacity
+            first = min(len(data), self.capacity - pos)
+            self._map[pos:pos + first] = data[:first]
+            if first < len(data):
+                self._map[0:len(data) - first] = data[first:]
+
+            self.end = offset + len(data)
+            self.start = max(self.start, self.end - self.capacity)
+            if boundaries:
+                self._times.append(timestamp)
+                self._offsets.append(boundaries[0])
+            self._drop_overwritten()
+
+    def _drop_overwritten(self):
+        while self._head < len(self._offsets) and self._offsets[self._head] < self.start:
+            self._head += 1
+        if self._head > len(self._offsets) // 2:
+            del self._times[:self._head]
+            del self._offsets[:self._head]
+            self._head = 0
+
+    def offset_at(self, timestamp):
+        """Stream offset of the first frame received at or after timestamp, None if it is not in the buffer."""
+        with self._lock:
+            i = bisect.bisect_left(self._times, timestamp, self._head)
+            if i == len(self._times) or i == self._head and timestamp < self._times[self._head] - 1:
+                # after the newest or (more than a chunk) before the oldest frame we still have
+                return None
+            return int(self._offsets[i])
+
+    def contains(self, start, end):
+        with self._lock:
+            return self.start is not None and self.start <= start and end <= self.end
+
+    def copy_to(self, f, start, end):
+        """Writes the stream bytes between the offsets start and end to the file object f."""
+        with self._lock:
+            if self.start is None or start < self.start or end > self.end:
+                raise ValueError("Range %s-%s is not in the buffer (%s-%s)." % (start, end, self.start, self.end))
+            while start < end:
+                pos = start % self.capacity
+                length = min(end - start, self.capacity - pos, COPY_CHUNK_SIZE)
+                f.write(self._map[pos:pos + length])
+                start += length
+
+    def seconds(self):
+        with self._lock:
+            if len(self._times) <= self._head:
+                return 0
+            return self._times[-1] - self._times[self._head]
+
+    def close(self):
+        self._map.close()
+        self._file.close()
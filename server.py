@@ -0,0 +1,90 @@
+import logging
+import signal
+
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+# Production HTTP front end for the Flask app, instead of app.run().
+# Requests are handled by a fixed number of threads: waitress if it is installed, otherwise
+# the Werkzeug server with a thread pool instead of a thread per connection.
+# Everything stays in one process, there must never be a second scheduler (no reloader, no worker processes).
+# Every open /status-stream/ holds a thread, streams beyond threads - THREADS_RESERVED are refused (status_stream.WaitSlots).
+# SIGTERM and SIGINT end serve(), so the caller can stop the recordings before the process exits.
+
+logger = logging.getLogger(__name__)
+
+THREADS = 16
+THREADS_RESERVED = 4 # never taken by waiting status streams
+SECONDS_REQUEST_TIMEOUT = 30 # for reading a request and writing a response, idle connections are closed after it
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug's server, but with a bounded pool of worker threads. Connections wait for a free thread."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=THREADS, timeout=SECONDS_REQUEST_TIMEOUT):
+        handler = type('TimeoutRequestHandler', (WSGIRequestHandler,), {'timeout': timeout})
+        BaseWSGIServer.__init__(self, host, port, app, handler=handler)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        # like socketserver.ThreadingMixIn
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        BaseWSGIServer.server_close(self)
+        self.executor.shutdown(wait=False)
+
+
+def make_server(app, host, port, threads=THREADS, timeout=SECONDS_REQUEST_TIMEOUT, engine='auto'):
+    """A server with a run() method. engine: 'waitress', 'werkzeug' or 'auto' (waitress if installed)."""
+    if engine == 'waitress' or (engine == 'auto' and waitress):
+        if not waitress:
+            raise ValueError("waitress is not installed.")
+        # send_bytes=1: Server-Sent Events must not wait in the output buffer
+        server = waitress.create_server(app, host=host, port=port, threads=threads, channel_timeout=timeout,
+                                        send_bytes=1, ident='live-recorder')
+        logger.info("Serving with waitress (%i threads) at %s:%i" % (threads, host, port))
+        return server
+    server = PooledWSGIServer(host, port, app, threads=threads, timeout=timeout)
+    server.run = server.serve_forever
+    logger.info("Serving with Werkzeug (%i threads) at %s:%i" % (threads, host, port))
+    return server
+
+
+def interrupt(signum, frame):
+    # both servers return from run() on KeyboardInterrupt and close the listening socket
+    raise KeyboardInterrupt()
+
+
+def serve(app, host, port, threads=THREADS, timeout=SECONDS_REQUEST_TIMEOUT, engine='auto'):
+    """Serves app until SIGTERM or SIGINT. Must be called from the main thread."""
+    server = make_server(app, host, port, threads=threads, timeout=timeout, engine=engine)
+    previous = signal.signal(signal.SIGTERM, interrupt)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        # no new connections while the recordings are stopped, Werkzeug closed its socket already
+        if hasattr(server, 'close'):
+            try:
+                server.close()
+            except EnvironmentError:
+                pass
+    logger.info("Server stopped.")
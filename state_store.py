@@ -0,0 +1,92 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+# Local state that has to survive a restart of the service:
+# the broadcasts we scheduled (so their jobs can be re-armed before Airtime answers)
+# and the scheduled recordings that were running (so they can be continued).
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcasts (
+    instance_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    timezone TEXT NOT NULL,
+    ends REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recordings (
+    instance_id INTEGER NOT NULL,
+    stream TEXT NOT NULL DEFAULT '',
+    filename TEXT NOT NULL,
+    name TEXT,
+    started REAL NOT NULL,
+    PRIMARY KEY (instance_id, stream)
+);
+"""
+# before multi-stream mode there was one recording per broadcast
+MIGRATE_STREAM = """
+ALTER TABLE recordings RENAME TO recordings_old;
+CREATE TABLE recordings (
+    instance_id INTEGER NOT NULL,
+    stream TEXT NOT NULL DEFAULT '',
+    filename TEXT NOT NULL,
+    name TEXT,
+    started REAL NOT NULL,
+    PRIMARY KEY (instance_id, stream)
+);
+INSERT INTO recordings (instance_id, filename, name, started) SELECT instance_id, filename, name, started FROM recordings_old;
+DROP TABLE recordings_old;
+"""
+
+
+class StateStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        if 'stream' not in [column[1] for column in self._db.execute("PRAGMA table_info(recordings)")]:
+            self._db.executescript(MIGRATE_STREAM)
+        self._lock = threading.Lock()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            with self._db:
+                return self._db.execute(sql, params).fetchall()
+
+    def save_broadcast(self, instance_id, r, timezone, ends):
+        self._execute("INSERT OR REPLACE INTO broadcasts (instance_id, data, timezone, ends) VALUES (?, ?, ?, ?)",
+                      (instance_id, json.dumps(r), timezone, ends))
+
+    def remove_broadcast(self, instance_id):
+        self._execute("DELETE FROM broadcasts WHERE instance_id = ?", (instance_id,))
+
+    def broadcasts(self):
+        """(dict, timezone name) of all broadcasts that did not end yet. Older ones are removed."""
+        self._execute("DELETE FROM broadcasts WHERE ends < ?", (time.time(),))
+        return [(json.loads(data), timezone) for data, timezone in
+                self._execute("SELECT data, timezone FROM broadcasts ORDER BY ends")]
+
+    def recording_started(self, instance_id, filename, name, started, stream=''):
+        self._execute("INSERT OR REPLACE INTO recordings (instance_id, stream, filename, name, started) VALUES (?, ?, ?, ?, ?)",
+                      (instance_id, stream, filename, name, started))
+
+    def recording_moved(self, filename, new_filename, started):
+        # a running recording continues in a new file (cut, restart after a stall), the old one is finalized already
+        self._execute("UPDATE recordings SET filename = ?, started = ? WHERE filename = ?", (new_filename, started, filename))
+
+    def recording_stopped(self, instance_id):
+        # of all streams
+        self._execute("DELETE FROM recordings WHERE instance_id = ?", (instance_id,))
+
+    def recordings(self, stream=''):
+        """Scheduled recordings of a stream that were running when the service stopped, by instance_id."""
+        return dict((row[0], {'filename': row[1], 'name': row[2], 'started': row[3]})
+                    for row in self._execute("SELECT instance_id, filename, name, started FROM recordings WHERE stream = ?",
+                                             (stream,)))
+
+
+store = None # set when started with a state database
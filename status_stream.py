@@ -0,0 +1,108 @@
+import collections
+import threading
+import time
+
+# Push channel for status changes.
+# Recorder and schedule publish here whenever something changes,
+# the /status-stream/ endpoints sleep on the condition instead of polling.
+# close() ends all of them on shutdown, an open stream must not keep its server thread (and the process) alive.
+# All of them share one status summary, computed when something was published (or when it got old),
+# so another dashboard costs a few bytes per change, not a summary (with Airtime calls) every second.
+# Every waiting request holds a server thread, WaitSlots keeps some threads free for the control API.
+
+SECONDS_HEARTBEAT = 15 # comment sent on idle streams, so proxies do not close them
+SECONDS_REFRESH = 5 # for changes nobody publishes, e.g. Airtime's on-air light
+SECONDS_LONG_POLL = 25 # stay below common proxy timeouts
+MAX_EVENTS = 100
+MAX_WAITING = 12 # default of server.THREADS minus server.THREADS_RESERVED
+
+
+class StatusBroadcaster(object):
+
+    def __init__(self, max_events=MAX_EVENTS):
+        self._condition = threading.Condition()
+        self.version = 0
+        self.closed = False
+        self.events = collections.deque(maxlen=max_events)
+
+    def publish(self, event, data=None):
+        with self._condition:
+            self.version += 1
+            self.events.append({'version': self.version, 'event': event, 'data': data, 'time': time.time()})
+            self._condition.notify_all()
+
+    def wait(self, since, timeout=None):
+        """Blocks until a version newer than since is published or timeout passed. Returns the current version."""
+        with self._condition:
+            if self.version <= since and not self.closed:
+                self._condition.wait(timeout)
+            return self.version
+
+    def close(self):
+        """Wakes all waiting streams, which end then."""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def events_since(self, since):
+        with self._condition:
+            return [e for e in self.events if e['version'] > since]
+
+
+class SharedSummary(object):
+    """The summary for all waiting clients. compute() runs once per published version, or after max_age."""
+
+    def __init__(self, compute, key, broadcaster, max_age=SECONDS_REFRESH, clock=time.time):
+        self.compute = compute
+        self.key = key # of a summary, without the parts that change all the time
+        self.broadcaster = broadcaster
+        self.max_age = max_age
+        self.clock = clock
+        self.computed = 0
+        self._lock = threading.Lock() # one computation, the other clients wait for it
+        self._cached = None # (version, time, summary, key)
+
+    def get(self):
+        """(version, summary, key)"""
+        with self._lock:
+            version = self.broadcaster.version
+            cached = self._cached
+            if cached is None or cached[0] != version or self.clock() - cached[1] >= self.max_age:
+                summary = self.compute()
+                cached = self._cached = (version, self.clock(), summary, self.key(summary))
+                self.computed += 1
+            return cached[0], cached[2], cached[3]
+
+
+class WaitSlots(object):
+    """Counts the requests that hold a server thread while they wait for changes."""
+
+    def __init__(self, limit=MAX_WAITING):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+def format_sse(event, data, id=None):
+    # data is an already serialized JSON string
+    message = "event: %s\n" % event
+    if id is not None:
+        message += "id: %s\n" % id
+    for line in data.splitlines():
+        message += "data: %s\n" % line
+    return message + "\n"
+
+
+status = StatusBroadcaster()
+wait_slots = WaitSlots()
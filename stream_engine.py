@@ -0,0 +1,260 @@
+import io
+import logging
+import threading
+import time
+
+import requests
+
+from mp3 import FrameTracker, find_frame
+
+# In-process recording engine, alternative to spawning streamripper.
+# Holds one connection to the stream and writes the received bytes to the current file.
+# A cut swaps the file handle on the next frame boundary, so no byte gets lost in between.
+# The class mimics the parts of subprocess.Popen the recorder uses (poll, terminate, wait),
+# so it can be used in place of the streamripper process.
+# With commit_at the engine connects early (warm standby) and drops what it receives until then,
+# the file starts with the first frame received at commit_at.
+# A connection that fails or sends nothing for read_timeout seconds is reopened with exponential backoff.
+# The file goes on with the first complete frame of the new connection, the audio in between is lost.
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 4096 # ~0.25 sec at 128 kbps
+STANDBY_CHUNK_SIZE = 1024 # smaller reads until the commit, so it is not late by a whole chunk
+BUFFER_SIZE = 1024 * 1024 # write buffer per file
+SECONDS_CONNECT_TIMEOUT = 10
+SECONDS_READ_TIMEOUT = 30
+SECONDS_BACKOFF = 0.5 # first reconnect, doubled for every failed one
+SECONDS_BACKOFF_MAX = 30
+
+
+class StreamCaptureEngine(threading.Thread):
+
+    def __init__(self, url, filename, max_duration=None, silence_length=None,
+                 chunk_size=CHUNK_SIZE, buffer_size=BUFFER_SIZE, commit_at=None, read_timeout=SECONDS_READ_TIMEOUT):
+        super(StreamCaptureEngine, self).__init__(name="stream-engine")
+        self.daemon = True
+        self.url = url
+        self.filename = filename
+        # same semantics as streamripper -l: stop after this many seconds
+        self.max_duration = max_duration
+        # kept for parity with streamripper's --xs_silence_length.
+        # streamripper only uses it to find split points between tracks, which we do not create (-A).
+        self.silence_length = silence_length
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.commit_at = commit_at # timestamp to start writing at, None to write right away
+        self.committed = None # arrival time of the chunk the file started with
+        self.read_timeout = read_timeout
+        self.last_data = None # arrival time of the last chunk
+        self.stalled = None # since when the connection is lost, None while receiving
+        self.reconnects = 0
+        self.lost_seconds = 0.0 # between the last chunk before and the first frame after a reconnect
+
+        self.returncode = None
+        self.started = None
+        self.bytes_received = 0
+        self.file_start = None # stream offset of the first byte in the current file
+        self.frames = FrameTracker()
+        # callables (data, timestamp, boundaries) that get every chunk after it was written.
+        # boundaries are the stream offsets of all frames starting in this chunk.
+        self.taps = []
+
+        self._file = None
+        self._response = None
+        self._stop_event = threading.Event()
+        self._cut_lock = threading.Lock()
+        self._cut_filename = None
+        self._cut_done = None
+        self._cut_start = None
+        self._cut_history = None
+        self._committed_event = threading.Event()
+        self._resync = False
+
+    # subprocess.Popen interface
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self._stop_event.set()
+
+    kill = terminate
+
+    def wait(self, timeout=None):
+        self.join(timeout)
+        return self.returncode
+
+    # engine
+
+    def request_cut(self, filename, start=None, history=None):
+        """
+        Continue writing to filename starting with the next frame. Returns an event that is set after the swap.
+        With start (a stream offset of a frame in the current file) the cut is moved back in time:
+        the bytes from start on are taken out of the current file and copied from history (a RingBuffer) to the new one.
+        """
+        with self._cut_lock:
+            done = threading.Event()
+            self._cut_filename = filename
+            self._cut_done = done
+            self._cut_start = start
+            self._cut_history = history
+        return done
+
+    def cut(self, filename, timeout=SECONDS_READ_TIMEOUT, start=None, history=None):
+        """Like request_cut, but blocks until the files are swapped. Must not be called from a tap."""
+        done = self.request_cut(filename, start=start, history=history)
+        if not done.wait(timeout) or self.filename != filename:
+            raise RuntimeError("Cut to %s did not happen." % filename)
+
+    def commit(self, at=None):
+        """Start writing at the timestamp at (default: now) instead of commit_at."""
+        self.commit_at = at or time.time()
+
+    def wait_committed(self, timeout=None):
+        """Blocks until the file was started. Returns the lateness in seconds, None on timeout or without commit_at."""
+        if not self._committed_event.wait(timeout) or self.commit_at is None or self.committed is None:
+            return None
+        return self.committed - self.commit_at
+
+    def flush(self):
+        # make everything received so far visible to readers of the file
+        f = self._file
+        try:
+            if f is not None:
+                f.flush()
+        except ValueError:
+            pass # closed by a cut in the meantime
+
+    def run(self):
+        backoff = SECONDS_BACKOFF
+        try:
+            while True:
+                try:
+                    self._receive()
+                    break # stopped or maximum duration reached
+                except Exception as e:
+                    if self.started is None or self._stop_event.is_set():
+                        raise # the first connection has to work
+                    if self.stalled is None:
+                        # data arrived since the last failure
+                        self.stalled = self.last_data or time.time()
+                        backoff = SECONDS_BACKOFF
+                    logger.warning("Stream %s failed (%s), reconnecting in %.1f seconds." % (self.url, e, backoff))
+                    self._response.close()
+                    if self._stop_event.wait(backoff):
+                        break
+                    backoff = min(backoff * 2, SECONDS_BACKOFF_MAX)
+                    self.reconnects += 1
+                    self._resync = True
+            self.returncode = 0
+        except Exception as e:
+            logger.error("Recording engine stopped: %s" % e)
+            self.returncode = 1
+        finally:
+            self._close()
+            if self._response is not None:
+                self._response.close()
+            self._finish_pending_cut()
+            self._committed_event.set()
+
+    def _receive(self):
+        self._response = requests.get(self.url, stream=True, timeout=(SECONDS_CONNECT_TIMEOUT, self.read_timeout))
+        self._response.raise_for_status()
+        if self.started is None:
+            self.started = time.time()
+        logger.debug("Connected to %s" % self.url)
+        while not self._stop_event.is_set():
+            standby = self.commit_at is not None and self._file is None
+            data = self._response.raw.read(STANDBY_CHUNK_SIZE if standby else self.chunk_size)
+            if not data:
+                raise IOError("Stream %s ended." % self.url)
+            self._write(data, time.time())
+            if self.max_duration and time.time() - self.started >= self.max_duration:
+                logger.info("Maximum duration of %s seconds reached." % self.max_duration)
+                return
+
+    def _write(self, data, timestamp):
+        if self._resync:
+            # a new connection starts in the middle of a frame, that part is not written or counted
+            pos = find_frame(data)
+            if pos is None:
+                return
+            data = data[pos:]
+            self.frames.resync()
+            self._resync = False
+        if self.stalled is not None:
+            if self._file is not None:
+                self.lost_seconds += timestamp - self.stalled
+            logger.info("Stream %s is back after %.1f seconds." % (self.url, timestamp - self.stalled))
+            self.stalled = None
+        self.last_data = timestamp
+        start = self.bytes_received
+        # a header split across chunks belongs to bytes we already wrote, so only frames starting in data count
+        boundaries = [b for b in self.frames.feed(data) if b >= start]
+        self.bytes_received += len(data)
+        view = memoryview(data)
+
+        if self._file is None:
+            # drop the partial frame we connected in the middle of and everything before the commit
+            if not boundaries or (self.commit_at is not None and timestamp < self.commit_at):
+                return
+            split = boundaries[0] - start
+            self._file = io.open(self.filename, 'wb', buffering=self.buffer_size)
+            self.file_start = boundaries[0]
+            self._file.write(view[split:])
+            self.committed = timestamp
+            self._committed_event.set()
+        elif self._cut_filename and self._cut_start is not None and self._cut_start < start:
+            self._swap_file_retroactively(start)
+            self._file.write(view)
+        elif self._cut_filename and boundaries:
+            split = boundaries[0] - start
+            self._file.write(view[:split])
+            self._swap_file(boundaries[0])
+            self._file.write(view[split:])
+        else:
+            self._file.write(view)
+
+        for tap in self.taps:
+            tap(data, timestamp, boundaries)
+
+    def _swap_file(self, file_start):
+        with self._cut_lock:
+            self._close()
+            self.file_start = file_start
+            self.filename = self._cut_filename
+            self._file = io.open(self.filename, 'wb', buffering=self.buffer_size)
+            logger.debug("Cut, now writing to %s" % self.filename)
+            self._finish_pending_cut()
+
+    def _swap_file_retroactively(self, end):
+        # the new file starts at _cut_start, which was already written to the old file
+        with self._cut_lock:
+            previous_filename, previous_start = self.filename, self.file_start
+            if self._cut_start < previous_start or not self._cut_history.contains(self._cut_start, end):
+                logger.error("Can not cut retroactively, the cut point is not in the current file or the buffer.")
+                self._cut_filename = None
+                return self._finish_pending_cut()
+            self._close()
+            with open(previous_filename, 'r+b') as f:
+                f.truncate(self._cut_start - previous_start)
+            self.filename = self._cut_filename
+            self.file_start = self._cut_start
+            self._file = io.open(self.filename, 'wb', buffering=self.buffer_size)
+            self._cut_history.copy_to(self._file, self._cut_start, end)
+            logger.debug("Retroactive cut, %i bytes moved to %s" % (end - self._cut_start, self.filename))
+            self._finish_pending_cut()
+
+    def _finish_pending_cut(self):
+        if self._cut_done is not None:
+            self._cut_done.set()
+        self._cut_filename = None
+        self._cut_done = None
+        self._cut_start = None
+        self._cut_history = None
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+import time
+
+from status_stream import status
+
+# Health of the running recordings. A streamripper process that is alive but gets no data (e.g. a half-open
+# TCP connection) looks like a running recording for hours, so the growth of the file is checked instead.
+# When it did not grow for stall_seconds the recording is restarted, which continues the show in the next file
+# (like a cut). Restarts that do not help are repeated with exponential backoff.
+# A new file gets grace_seconds for its first data, connecting to a slow server is no stall.
+# The restart is skipped when the recording was stopped or cut since the check (see StreamRecorderWithAirtime.restart).
+# The native engine reconnects by itself (see stream_engine.py), its counters are reported here.
+# Reconnects and lost seconds are counted per show: they start at 0 with every new file but not with the
+# files of a restart.
+
+logger = logging.getLogger(__name__)
+
+SECONDS_STALL = 5
+SECONDS_GRACE = 15 # for the first data of a file
+SECONDS_CHECK = 1
+SECONDS_BACKOFF = 1 # until the next restart while the stream stays stalled, doubled every time
+SECONDS_BACKOFF_MAX = 60
+
+
+def progress(recorder):
+    # bytes received by the engine, or the size of the file streamripper writes
+    process = recorder.process
+    if hasattr(process, 'bytes_received'):
+        return process.bytes_received
+    try:
+        return os.path.getsize(recorder._filename)
+    except (OSError, TypeError):
+        return 0
+
+
+class Health(object):
+
+    def __init__(self, recorder, t):
+        self.filename = recorder._filename
+        self.bytes = progress(recorder)
+        self.checked = t
+        self.last_growth = t
+        self.grown = False # the file got data since it was started
+        self.bytes_per_second = 0.0
+        self.stalled = None # since when the file does not grow
+        self.reconnects = 0
+        self.lost_seconds = 0.0
+        self.backoff = SECONDS_BACKOFF
+        self.next_restart = 0
+        # the engine counts for its whole lifetime, which spans cuts
+        self.engine_base = (getattr(recorder.process, 'reconnects', 0), getattr(recorder.process, 'lost_seconds', 0.0))
+
+    def to_dict(self, t):
+        return {'reconnects': self.reconnects, 'lost_seconds': self.lost_seconds, 'bytes_per_second': self.bytes_per_second,
+                'stalled': t - self.stalled if self.stalled else 0}
+
+
+class Watchdog(object):
+
+    def __init__(self, recorders, stall_seconds=SECONDS_STALL, grace_seconds=SECONDS_GRACE, clock=time.time):
+        self.recorders = recorders # callable, returns the recorders to check
+        self.stall_seconds = stall_seconds
+        self.grace_seconds = grace_seconds
+        self.clock = clock
+        self.health = {} # recorder -> Health
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        # joined, a restart must not run while the recordings are stopped at shutdown
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def run(self):
+        while not self._stop_event.wait(SECONDS_CHECK):
+            try:
+                self.check()
+            except Exception as e:
+                logger.exception("Watchdog check failed: %s" % e)
+
+    def check(self):
+        t = self.clock()
+        recorders = [recorder for recorder in self.recorders() if recorder.running()]
+        for recorder in list(self.health):
+            if recorder not in recorders:
+                del self.health[recorder]
+        for recorder in recorders:
+            health = self.health.get(recorder)
+            if health is None or health.filename != recorder._filename:
+                self.health[recorder] = Health(recorder, t) # new show
+                continue
+            received = progress(recorder)
+            health.bytes_per_second = max(received - health.bytes, 0) / float(max(t - health.checked, SECONDS_CHECK))
+            grown = received > health.bytes
+            health.bytes, health.checked = received, t
+            if grown:
+                health.last_growth = t
+                health.grown = True
+            if hasattr(recorder.process, 'reconnects'):
+                self.check_engine(recorder, health, t)
+            else:
+                self.check_growth(recorder, health, t, grown)
+
+    def check_engine(self, recorder, health, t):
+        engine = recorder.process
+        health.reconnects = engine.reconnects - health.engine_base[0]
+        health.lost_seconds = engine.lost_seconds - health.engine_base[1]
+        if engine.stalled and not health.stalled:
+            logger.warning("No data for %s since %.1f seconds, reconnecting." % (recorder._filename, t - engine.stalled))
+            status.publish('alarm', {'stalled': t - engine.stalled, 'filename': recorder.filename})
+        elif health.stalled and not engine.stalled:
+            status.publish('alarm', {'stalled': 0, 'filename': recorder.filename})
+        health.stalled = engine.stalled
+
+    def check_growth(self, recorder, health, t, grown):
+        if grown:
+            if health.stalled:
+                health.lost_seconds += t - health.stalled
+                logger.info("%s grows again after %.1f seconds." % (recorder._filename, t - health.stalled))
+                status.publish('alarm', {'stalled': 0, 'filename': recorder.filename})
+                health.stalled = None
+                health.backoff = SECONDS_BACKOFF
+            return
+        stall_seconds = self.stall_seconds if health.grown else max(self.stall_seconds, self.grace_seconds)
+        if t - health.last_growth < stall_seconds or t < health.next_restart:
+            return
+        if not health.stalled:
+            health.stalled = health.last_growth
+            status.publish('alarm', {'stalled': t - health.stalled, 'filename': recorder.filename})
+        logger.warning("%s did not grow for %.1f seconds, restarting the recording." % (recorder._filename, t - health.stalled))
+        if not recorder.restart('stall', recorder.name, recorder.metadata, expected_filename=health.filename):
+            return # stopped or cut in the meantime, the next check sees it
+        # same show, new file
+        health.filename, health.bytes, health.last_growth = recorder._filename, progress(recorder), t
+        health.grown = False
+        health.checked = t
+        health.reconnects += 1
+        health.next_restart = t + health.backoff
+        health.backoff = min(health.backoff * 2, SECONDS_BACKOFF_MAX)
+        self.health[recorder] = health
+
+    def status(self, recorder):
+        health = self.health.get(recorder)
+        return health.to_dict(self.clock()) if health else None
+
+
+watchdog = None # set when the service starts
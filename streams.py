@@ -0,0 +1,113 @@
+import collections
+import logging
+from configparser import ConfigParser
+
+# Multi-stream mode: one process records several streams, e.g. the main mount, a backup mount and a partner station.
+# They share the schedule poller, the Airtime API client, the web server and the post-processing workers.
+# Every show of the schedule is recorded from each stream with "schedule = yes", manual recordings are per stream.
+#
+#     [main]
+#     url = http://stream.radioangrezi.de:8000/live
+#     filename = /media/recordings/main/%Y/%m/%d/radio-%station_%Y-%m-%d-%H-%M-%S_%label.mp3
+#
+#     [partner]
+#     url = http://partner.example.org/stream.mp3
+#     filename = /media/recordings/partner/%Y/%m/%d/%station_%Y-%m-%d-%H-%M-%S_%label.mp3
+#     schedule = no
+#     secondary = http://partner-backup.example.org/stream.mp3
+#
+# secondary: record the same program from a second url and fill gaps with it, see redundant.py.
+
+logger = logging.getLogger(__name__)
+
+
+class Stream(object):
+
+    def __init__(self, id, url, filename, schedule=True, secondary=None):
+        self.id = id
+        self.url = url
+        self.secondary = secondary
+        self.filename = filename
+        self.schedule = schedule
+        self.recorder = None # for manual recordings, set when the service starts
+
+
+def load_config(path):
+    """Streams of a config file, in the order of its sections."""
+    parser = ConfigParser(interpolation=None) # filename patterns are full of %
+    if not parser.read(path):
+        raise ValueError("Can not read stream config %s" % path)
+    result = []
+    for section in parser.sections():
+        result.append(Stream(section, parser.get(section, 'url'), parser.get(section, 'filename'),
+                             schedule=parser.getboolean(section, 'schedule', fallback=True),
+                             secondary=parser.get(section, 'secondary', fallback=None)))
+    if not result:
+        raise ValueError("No streams in %s" % path)
+    if not any(stream.schedule for stream in result):
+        raise ValueError("At least one stream in %s has to record the schedule" % path)
+    filenames = [stream.filename for stream in result]
+    if len(set(filenames)) != len(filenames):
+        raise ValueError("Every stream needs its own filename pattern in %s" % path)
+    return result
+
+
+class RecorderGroup(object):
+    """Records a show from several streams. Has the parts of StreamRecorderWithAirtime the scheduler uses."""
+
+    def __init__(self, recorders):
+        self.recorders = collections.OrderedDict(recorders) # stream id -> recorder
+
+    def members(self):
+        return list(self.recorders.items())
+
+    @property
+    def primary(self):
+        # names, times and the continuous capture are taken from the first stream
+        return list(self.recorders.values())[0]
+
+    def __getattr__(self, item):
+        if item in ('_filename', 'filename', 'name', 'start_time', 'station_name', 'format_filename', 'finalize_file'):
+            return getattr(self.primary, item)
+        raise AttributeError(item)
+
+    def start(self, name=None, metadata=None, duration=None):
+        # every stream is started, False if one of them was refused
+        started = [recorder.start(name=name, metadata=metadata, duration=duration) for recorder in self.recorders.values()]
+        return all(started)
+
+    @property
+    def refusal(self):
+        refused = [recorder.refusal for recorder in self.recorders.values() if recorder.refusal]
+        return refused[0] if refused else None
+
+    def prepare(self, at, name=None, metadata=None, duration=None):
+        for recorder in self.recorders.values():
+            recorder.prepare(at, name=name, metadata=metadata, duration=duration)
+
+    def standby(self):
+        return any(recorder.standby() for recorder in self.recorders.values())
+
+    def commit(self):
+        # the show started when the last stream started its file
+        lateness = [recorder.commit() for recorder in self.recorders.values() if recorder.standby()]
+        lateness = [seconds for seconds in lateness if seconds is not None]
+        return max(lateness) if lateness else None
+
+    def cancel(self):
+        for recorder in self.recorders.values():
+            recorder.cancel()
+
+    def stop(self):
+        for recorder in self.recorders.values():
+            recorder.stop()
+
+    def running(self):
+        return any(recorder.running() for recorder in self.recorders.values())
+
+
+streams = collections.OrderedDict() # id -> Stream, empty unless started with a stream config
+
+
+def scheduled():
+    return [stream for stream in streams.values() if stream.schedule]
@@ -0,0 +1,57 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from analysis import LevelAnalyzer, levels, load_levels
+
+RATE = 8000
+
+
+def sine(seconds, amplitude):
+    t = np.arange(int(seconds * RATE)) / float(RATE)
+    return (np.sin(2 * np.pi * 440 * t) * amplitude * 32767).astype('<i2')
+
+
+def test_levels_per_second():
+    samples = np.concatenate((sine(2, 0.5), np.zeros(RATE, dtype='<i2'), sine(0.5, 1)))
+    records = levels(samples, RATE)
+    assert len(records) == 3 # the last half second is not complete
+    # RMS of a sine is 3 dB below its peak
+    assert abs(records['peak'][0] / 100.0 - -6.02) < 0.1
+    assert abs(records['rms'][0] / 100.0 - -9.03) < 0.1
+    assert list(records['silent']) == [0, 0, 1]
+    assert records['rms'][2] == -10000
+
+
+def test_sidecar_and_dead_air_alarm(tmpdir):
+    sidecar = str(tmpdir.join('rec.mp3.levels'))
+    analyzer = LevelAnalyzer(sidecar, rate=RATE, dead_air=3, command=['true'])
+    analyzer.add_samples(sine(1.5, 0.5))
+    analyzer.add_samples(np.concatenate((sine(0.5, 0.5), np.zeros(2 * RATE, dtype='<i2'))))
+    assert analyzer.status()['silent_seconds'] == 2
+    assert not analyzer.status()['dead_air']
+    analyzer.add_samples(np.zeros(RATE, dtype='<i2'))
+    assert analyzer.status()['dead_air']
+    analyzer.add_samples(sine(1, 0.5))
+    assert not analyzer.status()['dead_air']
+
+    # a cut continues in a new sidecar
+    analyzer.open_sidecar(str(tmpdir.join('next.mp3.levels')))
+    analyzer.add_samples(sine(1, 0.5))
+    analyzer.close()
+    assert list(load_levels(sidecar)['silent']) == [0, 0, 1, 1, 1, 0]
+    assert len(load_levels(str(tmpdir.join('next.mp3.levels')))) == 1
+
+
+def test_feed_does_not_wait_for_the_decoder(tmpdir):
+    import time
+    from analysis import QUEUE_CHUNKS
+    # a decoder that never reads its input
+    analyzer = LevelAnalyzer(str(tmpdir.join('rec.mp3.levels')), rate=RATE, command=['sleep', '10']).start()
+    started = time.time()
+    for _ in range(QUEUE_CHUNKS + 100):
+        analyzer.tap(b'\0' * 4096, time.time(), [])
+    assert time.time() - started < 1
+    assert analyzer.status()['dropped'] > 0
+    analyzer.process.kill()
+    analyzer.stop()
@@ -0,0 +1,36 @@
+import time
+
+import api_async
+from api_async import AsyncAirtimeApi
+
+
+class FakeApi(object):
+
+    def get_live_info(self):
+        time.sleep(0.2)
+        return {'current': 'show'}
+
+    def get_on_air_light(self):
+        time.sleep(0.2)
+        return {'on_air_light': True}
+
+    def get_bootstrap_info(self):
+        raise ValueError("no json")
+
+
+def test_calls_run_concurrently():
+    api = AsyncAirtimeApi(FakeApi())
+    started = time.time()
+    results, errors = api.gather({'live_info': 'get_live_info', 'on_air_light': 'get_on_air_light'})
+    assert time.time() - started < 0.35
+    assert results == {'live_info': {'current': 'show'}, 'on_air_light': {'on_air_light': True}}
+    assert errors == {}
+
+
+def test_partial_results_on_timeout_and_error(monkeypatch):
+    monkeypatch.setitem(api_async.deadlines, 'get_live_info', 0.05)
+    api = AsyncAirtimeApi(FakeApi())
+    results, errors = api.gather({'live_info': 'get_live_info', 'on_air_light': 'get_on_air_light',
+                                  'bootstrap': 'get_bootstrap_info'})
+    assert results == {'on_air_light': {'on_air_light': True}}
+    assert errors == {'live_info': 'timeout', 'bootstrap': 'no json'}
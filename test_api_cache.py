@@ -0,0 +1,83 @@
+import threading
+import time
+
+from api_cache import CachedApiCall, CachedAirtimeApi
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_hit_within_ttl():
+    calls = []
+    clock = FakeClock()
+    cache = CachedApiCall(lambda: calls.append(1) or len(calls), ttl=2, stale=0, clock=clock)
+    assert cache.get() == 1
+    clock.now = 1
+    assert cache.get() == 1
+    clock.now = 3
+    assert cache.get() == 2
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+
+def test_concurrent_misses_are_coalesced():
+    calls = []
+
+    def slow_fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'live-info'
+
+    cache = CachedApiCall(slow_fetch, ttl=10, stale=0)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get())) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['live-info'] * 5
+    assert len(calls) == 1
+
+
+def test_stale_value_served_while_revalidating():
+    calls = []
+    clock = FakeClock()
+    cache = CachedApiCall(lambda: calls.append(1) or len(calls), ttl=2, stale=10, clock=clock)
+    assert cache.get() == 1
+    clock.now = 5
+    assert cache.get() == 1 # stale, refresh runs in background
+    for i in range(50):
+        if cache.stats()['fetches'] == 2:
+            break
+        time.sleep(0.01)
+    assert cache.get() == 2
+    assert cache.stats()['stale_hits'] == 1
+
+
+class FakeApi(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_live_info(self):
+        self.calls += 1
+        return {'currentShow': [], 'calls': self.calls}
+
+    def get_on_air_light(self):
+        return {'on_air_light': False}
+
+
+def test_refresh_bypasses_cached_value_and_fills_cache():
+    api = FakeApi()
+    cached = CachedAirtimeApi(api, ttl=60, stale=30)
+    assert cached.get_live_info()['calls'] == 1
+    assert cached.get_live_info()['calls'] == 1
+    assert cached.refresh_live_info()['calls'] == 2 # the schedule poll
+    assert cached.get_live_info()['calls'] == 2
+    assert api.calls == 2
@@ -0,0 +1,90 @@
+import datetime
+import os
+import tempfile
+import time
+
+from archive_index import ArchiveIndex, patterns_for, parse_path, pattern_root
+from postprocess import id3_tag, read_id3
+
+FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413 # 128 kbit/s, 44.1 kHz
+PATTERN = '%Y/%m/%d/radio_%station_%Y-%m-%d-%H-%M-%S_%label.mp3'
+
+
+def write_recording(root, start, label, metadata=None, frames=1000):
+    # like format_filename(), which strips the separator of an empty label
+    pattern = PATTERN.replace('%label', label) if label else PATTERN.replace('_%label', '')
+    path = os.path.join(str(root), start.strftime(pattern.replace('%station', 'live')))
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write((id3_tag(metadata) if metadata else b'') + FRAME * frames)
+    return path
+
+
+def test_pattern_root_and_parse_path(tmpdir):
+    pattern = os.path.join(str(tmpdir), PATTERN)
+    assert pattern_root(pattern) == str(tmpdir)
+    start = datetime.datetime(2020, 7, 21, 20, 0, 0)
+    patterns = patterns_for(pattern)
+    path = write_recording(tmpdir, start, 'morning-show')
+    assert parse_path(path, patterns) == (time.mktime(start.timetuple()), 'morning-show')
+    # the separator before an empty label is stripped from filenames
+    path = write_recording(tmpdir, start, '')
+    assert path.endswith('20-00-00.mp3')
+    assert parse_path(path, patterns) == (time.mktime(start.timetuple()), None)
+    assert parse_path(str(tmpdir.join('other.mp3')), patterns) == (None, None)
+
+
+def test_read_id3_roundtrip():
+    metadata = {'name': u'Morning Show \xe4', 'station': u'live', 'description': u'News', 'instance_id': 732}
+    with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as f:
+        f.write(id3_tag(dict(metadata, image_path='http://example.com/a.jpg')) + FRAME)
+        path = f.name
+    try:
+        assert read_id3(path) == metadata
+    finally:
+        os.remove(path)
+
+
+def test_rebuild_and_find(tmpdir):
+    root = tmpdir.join('archive')
+    pattern = os.path.join(str(root), PATTERN)
+    day = datetime.datetime(2020, 7, 21)
+    write_recording(root, day.replace(hour=20), 'morning-show', {'name': u'Morning Show', 'instance_id': 732})
+    write_recording(root, day.replace(hour=22), 'late-show')
+    write_recording(root, day + datetime.timedelta(days=1, hours=20), 'morning-show', {'name': u'Morning Show', 'instance_id': 733})
+    root.join('notes.txt').write('not audio')
+
+    index = ArchiveIndex(str(tmpdir.join('index.sqlite')), patterns_for(pattern))
+    assert index.rebuild(str(root), workers=2) == 3
+    assert index.status()['recordings'] == 3
+
+    found = index.find(instance_id=732)
+    assert len(found) == 1
+    assert found[0]['name'] == u'Morning Show'
+    assert abs(found[0]['duration'] - 1000 * 417 * 8 / 128000.0) < 0.001
+    assert found[0]['start'] == time.mktime(day.replace(hour=20).timetuple())
+    assert [r['instance_id'] for r in index.find(name=u'Morning Show')] == [733, 732]
+    assert [r['name'] for r in index.find(name='late-show')] == ['late-show']
+
+    # overlapping a range
+    start = time.mktime(day.replace(hour=20, minute=0, second=10).timetuple())
+    assert [r['instance_id'] for r in index.find(start=start, end=start + 3600)] == [732]
+
+    # incremental updates
+    path = index.find(name='late-show')[0]['path']
+    index.moved(path, path + '.cold')
+    assert index.find(name='late-show')[0]['path'] == path + '.cold'
+    index.remove(path + '.cold')
+    assert index.status()['recordings'] == 2
+
+
+def test_find_is_fast(tmpdir):
+    index = ArchiveIndex(str(tmpdir.join('index.sqlite')))
+    hour = 3600.0
+    index.put_many([{'path': '/r/%i.mp3' % i, 'instance_id': i, 'name': 'show-%i' % (i % 50), 'start': i * hour,
+                     'end': (i + 1) * hour, 'duration': hour, 'size': 1, 'indexed': 0} for i in range(5 * 365 * 24)])
+    started = time.time()
+    for i in range(100):
+        assert len(index.find(instance_id=i * 97)) == 1
+    assert (time.time() - started) / 100 < 0.001
@@ -0,0 +1,54 @@
+import gzip
+import io
+import json
+
+from assets import build, Bundle, CACHE_IMMUTABLE, CACHE_REVALIDATE, MANIFEST
+
+
+def make_source(tmpdir):
+    source = tmpdir.join('public')
+    source.join('index.html').write('<link href="controller.css" rel="stylesheet"/>\n<a href="#top">top</a>', ensure=True)
+    source.join('controller.css').write('@import "fonts/font.css";\nbody { color: black; }\n' * 20)
+    source.join('fonts', 'font.css').write("src: url('font.woff2') format('woff2'), url('font.eot?#iefix'), url('missing.svg');",
+                                           ensure=True)
+    source.join('fonts', 'font.woff2').write_binary(b'\x00' * 100)
+    source.join('fonts', 'font.eot').write_binary(b'\x01' * 100)
+    return str(source)
+
+
+def test_build_hashes_names_and_rewrites_references(tmpdir):
+    target = tmpdir.join('dist')
+    manifest = build(make_source(tmpdir), str(target))
+
+    assert manifest['index.html'] == 'index.html'
+    css, font_css, woff2 = manifest['controller.css'], manifest['fonts/font.css'], manifest['fonts/font.woff2']
+    assert css.startswith('controller.') and css.endswith('.css') and css != 'controller.css'
+    assert target.join('index.html').read().startswith('<link href="%s"' % css)
+    assert '@import "%s";' % font_css in target.join(css).read()
+    font_css_text = target.join(font_css).read()
+    assert "url('%s')" % woff2[len('fonts/'):] in font_css_text
+    assert "url('%s?#iefix')" % manifest['fonts/font.eot'][len('fonts/'):] in font_css_text
+    assert "url('missing.svg')" in font_css_text
+    assert json.loads(target.join(MANIFEST).read()) == manifest
+
+    # compressible files get a gzip variant, if it is smaller
+    assert gzip.GzipFile(fileobj=io.BytesIO(target.join(css + '.gz').read_binary())).read() == target.join(css).read_binary()
+    assert not target.join(woff2 + '.gz').check()
+
+
+def test_bundle_caches_hashed_files_and_revalidates_pages(tmpdir):
+    target = tmpdir.join('dist')
+    manifest = build(make_source(tmpdir), str(target))
+    bundle = Bundle(str(target))
+    css = manifest['controller.css']
+
+    status, headers, body = bundle.response(css, accept_encoding='gzip, deflate, br')
+    assert status == 200 and headers['Content-Encoding'] == 'gzip' and headers['Cache-Control'] == CACHE_IMMUTABLE
+    assert body == target.join(css + '.gz').read_binary()
+    assert bundle.response(css, accept_encoding='gzip', if_none_match=headers['ETag'])[0] == 304
+
+    status, headers, body = bundle.response('', accept_encoding='gzip;q=0')
+    assert status == 200 and 'Content-Encoding' not in headers and headers['Cache-Control'] == CACHE_REVALIDATE
+    assert body == target.join('index.html').read_binary()
+    assert headers['Content-Type'].startswith('text/html')
+    assert bundle.response('../public/index.html')[0] == 404
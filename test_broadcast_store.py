@@ -0,0 +1,41 @@
+from broadcast_store import BroadcastStore
+
+
+class FakeBroadcast(object):
+
+    def __init__(self, r):
+        self._dict = r
+        self.start = r['starts']
+        self.end = r['ends']
+
+    def get_unique_id(self):
+        return int(self._dict['instance_id'])
+
+    def is_same_dict(self, r):
+        return self._dict == r
+
+
+def show(instance_id, starts, ends):
+    return {'instance_id': instance_id, 'starts': starts, 'ends': ends}
+
+
+def test_lookup_by_time():
+    store = BroadcastStore()
+    for r in (show(3, 30, 40), show(1, 10, 20), show(2, 20, 30)):
+        store.add(FakeBroadcast(r))
+    assert store.at(15).get_unique_id() == 1
+    assert store.at(20).get_unique_id() == 2
+    assert store.at(45) is None
+    assert store.at(5) is None
+    assert [b.get_unique_id() for b in store.upcoming(25)] == [2, 3]
+    assert [b.get_unique_id() for b in store.upcoming(25, n=1)] == [2]
+
+
+def test_diff():
+    store = BroadcastStore()
+    for r in (show(1, 10, 20), show(2, 20, 30)):
+        store.add(FakeBroadcast(r))
+    added, changed, removed = store.diff([show(2, 20, 35), show(3, 35, 40)])
+    assert added == [show(3, 35, 40)]
+    assert changed == [show(2, 20, 35)]
+    assert removed == [1]
@@ -0,0 +1,65 @@
+import calendar
+import datetime
+import time
+
+import pytest
+
+from continuous_capture import ContinuousCapture, CaptureSegment, parse_time, timestamp
+from mp3 import FrameIndex
+from test_mp3 import frames, FRAME_LENGTH
+
+
+def write_segment(capture, start, n):
+    segment = CaptureSegment(capture.segment_path(start))
+    with open(segment.path, 'wb') as f:
+        f.write(frames(n))
+    index = FrameIndex(segment.index_path)
+    for i in range(n):
+        index.append(i * FRAME_LENGTH, start + i)
+    index.close()
+    capture.segments.append(segment)
+
+
+def test_export_spans_segments(tmpdir):
+    capture = ContinuousCapture('http://localhost/stream', str(tmpdir))
+    start = int(time.time()) - 1000
+    write_segment(capture, start, 10)
+    write_segment(capture, start + 10, 10)
+
+    filename = str(tmpdir.join('show.mp3'))
+    size = capture.export(start + 5, start + 15, filename)
+
+    assert size == 10 * FRAME_LENGTH
+    assert open(filename, 'rb').read() == frames(10)
+
+
+def test_failed_engine_is_restarted_with_alarm(tmpdir):
+    from status_stream import status
+    t = [1000.0]
+    capture = ContinuousCapture('http://localhost:1/stream', str(tmpdir), supervise_seconds=0, clock=lambda: t[0])
+    capture.start()
+    capture.engine.join(5) # the first connection is refused
+    assert not capture.running()
+    version = status.version
+
+    capture.check()
+    assert capture.restarts == 1 and capture.down_since == 1000.0
+    assert [e['data']['capture_running'] for e in status.events_since(version)] == [False]
+    capture.engine.join(5)
+    capture.check() # within the backoff
+    assert capture.restarts == 1
+    t[0] += 1
+    capture.check()
+    assert capture.restarts == 2 and len(set(segment.path for segment in capture.segments)) == 3
+    capture.stop()
+
+
+def test_parse_time_converts_offsets_to_local_time():
+    local = parse_time('2020-07-21T20:00:00')
+    assert local == datetime.datetime(2020, 7, 21, 20, 0)
+    assert timestamp(parse_time('2020-07-21T18:00:00Z')) == calendar.timegm((2020, 7, 21, 18, 0, 0))
+    assert timestamp(parse_time('2020-07-21T20:00:00+02:00')) == calendar.timegm((2020, 7, 21, 18, 0, 0))
+    assert timestamp(parse_time('2020-07-21T18:00:00.5Z')) == timestamp(parse_time('2020-07-21 13:00:00.5-0500'))
+    assert parse_time('2020-07-21T18:00:00Z').tzinfo is None
+    with pytest.raises(ValueError):
+        parse_time('2020-07-21T18:00:00+2')
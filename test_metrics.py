@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from metrics import Histogram, Family, Counter, exposition
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        h.observe(value)
+    snapshot = h.snapshot()
+    assert snapshot['buckets'] == [(0.1, 1), (1, 3), ('+Inf', 4)]
+    json.dumps(snapshot, allow_nan=False) # no Infinity
+    assert h.quantile(0.99) == '+Inf'
+    assert snapshot['count'] == 4
+    assert abs(snapshot['sum'] - 4.25) < 1e-9
+
+
+def test_quantile_is_upper_bound_of_bucket():
+    h = Histogram(buckets=(0.1, 1))
+    assert h.quantile(0.5) is None
+    for value in (0.05, 0.05, 0.05, 0.5):
+        h.observe(value)
+    assert h.quantile(0.5) == 0.1
+    assert h.quantile(0.99) == 1
+
+
+def test_family_keeps_one_child_per_label():
+    f = Family('latency', 'Latency', ['action'])
+    assert f.labels('a') is f.labels('a')
+    with f.labels('b').time():
+        pass
+    assert sorted(f.snapshot()) == ['a', 'b']
+    with pytest.raises(ValueError):
+        Family('latency', 'Latency again', ['action'])
+    assert f.snapshot()['b']['count'] == 1
+
+
+def test_exposition_format():
+    latency = Family('api_seconds', 'API latency.', ['action'], register=False)
+    latency.labels('live-info').observe(0.02)
+    restarts = Family('restarts_total', 'Restarts.', ['reason'], factory=Counter, register=False)
+    restarts.labels('say "cut"').inc()
+    restarts.labels('say "cut"').inc(2)
+
+    def collect():
+        return 'pool_occupancy', 'Occupancy.', 'gauge', [({}, 2)]
+    lines = exposition([latency, restarts], [collect]).splitlines()
+
+    assert lines[:2] == ['# HELP api_seconds API latency.', '# TYPE api_seconds histogram']
+    assert 'api_seconds_bucket{action="live-info",le="0.01"} 0' in lines
+    assert 'api_seconds_bucket{action="live-info",le="0.025"} 1' in lines
+    assert 'api_seconds_bucket{action="live-info",le="+Inf"} 1' in lines
+    assert 'api_seconds_count{action="live-info"} 1' in lines
+    assert '# TYPE restarts_total counter' in lines
+    assert 'restarts_total{reason="say \\"cut\\""} 3' in lines
+    assert lines[-1] == 'pool_occupancy 2'
+
+
+def test_exposition_of_custom_buckets():
+    gap = Family('gap_seconds', 'Gap.', factory=lambda: Histogram((0, 1)), register=False)
+    gap.labels().observe(0)
+    lines = exposition([gap], []).splitlines()
+    assert '# TYPE gap_seconds histogram' in lines
+    assert 'gap_seconds_bucket{le="0"} 1' in lines
@@ -0,0 +1,50 @@
+import struct
+
+from mp3 import parse_header, find_frame, FrameTracker, FrameIndex
+
+# MPEG 1 Layer III, 128 kbit/s, 44.1 kHz, no padding: 417 bytes per frame
+HEADER = struct.pack('>I', 0xFFFB9064)
+FRAME_LENGTH = 417
+
+
+def frames(n):
+    return (HEADER + b'\x00' * (FRAME_LENGTH - len(HEADER))) * n
+
+
+def test_parse_header():
+    header = parse_header(HEADER)
+    assert header.length == FRAME_LENGTH
+    assert header.bitrate == 128000
+    assert header.samplerate == 44100
+    assert header.samples == 1152
+    assert parse_header(b'\x00\x00\x00\x00') is None
+
+
+def test_find_frame_skips_garbage():
+    assert find_frame(b'\xff\x00garbage' + frames(2)) == 9
+
+
+def test_tracker_across_chunks():
+    data = b'xyz' + frames(20)
+    tracker = FrameTracker()
+    boundaries = []
+    for i in range(0, len(data), 1000):
+        boundaries += tracker.feed(data[i:i + 1000])
+    assert boundaries == [3 + i * FRAME_LENGTH for i in range(20)]
+    assert tracker.frames == 20
+    assert abs(tracker.duration() - 20 * 1152 / 44100.0) < 1e-9
+
+
+def test_frame_index_lookup(tmpdir):
+    path = str(tmpdir.join('capture.idx'))
+    index = FrameIndex(path)
+    for i in range(10):
+        index.append(i * FRAME_LENGTH, 100.0 + i)
+    index.close()
+
+    loaded = FrameIndex.load(path)
+    assert len(loaded) == 10
+    assert loaded.offset_at(103.5) == 4 * FRAME_LENGTH
+    assert loaded.offset_at(99) == 0
+    assert loaded.offset_at(200) is None
+    assert loaded.time_at(4 * FRAME_LENGTH + 10) == 104.0
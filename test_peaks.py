@@ -0,0 +1,58 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from peaks import PeaksWriter, HEADER, peaks_path, read_range, zoom_levels
+
+RATE = 8000
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return HEADER.unpack(data[:HEADER.size]), np.frombuffer(data[HEADER.size:], dtype=np.int8)
+
+
+def test_incremental_peaks_match_whole_file(tmpdir):
+    recording = str(tmpdir.join('rec.mp3'))
+    samples = (np.random.RandomState(1).randn(RATE * 10) * 8000).clip(-32768, 32767).astype('<i2')
+    writer = PeaksWriter(recording, RATE, resolutions=(100, 400))
+    for chunk in np.array_split(samples, 37):
+        writer.add_samples(chunk)
+
+    # readable while recording
+    header, pairs = read(peaks_path(recording, 100))
+    assert header == (1, 1, RATE, 100, 800)
+    blocks = samples.reshape(800, 100)
+    assert (pairs[0::2] == blocks.min(axis=1) >> 8).all()
+    assert (pairs[1::2] == blocks.max(axis=1) >> 8).all()
+    header, pairs = read(peaks_path(recording, 400))
+    assert header[4] == 200
+    assert (pairs[1::2] == samples.reshape(200, 400).max(axis=1) >> 8).all()
+    writer.close()
+
+    assert sorted(zoom_levels(recording)) == [100, 400]
+    assert zoom_levels(recording)[400]['seconds'] == 10
+
+
+def test_read_range(tmpdir):
+    recording = str(tmpdir.join('rec.mp3'))
+    writer = PeaksWriter(recording, RATE, resolutions=(800,))
+    writer.add_samples(np.arange(RATE * 4, dtype='<i2'))
+    writer.close()
+    data = read_range(recording, 800, start=1, end=2.05)
+    header = HEADER.unpack(data[:HEADER.size])
+    assert header == (1, 1, RATE, 800, 11) # pixels 10 to 20
+    _, pairs = read(peaks_path(recording, 800))
+    assert data[HEADER.size:] == pairs[20:42].tobytes()
+    assert HEADER.unpack(read_range(recording, 800, start=100)[:HEADER.size])[4] == 0
+
+
+def test_cut_starts_new_files(tmpdir):
+    writer = PeaksWriter(str(tmpdir.join('a.mp3')), RATE, resolutions=(100,))
+    writer.add_samples(np.ones(250, dtype='<i2'))
+    writer.open(str(tmpdir.join('b.mp3')))
+    writer.add_samples(np.ones(100, dtype='<i2'))
+    writer.close()
+    assert read(peaks_path(str(tmpdir.join('a.mp3')), 100))[0][4] == 2
+    assert read(peaks_path(str(tmpdir.join('b.mp3')), 100))[0][4] == 1
@@ -0,0 +1,64 @@
+import hashlib
+import os
+
+from postprocess import PostProcessor, id3_tag, id3_size
+
+AUDIO = b'\xff\xfb\x90\x64' + b'\x00' * 413
+
+METADATA = {'name': u'Morning Show \xe4', 'description': u'News and music', 'image_path': 'http://example.com/show.jpg',
+            'instance_id': 732, 'station': 'example'}
+
+
+def test_tag_size_roundtrip():
+    tag = id3_tag(METADATA)
+    assert tag[:5] == b'ID3\x03\x00'
+    assert id3_size(tag[:10]) == len(tag)
+    assert u'Morning Show \xe4'.encode('utf-16') in tag
+    assert id3_size(AUDIO[:10]) == 0
+
+
+def test_job_runs_all_stages(tmpdir):
+    incomplete = tmpdir.join('rec_incomplete.mp3')
+    incomplete.write_binary(id3_tag({'name': u'old'}) + AUDIO)
+    tmpdir.join('rec_incomplete.cue').write('FILE')
+    tmpdir.join('rec_incomplete.mp3.peaks-256.dat').write('PEAKS')
+    final = str(tmpdir.join('shows', 'rec_morning-show.mp3'))
+
+    processor = PostProcessor(workers=1)
+    job = processor.submit(str(incomplete), final, METADATA)
+    processor.join()
+
+    assert job.stage == 'done' and job.errors == {}
+    assert not incomplete.check() and not tmpdir.join('rec_incomplete.cue').check()
+    # sidecars are renamed with the recording
+    with open(final + '.peaks-256.dat') as f:
+        assert f.read() == 'PEAKS'
+    with open(final, 'rb') as f:
+        data = f.read()
+    # the old tag was replaced
+    assert data == id3_tag(METADATA) + AUDIO
+    assert job.sha256 == hashlib.sha256(data).hexdigest()
+    with open(final + '.sha256') as f:
+        assert f.read() == "%s  rec_morning-show.mp3\n" % job.sha256
+
+    stats = processor.status()
+    assert stats['queue'] == 0 and stats['processed'] == 1 and stats['failed'] == 0
+    assert set(job.timings) == set(['rename', 'cues', 'tags', 'checksum'])
+    assert stats['stages']['checksum']['count'] >= 1
+
+
+def test_failed_stage_does_not_stop_the_others(tmpdir):
+    path = tmpdir.join('rec.mp3')
+    path.write_binary(AUDIO)
+    processor = PostProcessor(workers=1)
+
+    def upload(job):
+        raise IOError("Upload to Airtime failed.")
+    processor.add_stage('upload', upload, before='checksum')
+    job = processor.submit(str(path), str(path))
+    processor.join()
+
+    assert job.errors == {'upload': "Upload to Airtime failed."}
+    assert job.sha256 is not None
+    assert processor.status()['failed'] == 1
+    assert os.path.exists(str(path) + '.sha256')
@@ -30,3 +30,31 @@ def test_api_connection():
     pass
 
 
+
+
+class FakeApi(object):
+
+    def __init__(self):
+        self.uploads = []
+
+    def upload_recorded_show_stream(self, stream):
+        self.uploads.append(stream.path)
+
+
+def test_scheduled_recorder_uploads_live(monkeypatch):
+    import recorder
+    from airtime_schedule import make_recorder
+    api = FakeApi()
+    monkeypatch.setattr(recorder, 'airtime_api', api)
+    monkeypatch.setattr(recorder.args, 'upload', True)
+    monkeypatch.setattr(recorder.args, 'upload_live', True)
+    rec = make_recorder(stream, filename)
+    assert isinstance(rec, recorder.StreamRecorderWithAirtime)
+    rec.start()
+    time.sleep(1)
+    path = rec._filename
+    assert path in recorder.live_uploads
+    rec.stop()
+    recorder.live_uploads.pop(path).join(5)
+    assert api.uploads == [path]
+    os.remove(rec.filename)
@@ -0,0 +1,32 @@
+from recorder_pool import RecorderPool
+
+
+class FakeRecorder(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.is_running = True
+
+    def running(self):
+        return self.is_running
+
+
+def test_pool_limits_parallel_recorders():
+    pool = RecorderPool(size=2)
+    assert pool.acquire(FakeRecorder('a.mp3'))
+    assert pool.acquire(FakeRecorder('b.mp3'))
+    assert not pool.acquire(FakeRecorder('c.mp3'))
+
+
+def test_pool_records_overlap():
+    pool = RecorderPool(size=2)
+    current, following = FakeRecorder('current.mp3'), FakeRecorder('next.mp3')
+    pool.acquire(current)
+    pool.acquire(following)
+    assert pool.status()['occupancy'] == 2
+    assert pool.status()['recordings'] == ['current.mp3', 'next.mp3']
+    pool.release(current)
+    status = pool.status()
+    assert status['occupancy'] == 1
+    assert len(status['overlaps']) == 1
+    assert status['overlap'] == 0
@@ -0,0 +1,70 @@
+import os
+
+from mp3 import FrameIndex
+from redundant import find_gaps, merge, secondary_path, index_path
+from test_mp3 import HEADER, FRAME_LENGTH
+
+BYTES_PER_SECOND = 128000 // 8
+
+
+def frame(i):
+    return HEADER + bytearray([i % 256]) * (FRAME_LENGTH - len(HEADER))
+
+
+def write_recording(path, numbers, start=1000.0):
+    index = FrameIndex(index_path(path))
+    with open(path, 'wb') as f:
+        for i in numbers:
+            index.append(f.tell(), start + i * FRAME_LENGTH / float(BYTES_PER_SECOND))
+            f.write(frame(i))
+    index.close()
+
+
+def test_stall_that_is_caught_up_is_no_gap():
+    times = [0, 1, 2, 6, 7, 12]
+    assert find_gaps(times, [0, 1000, 2000, 6000, 7000, 12000], 1000) == []
+    assert find_gaps(times, [0, 1000, 2000, 3000, 4000, 9000], 1000) == [2]
+
+
+def test_merge_fills_gap_from_secondary(tmpdir):
+    path = str(tmpdir.join('show.mp3'))
+    write_recording(path, list(range(50)) + list(range(200, 300)))
+    write_recording(secondary_path(path), range(300))
+
+    filled = merge(path)
+
+    assert len(filled) == 1 and filled[0][2] == 150 * FRAME_LENGTH
+    assert open(path, 'rb').read() == b''.join(frame(i) for i in range(300))
+    assert os.listdir(str(tmpdir)) == ['show.mp3']
+
+
+def test_merge_keeps_complete_recording(tmpdir):
+    path = str(tmpdir.join('show.mp3'))
+    write_recording(path, range(300))
+    write_recording(secondary_path(path), range(100, 300))
+    assert merge(path) == []
+    assert open(path, 'rb').read() == b''.join(frame(i) for i in range(300))
+    assert os.listdir(str(tmpdir)) == ['show.mp3']
+
+
+def test_secondary_replaces_primary_that_never_connected(tmpdir):
+    path = str(tmpdir.join('show.mp3'))
+    index = FrameIndex(index_path(path))
+    index.append(0, 1000.0)
+    index.close()
+    write_recording(secondary_path(path), range(300))
+
+    filled = merge(path)
+
+    assert len(filled) == 1 and filled[0][2] == 300 * FRAME_LENGTH
+    assert open(path, 'rb').read() == b''.join(frame(i) for i in range(300))
+    assert os.listdir(str(tmpdir)) == ['show.mp3']
+
+
+def test_secondary_replaces_primary_that_ended_early(tmpdir):
+    path = str(tmpdir.join('show.mp3'))
+    write_recording(path, range(100))
+    write_recording(secondary_path(path), range(300))
+    assert len(merge(path)) == 1
+    assert open(path, 'rb').read() == b''.join(frame(i) for i in range(300))
+    assert os.listdir(str(tmpdir)) == ['show.mp3']
@@ -0,0 +1,91 @@
+import os
+import time
+
+import retention
+from retention import RetentionManager, DAY
+
+
+def write(path, size, age=0):
+    if not path.dirpath().check():
+        path.dirpath().ensure(dir=True)
+    path.write_binary(b'x' * size)
+    mtime = time.time() - age
+    os.utime(str(path), (mtime, mtime))
+    return str(path)
+
+
+def test_usage_is_tracked_incrementally(tmpdir):
+    root = tmpdir.join('hot')
+    write(root.join('2020', 'a.mp3'), 100)
+    write(root.join('2020', 'a.mp3.sha256'), 10)
+    manager = RetentionManager(str(root))
+    manager.scan()
+    assert (len(manager.files), manager.total) == (2, 110)
+
+    path = write(root.join('2020', 'b.mp3'), 50)
+    manager.add(path)
+    manager.add(path) # counted once
+    assert manager.total == 160
+    manager.discard(path)
+    assert manager.total == 110
+    assert manager.status()['hot_bytes'] == 110
+
+
+def test_policies(tmpdir):
+    root, cold = tmpdir.join('hot'), tmpdir.join('cold')
+    old = write(root.join('2020', '07', 'old.mp3'), 100, age=8 * DAY)
+    write(root.join('2020', '07', 'old.mp3.levels'), 5, age=8 * DAY)
+    recent = write(root.join('2020', '07', 'recent.mp3'), 100, age=DAY)
+    crashed = write(root.join('2020', '07', 'rec_incomplete.mp3'), 100, age=2 * 60 * 60)
+    recording = write(root.join('2020', '07', 'rec2_incomplete.mp3'), 100)
+    expired = write(cold.join('2019', 'expired.mp3'), 100, age=40 * DAY)
+
+    manager = RetentionManager(str(root), hot_days=7, cold_dir=str(cold), cold_days=30, incomplete=True)
+    manager.scan()
+    assert manager.apply() == 3
+
+    assert not os.path.exists(old) and not os.path.exists(crashed) and not os.path.exists(expired)
+    assert os.path.exists(recent) and os.path.exists(recording)
+    assert cold.join('2020', '07', 'old.mp3').check()
+    assert cold.join('2020', '07', 'old.mp3.levels').check()
+    stats = manager.status()
+    assert stats['actions']['moved'] == 1 and stats['actions']['deleted'] == 2
+    assert stats['bytes'] == 305 and stats['cold_bytes'] == 105
+    assert manager.apply() == 0
+
+
+def test_refuses_without_space(tmpdir, monkeypatch):
+    monkeypatch.setattr(retention, 'free_bytes', lambda path: 1000 * 1000 * 1000)
+    manager = RetentionManager(str(tmpdir), min_free=500 * 1000 * 1000)
+    manager.bytes_per_second = 16000
+    assert manager.has_space(str(tmpdir), 3600)
+    assert not manager.has_space(str(tmpdir), 10 * 3600)
+    assert manager.status()['actions']['refused'] == 1
+    manager.observe(32000 * 3600, 3600)
+    assert manager.bytes_per_second == 0.8 * 16000 + 0.2 * 32000
+
+
+def test_policies_stay_in_the_recordings_trees(tmpdir):
+    main, partner, cold = tmpdir.join('main'), tmpdir.join('partner'), tmpdir.join('cold')
+    write(main.join('2020', 'a.mp3'), 100, age=8 * DAY)
+    write(partner.join('2020', 'a.mp3'), 100, age=8 * DAY)
+    other = write(tmpdir.join('other', 'old.mp3'), 100, age=8 * DAY)
+    manager = RetentionManager([str(main), str(partner)], hot_days=7, cold_dir=str(cold))
+    manager.scan()
+    manager.add(other) # e.g. a file the API was asked about
+    assert manager.apply() == 2
+    assert cold.join('main', '2020', 'a.mp3').check() and cold.join('partner', '2020', 'a.mp3').check()
+    assert os.path.exists(other)
+
+
+def test_transcoded_file_keeps_its_age(tmpdir):
+    root, cold = tmpdir.join('hot'), tmpdir.join('cold')
+    old = write(root.join('2020', 'old.mp3'), 100, age=8 * DAY)
+    mtime = os.path.getmtime(old)
+    manager = RetentionManager(str(root), hot_days=7, cold_dir=str(cold), cold_days=30, transcode_kbps=64)
+    manager.transcode = lambda path, target: open(target, 'wb').write(b'y' * 50) # instead of ffmpeg
+    manager.scan()
+    assert manager.apply() == 1
+    target = str(cold.join('2020', 'old.mp3'))
+    assert os.path.getmtime(target) == mtime and os.path.getmtime(target + '.sha256') == mtime
+    assert manager.files[target] == [50, mtime]
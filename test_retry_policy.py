@@ -0,0 +1,96 @@
+import pytest
+
+from retry_policy import RetryPolicy, CircuitBreaker, CircuitOpen, RetryExecutor
+
+
+class Flaky(object):
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise IOError("down")
+        return 'ok'
+
+
+def test_backoff_grows_and_is_capped():
+    policy = RetryPolicy(base=1, max_delay=5, jitter=False)
+    assert [policy.delay(i) for i in range(1, 6)] == [1, 2, 4, 5, 5]
+    jittered = RetryPolicy(base=1, max_delay=5)
+    assert all(0 <= jittered.delay(3) <= 4 for _ in range(100))
+
+
+def test_retries_until_success():
+    sleeps = []
+    fn = Flaky(2)
+    assert RetryPolicy(attempts=3, jitter=False).call(fn, sleep=sleeps.append) == 'ok'
+    assert fn.calls == 3
+    assert sleeps == [1, 2]
+
+
+def test_gives_up_after_attempts_and_deadline():
+    with pytest.raises(IOError):
+        RetryPolicy(attempts=2).call(Flaky(5), sleep=lambda s: None)
+    fn = Flaky(5)
+    with pytest.raises(IOError):
+        RetryPolicy(attempts=10, base=10, deadline=15, jitter=False).call(fn, sleep=lambda s: None)
+    assert fn.calls == 2 # waiting 10 + 20 seconds would end after the deadline
+
+
+def test_breaker_opens_and_half_opens():
+    now = [0]
+    breaker = CircuitBreaker('update_source_status', failures=2, reset=60, clock=lambda: now[0])
+    with pytest.raises(CircuitOpen):
+        RetryPolicy(attempts=5, jitter=False).call(Flaky(5), breaker=breaker, sleep=lambda s: None)
+    assert breaker.state == 'open'
+    now[0] = 61
+    assert breaker.state == 'half-open'
+    assert RetryPolicy().call(Flaky(0), breaker=breaker) == 'ok'
+    assert breaker.state == 'closed'
+
+
+def test_half_open_breaker_lets_one_trial_call_through():
+    now = [0]
+    breaker = CircuitBreaker('update_source_status', failures=1, reset=60, clock=lambda: now[0])
+    breaker.failure()
+    assert not breaker.allow()
+    now[0] = 60
+    assert breaker.allow()
+    assert not breaker.allow() # while the trial runs
+    breaker.failure()
+    assert breaker.state == 'open' and not breaker.allow()
+    now[0] = 120
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_executor_returns_handle_immediately():
+    executor = RetryExecutor()
+    handle = executor.submit('get_bootstrap_info', Flaky(0))
+    assert handle.done.wait(5)
+    assert executor.get(handle.id).to_dict()['state'] == 'succeeded'
+    assert handle.result == 'ok'
+    assert executor.status()['breakers']['get_bootstrap_info']['state'] == 'closed'
+
+
+def test_long_attempt_is_retried_without_deadline():
+    now = [0]
+    calls = []
+
+    def upload():
+        now[0] += 600 # the upload of a long recording
+        calls.append(now[0])
+        if len(calls) == 1:
+            raise IOError("connection reset")
+        return 'ok'
+
+    with pytest.raises(IOError):
+        RetryPolicy(attempts=3, jitter=False).call(upload, sleep=lambda s: None, clock=lambda: now[0])
+    del calls[:]
+    assert RetryPolicy(attempts=3, jitter=False, deadline=None).call(upload, sleep=lambda s: None,
+                                                                    clock=lambda: now[0]) == 'ok'
+    assert len(calls) == 2
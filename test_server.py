@@ -0,0 +1,63 @@
+import threading
+import time
+
+import requests
+
+from loadtest import run
+from server import PooledWSGIServer
+
+
+def test_pooled_server_bounds_concurrent_requests():
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def app(environ, start_response):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return [b'{}']
+
+    server = PooledWSGIServer('localhost', 0, app, threads=2, timeout=5)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        url = 'http://localhost:%i/status-summary/' % server.server_address[1]
+        result = run(url, clients=6, seconds=0.5)
+        assert result['requests'] > 0 and result['errors'] == 0
+        assert peak[0] == 2
+        assert requests.get(url).status_code == 200
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def test_open_stream_ends_on_close():
+    from status_stream import StatusBroadcaster
+    broadcaster = StatusBroadcaster()
+
+    def app(environ, start_response):
+        # like /status-stream/
+        start_response('200 OK', [('Content-Type', 'text/event-stream')])
+
+        def generate():
+            version = broadcaster.version
+            while not broadcaster.closed:
+                yield b'event: heartbeat\n\n'
+                version = broadcaster.wait(version, timeout=1)
+        return generate()
+
+    server = PooledWSGIServer('localhost', 0, app, threads=2, timeout=5)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    response = requests.get('http://localhost:%i/status-stream/' % server.server_address[1], stream=True, timeout=5)
+    assert response.raw.read(5) == b'event'
+    server.shutdown()
+    thread.join()
+    broadcaster.close()
+    started = time.time()
+    server.executor.shutdown(wait=True) # what the interpreter does at exit
+    assert time.time() - started < 2
+    response.close()
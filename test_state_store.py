@@ -0,0 +1,48 @@
+import sqlite3
+import time
+
+from state_store import StateStore
+
+
+def test_broadcasts_survive_reopening(tmpdir):
+    path = str(tmpdir.join('state.db'))
+    store = StateStore(path)
+    store.save_broadcast(1, {'instance_id': 1, 'name': 'past'}, 'Europe/Berlin', time.time() - 10)
+    store.save_broadcast(2, {'instance_id': 2, 'name': 'upcoming'}, 'Europe/Berlin', time.time() + 3600)
+    store.recording_started(2, 'rec_incomplete.mp3', 'upcoming', 1000.0)
+
+    reopened = StateStore(path)
+    assert reopened.broadcasts() == [({'instance_id': 2, 'name': 'upcoming'}, 'Europe/Berlin')]
+    assert reopened.recordings() == {2: {'filename': 'rec_incomplete.mp3', 'name': 'upcoming', 'started': 1000.0}}
+    reopened.recording_stopped(2)
+    assert reopened.recordings() == {}
+
+
+def test_recordings_per_stream(tmpdir):
+    store = StateStore(str(tmpdir.join('state.db')))
+    store.recording_started(2, 'main_incomplete.mp3', 'show', 1000.0, stream='main')
+    store.recording_started(2, 'backup_incomplete.mp3', 'show', 1000.5, stream='backup')
+    assert store.recordings() == {}
+    assert store.recordings('backup') == {2: {'filename': 'backup_incomplete.mp3', 'name': 'show', 'started': 1000.5}}
+    store.recording_stopped(2)
+    assert store.recordings('main') == {}
+
+
+def test_migrates_recordings_of_one_stream(tmpdir):
+    path = str(tmpdir.join('state.db'))
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE recordings (instance_id INTEGER PRIMARY KEY, filename TEXT NOT NULL, name TEXT, started REAL NOT NULL)")
+    db.execute("INSERT INTO recordings VALUES (2, 'rec_incomplete.mp3', 'show', 1000.0)")
+    db.commit()
+    db.close()
+    assert StateStore(path).recordings() == {2: {'filename': 'rec_incomplete.mp3', 'name': 'show', 'started': 1000.0}}
+
+
+def test_restarted_recording_is_restored_from_its_current_file(tmpdir):
+    store = StateStore(str(tmpdir.join('state.db')))
+    store.recording_started(42, '/rec/show_incomplete.mp3', 'show', 1000.0)
+    # the watchdog restarted the stalled recording, the first file was finalized
+    store.recording_moved('/rec/show_incomplete.mp3', '/rec/show2_incomplete.mp3', 1100.0)
+
+    restored = StateStore(str(tmpdir.join('state.db'))).recordings()
+    assert restored == {42: {'filename': '/rec/show2_incomplete.mp3', 'name': 'show', 'started': 1100.0}}
@@ -0,0 +1,59 @@
+import threading
+import time
+
+from status_stream import StatusBroadcaster, SharedSummary, WaitSlots, format_sse
+
+
+def test_wait_returns_on_publish():
+    broadcaster = StatusBroadcaster()
+    version = broadcaster.version
+    threading.Timer(0.1, broadcaster.publish, args=('recorder', {'action': 'start'})).start()
+    started = time.time()
+    assert broadcaster.wait(version, timeout=5) == version + 1
+    assert time.time() - started < 5
+    assert broadcaster.events_since(version)[0]['event'] == 'recorder'
+
+
+def test_wait_times_out_without_changes():
+    broadcaster = StatusBroadcaster()
+    assert broadcaster.wait(broadcaster.version, timeout=0.05) == 0
+
+
+def test_format_sse():
+    assert format_sse('heartbeat', '{"status": 0}', id=3) == 'event: heartbeat\nid: 3\ndata: {"status": 0}\n\n'
+
+
+def test_close_wakes_waiting_streams():
+    broadcaster = StatusBroadcaster()
+    threading.Timer(0.1, broadcaster.close).start()
+    started = time.time()
+    broadcaster.wait(broadcaster.version, timeout=5)
+    assert time.time() - started < 5
+    assert broadcaster.closed
+    started = time.time()
+    broadcaster.wait(broadcaster.version, timeout=5) # returns at once after close
+    assert time.time() - started < 1
+
+
+def test_shared_summary_is_computed_once_per_version():
+    broadcaster = StatusBroadcaster()
+    now = [1000.0]
+    shared = SharedSummary(lambda: {'version': broadcaster.version}, lambda summary: str(summary), broadcaster,
+                           max_age=5, clock=lambda: now[0])
+    for client in range(10):
+        assert shared.get() == (0, {'version': 0}, "{'version': 0}")
+    assert shared.computed == 1
+    broadcaster.publish('recorder')
+    assert shared.get()[1] == {'version': 1}
+    assert shared.computed == 2
+    now[0] += 5
+    shared.get()
+    assert shared.computed == 3
+
+
+def test_wait_slots_refuse_above_limit():
+    slots = WaitSlots(limit=2)
+    assert slots.acquire() and slots.acquire()
+    assert not slots.acquire()
+    slots.release()
+    assert slots.acquire()
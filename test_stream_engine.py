@@ -0,0 +1,86 @@
+import threading
+import time
+
+from ring_buffer import RingBuffer
+from stream_engine import StreamCaptureEngine
+from test_mp3 import frames, FRAME_LENGTH
+
+
+def test_cut_on_frame_boundary_without_losing_bytes(tmpdir):
+    first = str(tmpdir.join('first.mp3'))
+    second = str(tmpdir.join('second.mp3'))
+    engine = StreamCaptureEngine('http://localhost/stream', first)
+    data = b'garbage' + frames(10)
+    chunks = [data[i:i + 1000] for i in range(0, len(data), 1000)]
+
+    engine._write(chunks[0], 0)
+    cut = threading.Thread(target=engine.cut, args=(second,))
+    cut.start()
+    while engine._cut_filename is None:
+        time.sleep(0.001)
+    for chunk in chunks[1:]:
+        engine._write(chunk, 0)
+    cut.join()
+    engine._close()
+
+    first_bytes = open(first, 'rb').read()
+    second_bytes = open(second, 'rb').read()
+    assert len(first_bytes) % FRAME_LENGTH == 0
+    assert first_bytes + second_bytes == frames(10)
+
+
+def test_retroactive_cut_moves_bytes_to_new_file(tmpdir):
+    first = str(tmpdir.join('first.mp3'))
+    second = str(tmpdir.join('second.mp3'))
+    engine = StreamCaptureEngine('http://localhost/stream', first)
+    ring = RingBuffer(capacity=4096)
+    ring.attach(engine)
+    data = frames(10)
+    chunks = [data[i:i + 1000] for i in range(0, len(data), 1000)]
+    for i, chunk in enumerate(chunks[:3]):
+        engine._write(chunk, 100 + i)
+
+    start = ring.offset_at(101)
+    engine.request_cut(second, start=start, history=ring)
+    for chunk in chunks[3:]:
+        engine._write(chunk, 200)
+    engine._close()
+
+    first_bytes = open(first, 'rb').read()
+    assert len(first_bytes) == start
+    assert first_bytes + open(second, 'rb').read() == data
+
+
+def test_warm_standby_starts_file_at_commit(tmpdir):
+    path = str(tmpdir.join('show.mp3'))
+    engine = StreamCaptureEngine('http://localhost/stream', path, commit_at=100.0)
+    received = []
+    engine.taps.append(lambda data, timestamp, boundaries: received.append(timestamp))
+    data = frames(10)
+    chunks = [data[i:i + FRAME_LENGTH] for i in range(0, len(data), FRAME_LENGTH)]
+    for i, chunk in enumerate(chunks):
+        engine._write(chunk, 98.0 + i * 0.5)
+    engine._close()
+
+    # chunks before the commit are dropped, also for the taps
+    assert open(path, 'rb').read() == b''.join(chunks[4:])
+    assert received[0] == 100.0
+    assert engine.wait_committed(0) == 0.0
+
+
+def test_reconnect_continues_file_with_next_frame(tmpdir):
+    path = str(tmpdir.join('show.mp3'))
+    engine = StreamCaptureEngine('http://localhost/stream', path)
+    data = frames(10)
+    engine._write(data[:5 * FRAME_LENGTH], 100.0)
+
+    # the new connection starts in the middle of a frame
+    engine.stalled = 100.0
+    engine._resync = True
+    engine._write(data[100:FRAME_LENGTH], 103.0)
+    engine._write(data[:5 * FRAME_LENGTH], 104.0)
+    engine._close()
+
+    assert open(path, 'rb').read() == data
+    assert engine.bytes_received == len(data)
+    assert engine.lost_seconds == 4.0 and engine.stalled is None
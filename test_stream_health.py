@@ -0,0 +1,88 @@
+import stream_health
+from stream_health import Watchdog
+
+
+class FakeRecorder(object):
+
+    def __init__(self, path):
+        self._filename = self.filename = path
+        self.name = 'show'
+        self.metadata = {}
+        self.process = object() # like streamripper, no byte counters
+        self.restarts = 0
+        self.is_running = True
+
+    def running(self):
+        return self.is_running
+
+    def restart(self, reason, name=None, metadata=None, expected_filename=None):
+        if expected_filename is not None and (not self.is_running or self._filename != expected_filename):
+            return False
+        self.restarts += 1
+        self._filename = self.filename = '%s.%i' % (self.filename.split('.')[0], self.restarts)
+        open(self._filename, 'wb').close()
+        return True
+
+
+def test_restarts_stalled_recording_with_backoff(tmpdir):
+    now = [1000.0]
+    recorder = FakeRecorder(str(tmpdir.join('show')))
+    open(recorder._filename, 'wb').close()
+    watchdog = Watchdog(lambda: [recorder], stall_seconds=5, grace_seconds=5, clock=lambda: now[0])
+
+    def tick(seconds, grow=0):
+        for _ in range(seconds):
+            now[0] += 1
+            if grow:
+                with open(recorder._filename, 'ab') as f:
+                    f.write(b'x' * grow)
+            watchdog.check()
+
+    watchdog.check()
+    tick(10, grow=16000)
+    assert recorder.restarts == 0
+    assert watchdog.status(recorder)['bytes_per_second'] == 16000
+
+    tick(5)
+    assert recorder.restarts == 1
+    # the new file does not grow either, it is restarted again and the backoff doubles
+    tick(5)
+    assert recorder.restarts == 2
+    tick(5)
+    assert recorder.restarts == 3
+    assert watchdog.health[recorder].backoff == stream_health.SECONDS_BACKOFF * 8
+
+    tick(1, grow=16000)
+    status = watchdog.status(recorder)
+    assert status['reconnects'] == 3 and status['stalled'] == 0
+    assert status['lost_seconds'] == 16
+
+
+def test_new_file_gets_grace_for_first_data(tmpdir):
+    now = [1000.0]
+    recorder = FakeRecorder(str(tmpdir.join('show')))
+    open(recorder._filename, 'wb').close()
+    watchdog = Watchdog(lambda: [recorder], stall_seconds=5, grace_seconds=15, clock=lambda: now[0])
+    watchdog.check()
+    for _ in range(14):
+        now[0] += 1
+        watchdog.check()
+    assert recorder.restarts == 0 # slow to connect
+    now[0] += 1
+    watchdog.check()
+    assert recorder.restarts == 1
+
+
+def test_no_restart_of_stopped_recording(tmpdir):
+    now = [1000.0]
+    recorder = FakeRecorder(str(tmpdir.join('show')))
+    open(recorder._filename, 'wb').close()
+    watchdog = Watchdog(lambda: [recorder], stall_seconds=5, grace_seconds=5, clock=lambda: now[0])
+    watchdog.check()
+    now[0] += 5
+    # the scheduler stops the recording between the check finding it running and the restart
+    recorder.running = lambda: True
+    recorder.is_running = False
+    watchdog.check()
+    assert recorder.restarts == 0
+    assert watchdog.health[recorder].reconnects == 0
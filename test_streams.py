@@ -0,0 +1,74 @@
+import pytest
+
+from streams import load_config, RecorderGroup
+
+CONFIG = """
+[main]
+url = http://stream.example.org:8000/live
+filename = /media/recordings/main/%Y/%m/%d/radio-%station_%Y-%m-%d-%H-%M-%S_%label.mp3
+
+[partner]
+url = http://partner.example.org/stream.mp3
+filename = /media/recordings/partner/%station_%Y-%m-%d-%H-%M-%S_%label.mp3
+schedule = no
+"""
+
+
+class FakeRecorder(object):
+
+    def __init__(self, lateness=None, refusal=None):
+        self.lateness = lateness
+        self.refusal = refusal
+        self.state = 'idle'
+
+    def start(self, name=None, metadata=None, duration=None):
+        if self.refusal:
+            return False
+        self.state = 'running'
+        return True
+
+    def stop(self):
+        self.state = 'idle'
+
+    def running(self):
+        return self.state != 'idle'
+
+    def standby(self):
+        return self.state == 'standby'
+
+    def commit(self):
+        self.state = 'running'
+        return self.lateness
+
+
+def test_load_config(tmpdir):
+    path = tmpdir.join('streams.conf')
+    path.write(CONFIG)
+    main, partner = load_config(str(path))
+    assert (main.id, main.url, main.schedule) == ('main', 'http://stream.example.org:8000/live', True)
+    assert main.filename.endswith('%Y-%m-%d-%H-%M-%S_%label.mp3')
+    assert (partner.id, partner.schedule) == ('partner', False)
+
+    path.write(CONFIG.replace('/partner/', '/main/%Y/%m/%d/radio-'))
+    with pytest.raises(ValueError):
+        load_config(str(path))
+
+
+def test_group_commits_all_prepared_recorders():
+    main, backup = FakeRecorder(lateness=0.02), FakeRecorder(lateness=0.05)
+    group = RecorderGroup([('main', main), ('backup', backup)])
+    main.state = backup.state = 'standby'
+    assert group.standby()
+    assert group.commit() == 0.05
+    assert group.running() and not group.standby()
+    assert [id for id, recorder in group.members()] == ['main', 'backup']
+    group.stop()
+    assert not main.running() and not backup.running()
+
+
+def test_group_start_reports_refused_stream():
+    main, partner = FakeRecorder(), FakeRecorder(refusal=(507, "Not enough disk space."))
+    group = RecorderGroup([('main', main), ('partner', partner)])
+    assert not group.start()
+    assert main.running() # the other streams record anyway
+    assert group.refusal == (507, "Not enough disk space.")
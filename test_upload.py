@@ -0,0 +1,53 @@
+import time
+
+from upload import MultipartStream, LiveUpload
+
+
+def test_length_matches_body(tmpdir):
+    path = tmpdir.join('rec.mp3')
+    path.write_binary(b'a' * 100000)
+    stream = MultipartStream(str(path), prefix=b'ID3', chunk_size=4096)
+    body = b''.join(stream)
+    assert len(body) == stream.len == stream.bytes_sent
+    assert body.startswith(('--%s\r\n' % stream.boundary).encode('ascii'))
+    assert b'filename="rec.mp3"' in body
+    assert b'\r\n\r\nID3' + b'a' * 100000 + b'\r\n--' in body
+    # a retry sends the same body again
+    assert b''.join(stream) == body
+
+
+def test_live_upload_follows_the_growing_file(tmpdir):
+    path = tmpdir.join('rec.mp3')
+    path.write_binary(b'')
+    received = []
+
+    def upload(stream):
+        received.append(b''.join(stream))
+        return {'id': 1}
+
+    live = LiveUpload(str(path), upload)
+    assert not hasattr(live.stream, 'len') # sent chunked
+    live.start()
+    with open(str(path), 'ab') as f:
+        for i in range(5):
+            f.write(b'x' * 1000)
+            f.flush()
+            time.sleep(0.05)
+    assert live.status()['recording']
+    assert live.finish(timeout=5)
+    assert live.response == {'id': 1}
+    assert b'x' * 5000 + b'\r\n--' in received[0]
+    assert live.status()['bytes_sent'] == len(received[0])
+
+
+def test_failed_live_upload_reports_error(tmpdir):
+    path = tmpdir.join('rec.mp3')
+    path.write_binary(b'x')
+
+    def upload(stream):
+        raise IOError("Server is down")
+
+    live = LiveUpload(str(path), upload)
+    live.start()
+    assert not live.finish(timeout=5)
+    assert live.error == "Server is down"
@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+import time
+import uuid
+
+# Uploads of recordings as a streamed multipart/form-data body: the file is read in chunks
+# while the request is sent, so memory use does not depend on the length of the recording.
+# A file that is still being recorded can be followed, so its upload ends seconds after the recording.
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+SECONDS_FOLLOW_POLL = 0.5 # wait for new data of a followed file
+SECONDS_FOLLOW_IDLE = 120 # give up on a followed file that stopped growing and was not finished
+
+
+class MultipartStream(object):
+    """
+    Iterable multipart body with a single file field. Every iteration reads the file again,
+    so a retry re-sends it without holding it in memory. When follow (an Event) is passed,
+    reading continues as the file grows until follow is set, and the length is unknown
+    (requests sends it with chunked transfer encoding).
+    """
+
+    def __init__(self, path, field='file', filename=None, follow=None, prefix=b'', skip=0, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.follow = follow
+        self.prefix = prefix # e.g. an ID3 tag in front of the audio
+        self.skip = skip # bytes at the start of the file that are not sent
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=%s' % self.boundary
+        filename = (filename or os.path.basename(path)).replace('"', '')
+        self.head = ('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                     'Content-Type: application/octet-stream\r\n\r\n' % (self.boundary, field, filename)).encode('utf-8')
+        self.tail = ('\r\n--%s--\r\n' % self.boundary).encode('ascii')
+        self.bytes_sent = 0
+        if follow is None:
+            # requests only sets Content-Length for iterables with a len attribute
+            self.len = len(self.head) + len(self.prefix) + os.path.getsize(path) - skip + len(self.tail)
+
+    def __iter__(self):
+        self.bytes_sent = 0
+        for data in self._parts():
+            self.bytes_sent += len(data)
+            yield data
+
+    def _parts(self):
+        yield self.head
+        if self.prefix:
+            yield self.prefix
+        with open(self.path, 'rb') as f:
+            f.seek(self.skip)
+            reader = follow_file(f, self.follow, self.chunk_size) if self.follow is not None else \
+                iter(lambda: f.read(self.chunk_size), b'')
+            for chunk in reader:
+                yield chunk
+        yield self.tail
+
+
+def follow_file(f, done, chunk_size=CHUNK_SIZE, poll=SECONDS_FOLLOW_POLL, idle=SECONDS_FOLLOW_IDLE):
+    """Reads f as it grows, until done is set and everything was read."""
+    last_data = time.time()
+    while True:
+        # check before reading, so nothing written before done was set is missed
+        finished = done.is_set()
+        chunk = f.read(chunk_size)
+        if chunk:
+            last_data = time.time()
+            yield chunk
+        elif finished:
+            return
+        elif time.time() - last_data > idle:
+            raise IOError("%s did not grow for %i seconds." % (f.name, idle))
+        else:
+            done.wait(poll)
+
+
+class LiveUpload(threading.Thread):
+    """Uploads a recording while it is written. Call finish() when the file is closed."""
+
+    def __init__(self, path, upload, prefix=b'', skip=0):
+        super(LiveUpload, self).__init__(name='upload-%s' % os.path.basename(path))
+        self.daemon = True
+        self.path = path
+        self.upload = upload # function of a MultipartStream, e.g. AirtimeApiClient.upload_recorded_show_stream
+        self.done = threading.Event()
+        self.stream = MultipartStream(path, follow=self.done, prefix=prefix, skip=skip)
+        self.started = None
+        self.finished = None
+        self.response = None
+        self.error = None
+
+    def run(self):
+        self.started = time.time()
+        try:
+            self.response = self.upload(self.stream)
+        except Exception as e:
+            logger.error("Live upload of %s failed: %s" % (self.path, e))
+            self.error = str(e) or e.__class__.__name__
+        finally:
+            self.finished = time.time()
+
+    def finish(self, timeout=None):
+        """Marks the file as complete and waits for the upload. Returns True if it succeeded."""
+        self.done.set()
+        self.join(timeout)
+        return self.finished is not None and self.error is None
+
+    def status(self):
+        return {'path': self.path, 'bytes_sent': self.stream.bytes_sent, 'recording': not self.done.is_set(),
+                'started': self.started, 'finished': self.finished, 'error': self.error}
+
+
+live_uploads = {} # by path of the file being recorded